@@ -1,72 +1,392 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_from_directory, abort, get_template_attribute, stream_with_context
+from markupsafe import Markup
+from werkzeug.exceptions import NotFound
 from functools import wraps
 import uuid
-from werkzeug.utils import secure_filename
 import os
-import requests
+import io
 import json
 import hashlib
 import hmac
+import time
+import click
+from types import SimpleNamespace
 from config import Config
 from config import Config
-from models import db, Perfume, Order, SiteSettings
+from models import db, Perfume, Order, SiteSettings, WebhookEvent
+from cache import VersionedCache, VersionStamp, CachedValue, ResponseCache
+import migrations
+import catalog
+import catalog_io
+import search
+import notes
+from paystack import PaystackClient, PaystackError, PaystackUnavailable
+import webhook_queue
+import orders
+import sales
+import order_queries
+import order_export
+import order_items
+import inventory
+from images import ImagePipeline, ImageError
+import storage
+import assets
+import metrics
+import database
+from cart_store import create_cart_store, parse_ops, CartOpError, CartVersionConflict
+import pricing
+from pricing import PriceBook, UnavailableItems
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
-# Initialize database
+# Initialize database: pool sizing, SQLite WAL and the optional read replica
+database.configure(app.config)
 db.init_app(app)
+database.init_app(app, db)
+
+# Pooled Paystack client, shared by all requests in this worker
+paystack = PaystackClient.from_config(app.config)
+
+# Webhook queue workers start with the first webhook this process receives
+webhook_workers = webhook_queue.WebhookWorkerPool.from_config(app)
+
+# Gives back stock held by checkouts that were never paid; starts with the first checkout
+reservation_sweeper = inventory.ReservationSweeper.from_config(app)
+
+# Latency, SQL and template timings per endpoint, served at /admin/metrics
+request_metrics = metrics.RequestMetrics.from_config(app.config)
+request_metrics.init_app(app)
+
+# Carts live server-side; the session cookie only holds the cart id
+cart_store = create_cart_store(app.config)
 
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Content-addressed uploads on local disk or S3; variants are encoded in worker processes
+upload_storage = storage.create_storage(app.config)
+image_pipeline = ImagePipeline.from_config(app.config, upload_storage)
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
 def save_uploaded_file(file):
+    """Run an upload through the image pipeline; returns its manifest, or None if rejected.
+    The caller takes a reference with storage.acquire() on the URL it saves."""
     if file and allowed_file(file.filename):
-        # 1. Secure the filename
-        original_filename = secure_filename(file.filename)
-        
-        # 2. Extract extension
-        file_ext = original_filename.rsplit('.', 1)[1].lower()
-        
-        # 3. Generate unique UUID filename
-        unique_filename = f"{uuid.uuid4().hex}.{file_ext}"
-        
-        # 4. Create full path
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        
-        # 5. Save file
-        file.save(file_path)
-        
-        # 6. Return relative URL for database
-        # In production this might need to be served via nginx or a dedicated route
-        # For this setup we use Flask static serving
-        return f"/static/uploads/{unique_filename}"
-
-    return None
-
-def delete_old_file(file_url):
-    if not file_url:
-        return
-    
-    # Check if it's a local static file
-    if file_url.startswith('/static/uploads/'):
-        filename = file_url.replace('/static/uploads/', '')
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
+        digest, data = storage.read_upload(file.stream)
         try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                print(f"Deleted old file: {file_path}")
-        except Exception as e:
-            print(f"Error deleting file {file_path}: {e}")
+            return image_pipeline.store(digest, data)
+        except ImageError as e:
+            app.logger.warning("Rejected upload %s: %s", file.filename, e)
+    return None
 
 # Create tables on first request
 with app.app_context():
     db.create_all()
+    # create_all skips new columns and indexes on tables that already exist
+    migrations.add_missing_columns(db.engine, db.metadata)
+    migrations.create_missing_indexes(db.engine, db.metadata)
+    search.ensure_search_index(db.engine)
+
+
+def upgrade_data():
+    """One-off data backfills, each skipped once done.
+
+    They aren't locked against each other, so they run once per deploy
+    (`flask upgrade-db`, the Procfile release step) rather than in every
+    worker at import.
+    """
+    # From the free-text notes column
+    if notes.needs_backfill():
+        notes.backfill_notes()
+    if sales.needs_rebuild():
+        sales.rebuild()
+    if orders.needs_summary_backfill():
+        orders.backfill_summary_columns()
+    if order_items.needs_rebuild():
+        order_items.rebuild()
+    if storage.needs_recount():
+        storage.recount()
+        db.session.commit()
+
+if assets.needs_build(app.static_folder, app.config['ASSET_BUILD_DIR']):
+    assets.build(app.static_folder, app.config['ASSET_BUILD_DIR'])
+asset_manifest = assets.load_manifest(app.config['ASSET_BUILD_DIR'])
+
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Run pending data backfills (notes, stats, order summaries and line items, image refcounts)"""
+    upgrade_data()
+    print("Database is up to date")
+
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute dashboard aggregates from the orders table"""
+    count = sales.rebuild()
+    print(f"Rebuilt sales aggregates from {count} orders")
+
+
+@app.cli.command('rebuild-order-items')
+def rebuild_order_items_command():
+    """Refill the order_items table from each order's items JSON"""
+    count = order_items.rebuild()
+    print(f"Rebuilt line items for {count} orders")
+
+
+@app.cli.command('release-reservations')
+def release_reservations_command():
+    """Give back the stock held by expired, unpaid checkouts"""
+    count = reservation_sweeper.sweep()
+    print(f"Released {count} expired stock holds")
+
+
+@app.cli.command('webhooks-work')
+@click.option('--threads', default=4, show_default=True)
+def webhooks_work_command(threads):
+    """Drain the webhook queue until interrupted"""
+    pool = webhook_queue.WebhookWorkerPool.from_config(app, threads=threads)
+    pool.start()
+    print(f"Processing webhooks with {threads} threads, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pool.stop()
+
+
+@app.cli.command('webhooks-replay')
+@click.argument('ids', nargs=-1, type=int)
+def webhooks_replay_command(ids):
+    """Requeue the given event ids, or every dead event"""
+    count = webhook_queue.replay(ids=list(ids) or None)
+    print(f"Requeued {count} webhook events")
+
+
+@app.cli.command('webhooks-stats')
+def webhooks_stats_command():
+    """Show webhook queue depth by status"""
+    for key, value in webhook_queue.queue_depth().items():
+        print(f"{key}: {value}")
+    for event in WebhookEvent.query.filter_by(status='dead').order_by(WebhookEvent.id).limit(20):
+        print(f"dead #{event.id} {event.event} {event.reference}: {(event.last_error or '').strip().splitlines()[-1:]}")
+
+
+@app.cli.command('purge-carts')
+def purge_carts_command():
+    """Delete carts idle for longer than CART_TTL"""
+    count = cart_store.purge_expired()
+    print(f"Purged {count} expired carts")
+
+
+@app.cli.command('gc-uploads')
+@click.option('--grace', default=3600, show_default=True, help='Seconds an unreferenced upload is kept')
+@click.option('--dry-run', is_flag=True, help='Report without deleting')
+def gc_uploads_command(grace, dry_run):
+    """Delete uploaded files that no perfume or setting points at"""
+    result = storage.collect_garbage(upload_storage, grace_seconds=grace, dry_run=dry_run)
+    verb = 'Would delete' if dry_run else 'Deleted'
+    print(f"Recounted {result['recounted']} blobs; {verb} {result['deleted_blobs']} blobs ({result['deleted_files']} files)")
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress static files into ASSET_BUILD_DIR"""
+    manifest = assets.build(app.static_folder, app.config['ASSET_BUILD_DIR'])
+    print(f"Built {len(manifest)} assets into {app.config['ASSET_BUILD_DIR']}")
+
+
+@app.cli.command('import-catalog')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(catalog_io.FORMATS), help='Default: from the file extension')
+def import_catalog_command(path, fmt):
+    """Upsert perfumes from a CSV or JSON Lines file, matched by SKU or name"""
+    try:
+        fmt = catalog_io.detect_format(path, fmt)
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            report = catalog_io.import_records(catalog_io.read_records(f, fmt))
+    except catalog_io.ImportFormatError as e:
+        raise click.ClickException(str(e))
+    finally:
+        catalog_cache.bump()
+    print(f"Inserted {report.inserted}, updated {report.updated}, failed {report.failed}")
+    for error in report.errors:
+        print(f"line {error['line']}: {error['error']}")
+
+
+@app.cli.command('export-catalog')
+@click.argument('output', type=click.File('w', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(catalog_io.FORMATS), help='Default: from the file extension')
+def export_catalog_command(output, fmt):
+    """Write every perfume to a CSV or JSON Lines file ('-' for stdout)"""
+    try:
+        fmt = catalog_io.detect_format(output.name, fmt)
+    except catalog_io.ImportFormatError as e:
+        raise click.ClickException(str(e))
+    for chunk in catalog_io.export_chunks(catalog_io.export_rows(db.session), fmt):
+        output.write(chunk)
+
+
+@app.cli.command('export-orders')
+@click.argument('output', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--format', 'fmt', type=click.Choice(catalog_io.FORMATS), help='Default: from the file extension')
+@click.option('--status', default='confirmed', show_default=True, help="An order status, or 'all'")
+@click.option('--date-from', help='YYYY-MM-DD, inclusive')
+@click.option('--date-to', help='YYYY-MM-DD, inclusive')
+def export_orders_command(output, fmt, status, date_from, date_to):
+    """Write one row per order line item to CSV or JSON Lines; a .gz name compresses it"""
+    compress = output.endswith('.gz')
+    try:
+        fmt = catalog_io.detect_format(output[:-3] if compress else output, fmt)
+        spec = order_export.parse_args({'status': status, 'date_from': date_from, 'date_to': date_to})
+    except (catalog_io.ImportFormatError, order_queries.OrderQueryError) as e:
+        raise click.ClickException(str(e))
+    chunks = catalog_io.export_chunks(order_export.export_rows(spec), fmt, fields=order_export.FIELDS)
+    with click.open_file(output, 'wb') as f:
+        for data in order_export.gzip_chunks(chunks) if compress else (chunk.encode('utf-8') for chunk in chunks):
+            f.write(data)
+
+
+@app.cli.command('backfill-notes')
+def backfill_notes_command():
+    """Relink all perfumes to normalized notes and recount facets"""
+    count = notes.backfill_notes()
+    print(f"Linked notes for {count} perfumes")
+
+
+# ============ CACHES ============
+def cache_stamp(name):
+    return VersionStamp(os.path.join(app.config['CACHE_STAMP_DIR'], name))
+
+
+# Serialized /api/perfumes bodies; admin perfume writes bump the version
+catalog_cache = VersionedCache(stamp=cache_stamp('catalog'))
+
+# Checkout prices; shares the catalog stamp, so perfume edits apply at once
+price_book = PriceBook(ttl=app.config['PRICE_CACHE_TTL'], stamp=cache_stamp('catalog'))
+
+
+# Server-rendered catalog HTML (product pages, featured and shop grids); same stamp as the
+# JSON cache, so the admin perfume endpoints that bump it clear these too
+fragment_cache = VersionedCache(max_entries=1024, stamp=cache_stamp('catalog'))
+
+# These caches outlive replica lag, so catalog reads stay on the primary just after a write
+database.replica.watch(cache_stamp('catalog'))
+
+
+def cached_fragment(key, builder):
+    """Markup for key, calling builder() for the HTML on a miss"""
+    body, _ = fragment_cache.get_or_build(key, lambda: str(builder()).encode('utf-8'))
+    return Markup(body.decode('utf-8'))
+
+
+# Whole storefront pages for anonymous visitors; catalog and settings writes clear it
+page_cache = ResponseCache(max_bytes=app.config['PAGE_CACHE_MAX_BYTES'],
+                           stamps=(cache_stamp('catalog'), cache_stamp('settings')))
+
+
+def cached_page(ttl_setting, vary=()):
+    """Serve a page from page_cache for ttl_setting seconds. Admins always get a fresh render.
+
+    Responses are cached per path, query string and the values of the `vary`
+    request headers; other responses (errors, or ones that vary on anything
+    else) pass through uncached.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            ttl = app.config[ttl_setting]
+            if ttl <= 0:
+                return view(*args, **kwargs)
+            if session.get('admin_logged_in'):
+                page_cache.bypass()
+                return view(*args, **kwargs)
+
+            key = (request.path, tuple(sorted(request.args.items(multi=True))),
+                   tuple(request.headers.get(header, '') for header in vary))
+            entry, version = page_cache.lookup(key)
+            status = 'HIT'
+            if entry is None:
+                status = 'MISS'
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200 or set(response.vary) - {'Cookie', *vary}:
+                    return response
+                body = response.get_data()
+                entry = (body, response.mimetype, hashlib.sha1(body).hexdigest()[:16])
+                page_cache.store(key, entry, len(body), ttl, version)
+
+            body, mimetype, etag = entry
+            response = app.response_class(body, mimetype=mimetype)
+            response.set_etag(etag)
+            response.cache_control.no_cache = True
+            # Admin sessions are served differently (fresh), so shared caches must key on the cookie
+            response.vary.update(['Cookie', *vary])
+            response.headers['X-Cache'] = status
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+
+def load_site_settings():
+    # Plain snapshot of the single settings row, safe to share between requests
+    settings = SiteSettings.query.first()
+    values = {}
+    for column in SiteSettings.__table__.columns:
+        value = getattr(settings, column.key) if settings else None
+        if value is None and column.default is not None:
+            value = column.default.arg
+        values[column.key] = value
+    return SimpleNamespace(**values)
+
+
+settings_cache = CachedValue(load_site_settings, stamp=cache_stamp('settings'))
+
+
+def cached_json_response(cache, key, builder):
+    body, etag = cache.get_or_build(key, lambda: app.json.dumps(builder()).encode('utf-8'))
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    # Browsers keep the body but must revalidate, which is answered with a 304
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+# ============ STATIC ASSETS ============
+@app.template_global()
+def asset_url(filename):
+    """Fingerprinted URL for a static file; plain /static in debug mode so edits show up"""
+    built_name = asset_manifest.get(filename)
+    if built_name is None or app.debug:
+        return url_for('static', filename=filename)
+    return url_for('built_asset', filename=built_name)
+
+
+@app.route('/assets/<path:filename>')
+def built_asset(filename):
+    if not assets.is_built_file(filename):
+        abort(404)
+    name, encoding = assets.negotiate(request.accept_encodings, app.config['ASSET_BUILD_DIR'], filename)
+    # Typed as the original file, whichever encoding is sent
+    response = send_from_directory(app.config['ASSET_BUILD_DIR'], name, mimetype=assets.content_type(filename),
+                                   max_age=assets.MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    # The name changes with the content, so the file never needs revalidating
+    response.cache_control.immutable = True
+    return response
+
+
+@app.after_request
+def cache_uploads(response):
+    # Upload names are content hashes (or one-off uuids), so they never change either
+    if request.endpoint == 'static' and request.view_args['filename'].startswith('uploads/') and response.status_code in (200, 304):
+        response.headers['Cache-Control'] = storage.IMMUTABLE
+    return response
 
 
 # ============ AUTH DECORATOR ============
@@ -82,30 +402,67 @@ def admin_required(f):
 # ============ CONTEXT PROCESSOR ============
 @app.context_processor
 def inject_settings():
-    settings = SiteSettings.query.first()
-    if not settings:
-        # Create default if avoids crashing on first run
-        settings = SiteSettings()
-        # We don't save it here to avoid race conditions/readonly DB issues, 
-        # but the object exists for variables.
-        # Ideally, it should be seeded.
-    return dict(site_settings=settings)
+    return dict(site_settings=settings_cache.get())
+
+
+@app.template_filter('price')
+def format_price(value):
+    # Matches Number.toLocaleString() in the storefront scripts: 1,250 or 1,250.5
+    return f'{value:,.2f}'.rstrip('0').rstrip('.')
 
 
 # ============ PUBLIC ROUTES ============
+# Same query the shop's "Load More" continues with (LIST_FIELDS / PAGE_SIZE in shop.html)
+LIST_FIELDS = 'name,price,compare_at_price,cloudinary_url,image_srcset,size,notes'
+FEATURED_ARGS = {'limit': '3', 'fields': LIST_FIELDS}
+SHOP_PAGE_ARGS = {'limit': '24', 'fields': LIST_FIELDS, 'sort': 'newest'}
+
+
+def product_macro(name):
+    return get_template_attribute('_product_macros.html', name)
+
+
 @app.route('/')
+@cached_page('PAGE_CACHE_TTL_INDEX')
 def index():
-    return render_template('index.html')
+    def build():
+        page = catalog.query_perfumes(catalog.parse_args(FEATURED_ARGS))
+        return product_macro('featured_grid')(page['items'])
+
+    return render_template('index.html', featured=cached_fragment(('featured',), build))
 
 
 @app.route('/shop')
+@cached_page('PAGE_CACHE_TTL_SHOP')
 def shop():
-    return render_template('shop.html')
+    def build():
+        page = catalog.query_perfumes(catalog.parse_args(SHOP_PAGE_ARGS))
+        return product_macro('catalog_grid')(page)
+
+    return render_template('shop.html', catalog_page=cached_fragment(('shop',), build))
 
 
 @app.route('/product/<int:product_id>')
+@cached_page('PAGE_CACHE_TTL_PRODUCT')
 def product_detail(product_id):
-    return render_template('product.html', product_id=product_id)
+    def build():
+        perfume = database.read_session().get(Perfume, product_id)
+        if perfume is None:
+            raise NotFound()  # Not cached: the id may be taken by the next perfume added
+        product = perfume.to_dict()
+        return app.json.dumps({
+            'name': product['name'],
+            'description': product['description'],
+            'html': str(product_macro('product_detail')(product)),
+        })
+
+    try:
+        body, _ = fragment_cache.get_or_build(('product', product_id), lambda: build().encode('utf-8'))
+    except NotFound:
+        return render_template('product.html', product=None), 404
+    product = json.loads(body)
+    product['html'] = Markup(product['html'])
+    return render_template('product.html', product=product)
 
 
 @app.route('/cart')
@@ -121,119 +478,219 @@ def checkout():
 # ============ API ROUTES ============
 @app.route('/api/perfumes', methods=['GET'])
 def get_perfumes():
-    perfumes = Perfume.query.order_by(Perfume.created_at.desc()).all()
-    return jsonify([p.to_dict() for p in perfumes])
+    try:
+        spec = catalog.parse_args(request.args)
+    except catalog.CatalogQueryError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def build():
+        return catalog.query_perfumes(spec)
+
+    try:
+        return cached_json_response(catalog_cache, catalog.spec_key(spec), build)
+    except catalog.CatalogQueryError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@app.route('/api/perfumes/search', methods=['GET'])
+def search_perfumes():
+    try:
+        spec = search.parse_args(request.args)
+    except search.SearchQueryError as e:
+        return jsonify({'error': str(e)}), 400
+
+    key = ('search',) + tuple(sorted(spec.items()))
+    return cached_json_response(catalog_cache, key, lambda: search.search_perfumes(spec))
+
+
+@app.route('/api/perfumes/facets', methods=['GET'])
+def get_perfume_facets():
+    return cached_json_response(catalog_cache, ('facets',), lambda: {'notes': notes.note_facets()})
 
 
 @app.route('/api/perfumes/<int:perfume_id>', methods=['GET'])
 def get_perfume(perfume_id):
-    perfume = Perfume.query.get_or_404(perfume_id)
+    perfume = database.read_session().get(Perfume, perfume_id)
+    if perfume is None:
+        abort(404)
     return jsonify(perfume.to_dict())
 
 
 # ============ CART SESSION MANAGEMENT ============
+def session_cart_id(create=False):
+    """Cart id from the session cookie; carts saved in the old cookie format move into the store"""
+    legacy = session.pop('cart', None)
+    session.pop('pending_customer_info', None)
+    session.pop('pending_items', None)
+    cart_id = session.get('cart_id')
+    if cart_id is None and (create or legacy):
+        cart_id = session['cart_id'] = uuid.uuid4().hex
+    if legacy:
+        try:
+            ops, _ = priced_ops(parse_ops([{**item, 'op': 'add'} for item in legacy]))
+            cart_store.apply(cart_id, ops)
+        except CartOpError:
+            pass
+    return cart_id
+
+
+def priced_ops(ops):
+    """Fill added items' name, price and image from the catalog.
+    Returns (ops, unknown perfume ids); ops for unknown ids are dropped."""
+    prices = price_book.lookup(op['id'] for op in ops if op['op'] == 'add')
+    unknown = [op['id'] for op in ops if op['op'] == 'add' and op['id'] not in prices]
+    result = []
+    for op in ops:
+        if op['op'] == 'add':
+            if op['id'] not in prices:
+                continue
+            entry = prices[op['id']]
+            op = {**op, 'name': entry['name'], 'price': float(entry['price']), 'image': entry['image']}
+        result.append(op)
+    return result, unknown
+
+
+def cart_items(cart_id):
+    return cart_store.snapshot(cart_id)[1] if cart_id else []
+
+
+def cart_etag(cart_id, version):
+    # The cart id is part of the tag so a new session never matches an old cart's version
+    return f'{cart_id or "none"}.{version}'
+
+
+def if_match_version(cart_id):
+    """Cart version named by If-Match; None when the header is absent or '*'"""
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    for tag in request.if_match:
+        tag_cart_id, _, version = tag.rpartition('.')
+        if tag_cart_id == (cart_id or 'none') and version.isdigit():
+            return int(version)
+    return -1  # Another cart's tag never matches
+
+
+def cart_response(cart_id, body=None, status=200):
+    """The cart, plus its version as an ETag. With body, items go under 'cart'."""
+    version, items = cart_store.snapshot(cart_id) if cart_id else (0, [])
+    response = jsonify(items if body is None else {**body, 'cart': items, 'version': version})
+    response.status_code = status
+    response.set_etag(cart_etag(cart_id, version))
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    return response
+
+
+def apply_cart_ops(ops, message):
+    try:
+        ops, unknown = priced_ops(parse_ops(ops))
+    except CartOpError as e:
+        return jsonify({'error': str(e)}), 400
+    if unknown:
+        return jsonify({'error': str(UnavailableItems(unknown))}), 400
+    
+    cart_id = session_cart_id(create=True)
+    try:
+        cart_store.apply(cart_id, ops, expected_version=if_match_version(cart_id))
+    except CartVersionConflict:
+        # Send the current cart so the client can redo its change on top of it
+        return cart_response(cart_id, {'error': 'Cart has changed'}, status=412)
+    return cart_response(cart_id, {'message': message})
+
+
 @app.route('/api/cart', methods=['GET'])
 def get_cart():
-    cart = session.get('cart', [])
-    return jsonify(cart)
+    return cart_response(session_cart_id()).make_conditional(request)
+
+
+@app.route('/api/cart/batch', methods=['POST'])
+def batch_cart():
+    data = request.json or {}
+    return apply_cart_ops(data.get('ops'), 'Cart updated')
 
 
 @app.route('/api/cart/add', methods=['POST'])
 def add_to_cart():
-    data = request.json
-    cart = session.get('cart', [])
-    
-    # Check if item already in cart
-    for item in cart:
-        if item['id'] == data['id']:
-            item['quantity'] += data.get('quantity', 1)
-            session['cart'] = cart
-            return jsonify({'message': 'Cart updated', 'cart': cart})
-    
-    # Add new item
-    cart.append({
-        'id': data['id'],
-        'name': data['name'],
-        'price': data['price'],
-        'image': data['image'],
-        'quantity': data.get('quantity', 1)
-    })
-    session['cart'] = cart
-    return jsonify({'message': 'Item added to cart', 'cart': cart})
+    return apply_cart_ops([{**request.json, 'op': 'add'}], 'Item added to cart')
 
 
 @app.route('/api/cart/update', methods=['POST'])
 def update_cart():
-    data = request.json
-    cart = session.get('cart', [])
-    
-    for item in cart:
-        if item['id'] == data['id']:
-            if data['quantity'] <= 0:
-                cart.remove(item)
-            else:
-                item['quantity'] = data['quantity']
-            break
-    
-    session['cart'] = cart
-    return jsonify({'message': 'Cart updated', 'cart': cart})
+    return apply_cart_ops([{**request.json, 'op': 'set'}], 'Cart updated')
 
 
 @app.route('/api/cart/remove', methods=['POST'])
 def remove_from_cart():
-    data = request.json
-    cart = session.get('cart', [])
-    cart = [item for item in cart if item['id'] != data['id']]
-    session['cart'] = cart
-    return jsonify({'message': 'Item removed', 'cart': cart})
+    return apply_cart_ops([{**request.json, 'op': 'remove'}], 'Item removed')
 
 
 @app.route('/api/cart/clear', methods=['POST'])
 def clear_cart():
-    session['cart'] = []
-    return jsonify({'message': 'Cart cleared', 'cart': []})
+    return apply_cart_ops([{'op': 'clear'}], 'Cart cleared')
 
 
 # ============ PAYSTACK INTEGRATION ============
 @app.route('/api/payment/initialize', methods=['POST'])
 def initialize_payment():
-    data = request.json
-    cart = session.get('cart', [])
+    data = request.get_json(silent=True) or {}
+    # Checked before anything is held, so a bad body can't tie up stock
+    customer_info = data.get('customer_info')
+    if not isinstance(customer_info, dict) or not isinstance(customer_info.get('email'), str) \
+            or not customer_info['email'].strip():
+        return jsonify({'error': 'customer_info with an email is required'}), 400
+    cart_id = session_cart_id()
+    cart = cart_items(cart_id)
     
     if not cart:
         return jsonify({'error': 'Cart is empty'}), 400
     
-    # Calculate total
-    total = sum(item['price'] * item['quantity'] for item in cart)
+    # Charge current catalog prices, not the ones saved with the cart
+    try:
+        quote = price_book.quote(cart)
+    except UnavailableItems as e:
+        return jsonify({'error': 'Some items are no longer available', 'unavailable': e.ids}), 400
+    items = pricing.order_items(quote)
     
-    # Store customer info in session temporarily
-    session['pending_customer_info'] = data['customer_info']
-    session['pending_items'] = cart
+    # Hold the units until the order is confirmed or the hold expires; a retried
+    # checkout from the same cart gives back its previous hold first
+    reference = uuid.uuid4().hex
+    previous_reference = cart_store.get_data(cart_id, 'pending_reference')
+    if previous_reference:
+        inventory.release(previous_reference)
+    try:
+        inventory.reserve(reference, [(item['id'], item['quantity']) for item in items], app.config['RESERVATION_TTL'])
+    except inventory.OutOfStock as e:
+        db.session.commit()  # Keep the release above
+        return jsonify({'error': 'Some items are out of stock', 'out_of_stock': e.ids}), 409
+    db.session.commit()
+    reservation_sweeper.start()
     
-    # Initialize Paystack transaction
-    headers = {
-        'Authorization': f"Bearer {app.config['PAYSTACK_SECRET_KEY']}",
-        'Content-Type': 'application/json'
-    }
+    # Keep customer info with the cart until payment completes
+    cart_store.set_data(cart_id, 'pending_customer_info', customer_info)
+    cart_store.set_data(cart_id, 'pending_items', items)
+    cart_store.set_data(cart_id, 'pending_reference', reference)
     
+    # Initialize Paystack transaction
     payload = {
-        'email': data['customer_info']['email'],
-        'amount': int(total * 100),  # Paystack uses kobo (cents)
+        'email': customer_info['email'],
+        'amount': pricing.to_subunits(quote['total']),  # Paystack uses kobo (cents)
+        'reference': reference,  # Ours, so the stock hold exists before Paystack knows the payment
         'callback_url': request.host_url.rstrip('/') + '/payment/callback',
         'currency': 'GHS',
         'metadata': {
-            'customer_info': data['customer_info'],
-            'items': cart
+            'customer_info': customer_info,
+            'items': items
         }
     }
     
-    response = requests.post(
-        'https://api.paystack.co/transaction/initialize',
-        headers=headers,
-        json=payload
-    )
-    
-    result = response.json()
+    try:
+        result = paystack.initialize_transaction(payload)
+    except PaystackUnavailable:
+        release_checkout(reference)
+        return jsonify({'error': 'Payment service is temporarily unavailable. Please try again shortly.'}), 503
+    except PaystackError:
+        release_checkout(reference)
+        return jsonify({'error': 'Payment initialization failed'}), 400
     
     if result.get('status'):
         return jsonify({
@@ -241,9 +698,16 @@ def initialize_payment():
             'reference': result['data']['reference']
         })
     else:
+        release_checkout(reference)
         return jsonify({'error': 'Payment initialization failed'}), 400
 
 
+def release_checkout(reference):
+    """Give back a checkout's stock hold once it can no longer be paid"""
+    inventory.release(reference)
+    db.session.commit()
+
+
 @app.route('/payment/callback')
 def payment_callback():
     reference = request.args.get('reference')
@@ -252,41 +716,29 @@ def payment_callback():
         return render_template('payment_result.html', success=False, message='No reference provided')
     
     # Verify transaction with Paystack
-    headers = {
-        'Authorization': f"Bearer {app.config['PAYSTACK_SECRET_KEY']}"
-    }
-    
-    response = requests.get(
-        f'https://api.paystack.co/transaction/verify/{reference}',
-        headers=headers
-    )
-    
-    result = response.json()
+    try:
+        result = paystack.verify_transaction(reference)
+    except PaystackUnavailable:
+        # The charge.success webhook still records the order once Paystack recovers
+        return render_template('payment_result.html', success=False,
+                               message='We could not confirm your payment yet. If you were charged, your order will be confirmed shortly.')
+    except PaystackError:
+        return render_template('payment_result.html', success=False, message='Payment verification failed')
     
     if result.get('status') and result['data']['status'] == 'success':
-        # Create confirmed order
-        metadata = result['data']['metadata']
-        
-        # Check if order already exists
-        existing_order = Order.query.filter_by(payment_ref=reference).first()
-        if not existing_order:
-            order = Order(
-                customer_info_json=metadata['customer_info'],
-                items_json=metadata['items'],
-                total_price=result['data']['amount'] / 100,
-                payment_ref=reference,
-                status='confirmed'
-            )
-            db.session.add(order)
-            db.session.commit()
+        # Create confirmed order unless the webhook already did
+        orders.finalize_order(result['data'])
+        db.session.commit()
         
-        # Clear cart
-        session['cart'] = []
-        session.pop('pending_customer_info', None)
-        session.pop('pending_items', None)
+        # Clear cart, including the pending checkout info
+        cart_id = session_cart_id()
+        if cart_id:
+            cart_store.clear(cart_id)
         
         return render_template('payment_result.html', success=True, reference=reference)
     else:
+        if result.get('status') and result['data']['status'] == 'failed':
+            release_checkout(reference)
         return render_template('payment_result.html', success=False, message='Payment verification failed')
 
 
@@ -307,23 +759,10 @@ def paystack_webhook():
     
     payload = request.json
     
-    if payload.get('event') == 'charge.success':
-        data = payload['data']
-        reference = data['reference']
-        
-        # Check if order already exists
-        existing_order = Order.query.filter_by(payment_ref=reference).first()
-        if not existing_order:
-            metadata = data.get('metadata', {})
-            order = Order(
-                customer_info_json=metadata.get('customer_info', {}),
-                items_json=metadata.get('items', []),
-                total_price=data['amount'] / 100,
-                payment_ref=reference,
-                status='confirmed'
-            )
-            db.session.add(order)
-            db.session.commit()
+    # Ack as soon as the event is durably queued; workers create the order
+    webhook_queue.enqueue(payload)
+    webhook_workers.start()
+    webhook_workers.wake()
     
     return jsonify({'status': 'ok'}), 200
 
@@ -394,19 +833,22 @@ def admin_settings():
         # Process Images
         if 'hero_image' in request.files and request.files['hero_image'].filename != '':
             hero_file = request.files['hero_image']
-            hero_url = save_uploaded_file(hero_file)
-            if hero_url:
-                delete_old_file(settings.hero_image)
-                settings.hero_image = hero_url
+            hero_image = save_uploaded_file(hero_file)
+            if hero_image:
+                storage.release(settings.hero_image)
+                storage.acquire(hero_image['src'])
+                settings.hero_image = hero_image['src']
                 
         if 'story_image' in request.files and request.files['story_image'].filename != '':
             story_file = request.files['story_image']
-            story_url = save_uploaded_file(story_file)
-            if story_url:
-                delete_old_file(settings.story_image)
-                settings.story_image = story_url
+            story_image = save_uploaded_file(story_file)
+            if story_image:
+                storage.release(settings.story_image)
+                storage.acquire(story_image['src'])
+                settings.story_image = story_image['src']
         
         db.session.commit()
+        settings_cache.invalidate()
         return redirect(url_for('admin_settings'))
         
     return render_template('admin/settings.html', settings=settings)
@@ -416,12 +858,32 @@ def admin_settings():
 @app.route('/api/admin/orders', methods=['GET'])
 @admin_required
 def get_admin_orders():
-    status = request.args.get('status', 'confirmed')
-    if status == 'all':
-        orders = Order.query.order_by(Order.created_at.desc()).all()
-    else:
-        orders = Order.query.filter_by(status=status).order_by(Order.created_at.desc()).all()
-    return jsonify([o.to_dict() for o in orders])
+    try:
+        spec = order_queries.parse_args(request.args)
+    except order_queries.OrderQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(order_queries.query_orders(spec))
+
+
+@app.route('/api/admin/orders/export', methods=['GET'])
+@admin_required
+def export_orders():
+    """Stream order line items as CSV or NDJSON; gzip=1 sends a .gz file"""
+    try:
+        fmt = catalog_io.detect_format(requested=request.args.get('format', 'csv'))
+        spec = order_export.parse_args(request.args)
+    except (catalog_io.ImportFormatError, order_queries.OrderQueryError) as e:
+        return jsonify({'error': str(e)}), 400
+    chunks = catalog_io.export_chunks(order_export.export_rows(spec), fmt, fields=order_export.FIELDS)
+    filename = f'orders.{fmt}'
+    mimetype = catalog_io.MIMETYPES[fmt]
+    if request.args.get('gzip') in ('1', 'true'):
+        chunks = order_export.gzip_chunks(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    return app.response_class(stream_with_context(chunks), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={filename}',
+    })
 
 
 @app.route('/api/admin/orders/<int:order_id>/status', methods=['PUT'])
@@ -429,6 +891,7 @@ def get_admin_orders():
 def update_order_status(order_id):
     order = Order.query.get_or_404(order_id)
     data = request.json
+    sales.record_status_change(order.status, data['status'], order.total_price)
     order.status = data['status']
     db.session.commit()
     return jsonify(order.to_dict())
@@ -445,10 +908,10 @@ def add_perfume():
     if file.filename == '':
         return jsonify({'error': 'No image selected'}), 400
     
-    # Save file locally
-    image_url = save_uploaded_file(file)
+    # Resize and store variants locally
+    image = save_uploaded_file(file)
     
-    if not image_url:
+    if not image:
         return jsonify({'error': 'Invalid file type or upload failed'}), 400
     
     price = float(request.form['price'])
@@ -461,13 +924,18 @@ def add_perfume():
         description=request.form['description'],
         price=price,
         compare_at_price=compare_at_price,
-        cloudinary_url=image_url,  # We keep the column name for compatibility but store local path
+        cloudinary_url=image['src'],  # We keep the column name for compatibility but store local path
+        image_variants=image,
         size=request.form.get('size', '50ml'),
         notes=request.form.get('notes', '')
     )
     
     db.session.add(perfume)
+    storage.acquire(perfume.cloudinary_url)
+    notes.sync_perfume_notes(perfume)
+    sales.adjust_perfume_count(1)
     db.session.commit()
+    catalog_cache.bump()
     
     return jsonify(perfume.to_dict()), 201
 
@@ -480,12 +948,14 @@ def update_perfume(perfume_id):
     # Handle optional image upload
     if 'image' in request.files and request.files['image'].filename != '':
         file = request.files['image']
-        image_url = save_uploaded_file(file)
+        image = save_uploaded_file(file)
         
-        if image_url:
-            # Delete old file here if it exists and is local
-            delete_old_file(perfume.cloudinary_url)
-            perfume.cloudinary_url = image_url
+        if image:
+            # The old files stay until `flask gc-uploads` finds nothing else using them
+            storage.release(perfume.cloudinary_url)
+            storage.acquire(image['src'])
+            perfume.cloudinary_url = image['src']
+            perfume.image_variants = image
         else:
              return jsonify({'error': 'Invalid file type'}), 400
     
@@ -501,8 +971,10 @@ def update_perfume(perfume_id):
         
     perfume.size = request.form.get('size', perfume.size)
     perfume.notes = request.form.get('notes', perfume.notes)
+    notes.sync_perfume_notes(perfume)
     
     db.session.commit()
+    catalog_cache.bump()
     return jsonify(perfume.to_dict())
 
 
@@ -510,26 +982,177 @@ def update_perfume(perfume_id):
 @admin_required
 def delete_perfume(perfume_id):
     perfume = Perfume.query.get_or_404(perfume_id)
+    notes.unlink_perfume_notes(perfume)
+    sales.adjust_perfume_count(-1)
+    storage.release(perfume.cloudinary_url)
     db.session.delete(perfume)
     db.session.commit()
-    # Delete image file
-    delete_old_file(perfume.cloudinary_url)
+    catalog_cache.bump()
     return jsonify({'message': 'Perfume deleted'})
 
 
+@app.route('/api/admin/perfumes/import', methods=['POST'])
+@admin_required
+def import_perfumes():
+    """Upsert perfumes from an uploaded CSV/JSON Lines file (field `file`) or the raw request body"""
+    upload = request.files.get('file')
+    try:
+        fmt = catalog_io.detect_format(upload.filename if upload else None, request.args.get('format'))
+        stream = io.TextIOWrapper(upload.stream if upload else request.stream, encoding='utf-8-sig', newline='')
+        report = catalog_io.import_records(catalog_io.read_records(stream, fmt))
+    except catalog_io.ImportFormatError as e:
+        return jsonify({'error': str(e)}), 400
+    except UnicodeDecodeError:
+        return jsonify({'error': 'File must be UTF-8; rows before the bad byte were imported'}), 400
+    finally:
+        catalog_cache.bump()
+    return jsonify(report.to_dict())
+
+
+@app.route('/api/admin/perfumes/export', methods=['GET'])
+@admin_required
+def export_perfumes():
+    try:
+        fmt = catalog_io.detect_format(requested=request.args.get('format', 'csv'))
+    except catalog_io.ImportFormatError as e:
+        return jsonify({'error': str(e)}), 400
+    chunks = catalog_io.export_chunks(catalog_io.export_rows(database.read_session()), fmt)
+    return app.response_class(stream_with_context(chunks), mimetype=catalog_io.MIMETYPES[fmt], headers={
+        'Content-Disposition': f'attachment; filename=perfumes.{fmt}',
+    })
+
+
+@app.route('/api/admin/inventory', methods=['GET'])
+@admin_required
+def get_inventory():
+    return jsonify(inventory.levels())
+
+
+@app.route('/api/admin/inventory/<int:perfume_id>', methods=['PUT'])
+@admin_required
+def update_inventory(perfume_id):
+    """{"stock": n} sets units free to sell (null stops tracking); {"adjust": n} adds to them"""
+    data = request.get_json(silent=True) or {}
+    if 'adjust' in data:
+        if not isinstance(data['adjust'], int) or isinstance(data['adjust'], bool):
+            return jsonify({'error': 'adjust must be a whole number'}), 400
+        stock = inventory.adjust_stock(perfume_id, data['adjust'])
+        if stock is None:
+            return jsonify({'error': 'Perfume not found or not stock-tracked'}), 404
+    elif 'stock' in data:
+        stock = data['stock']
+        if stock is not None and (not isinstance(stock, int) or isinstance(stock, bool) or stock < 0):
+            return jsonify({'error': 'stock must be a whole number, zero or more, or null'}), 400
+        if not inventory.set_stock(perfume_id, stock):
+            abort(404)
+    else:
+        return jsonify({'error': 'Provide stock or adjust'}), 400
+    db.session.commit()
+    return jsonify({'perfume_id': perfume_id, 'stock': stock})
+
+
+@app.route('/api/admin/paystack/metrics', methods=['GET'])
+@admin_required
+def get_paystack_metrics():
+    return jsonify({
+        'circuit': paystack.breaker.state,
+        'calls': paystack.stats.snapshot()
+    })
+
+
+@app.route('/admin/metrics')
+def prometheus_metrics():
+    """Prometheus text format; needs an admin session or `Authorization: Bearer $METRICS_TOKEN`"""
+    token = app.config['METRICS_TOKEN']
+    authorization = request.headers.get('Authorization', '')
+    if not session.get('admin_logged_in') and not (
+            token and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode())):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return app.response_class(request_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def paystack_metric_lines():
+    return metrics.render_call_stats('paystack_request_duration_seconds', 'Outbound Paystack call latency',
+                                     paystack.stats.snapshot())
+
+
+def page_cache_metric_lines():
+    stats = page_cache.stats()
+    return (
+        metrics.render_samples('page_cache_events_total', 'counter', 'Page cache lookups and maintenance',
+                               [({'event': name}, stats[name]) for name in page_cache.counters])
+        + metrics.render_samples('page_cache_bytes', 'gauge', 'Bytes of cached page bodies', [({}, stats['bytes'])])
+    )
+
+
+request_metrics.add_collector(paystack_metric_lines)
+request_metrics.add_collector(page_cache_metric_lines)
+request_metrics.add_collector(lambda: database.pool_metric_lines(db.engines))
+
+
+@app.route('/api/admin/cache/metrics', methods=['GET'])
+@admin_required
+def get_cache_metrics():
+    return jsonify({'pages': page_cache.stats()})
+
+
+@app.route('/api/admin/webhooks/metrics', methods=['GET'])
+@admin_required
+def get_webhook_metrics():
+    return jsonify(webhook_queue.queue_depth())
+
+
 @app.route('/api/admin/stats', methods=['GET'])
 @admin_required
 def get_admin_stats():
-    total_orders = Order.query.count()
-    total_revenue = db.session.query(db.func.sum(Order.total_price)).scalar() or 0
-    total_products = Perfume.query.count()
-    
+    return jsonify(sales.stats())
+
+
+@app.route('/api/admin/stats/revenue', methods=['GET'])
+@admin_required
+def get_revenue_series():
+    period = request.args.get('period', 'day')
+    if period not in ('day', 'week'):
+        return jsonify({'error': "period must be 'day' or 'week'"}), 400
+    days = max(1, min(request.args.get('days', 30, type=int), 366))
+    return jsonify(sales.revenue_series(period, days))
+
+
+@app.route('/api/admin/stats/top-perfumes', methods=['GET'])
+@admin_required
+def get_top_perfumes():
+    limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+    return jsonify(sales.top_perfumes(limit))
+
+
+@app.route('/api/admin/stats/perfume-sales', methods=['GET'])
+@admin_required
+def get_perfume_sales():
+    try:
+        start, end = order_items.parse_range(request.args)
+    except order_items.SalesQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = max(1, min(request.args.get('limit', 20, type=int), 500))
     return jsonify({
-        'total_orders': total_orders,
-        'total_revenue': total_revenue,
-        'total_products': total_products
+        'date_from': start.isoformat(),
+        'date_to': end.isoformat(),
+        'items': order_items.perfume_sales(start, end, limit),
     })
 
 
+@app.route('/api/admin/stats/perfume-sales/<int:perfume_id>', methods=['GET'])
+@admin_required
+def get_perfume_daily_sales(perfume_id):
+    try:
+        start, end = order_items.parse_range(request.args)
+        days = order_items.perfume_daily(perfume_id, start, end)
+    except order_items.SalesQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'perfume_id': perfume_id, 'days': days})
+
+
 if __name__ == '__main__':
+    # A single development process, so the backfills can't race
+    with app.app_context():
+        upgrade_data()
     app.run(debug=True, port=5002)
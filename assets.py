@@ -0,0 +1,144 @@
+"""
+Fingerprinted static assets
+
+`build()` copies every file in static/ (except uploads) into the build
+directory under a name that includes a hash of its content, and writes
+gzip and brotli versions next to the text files:
+
+    css/style.3f2a1b9c0d.css
+    css/style.3f2a1b9c0d.css.gz
+    css/style.3f2a1b9c0d.css.br
+    manifest.json               {"css/style.css": "css/style.3f2a1b9c0d.css", ...}
+
+Templates link through asset_url(), so an edited file gets a new URL and
+the old one can be cached by browsers forever. Brotli output needs the
+optional `brotli` package; without it only gzip is written.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip alone still works everywhere
+    brotli = None
+
+HASH_LENGTH = 10
+MAX_AGE = 365 * 24 * 3600
+SKIP_DIRS = {'uploads'}
+COMPRESSIBLE_TYPES = {'application/javascript', 'application/json', 'image/svg+xml', 'text/javascript'}
+
+# Content-Encoding -> file suffix, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def fingerprinted_name(name, data):
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}'
+
+
+def is_compressible(name):
+    mime = content_type(name)
+    return mime.startswith('text/') or mime in COMPRESSIBLE_TYPES
+
+
+def source_files(static_folder):
+    """Names (relative, '/'-separated) of every file to fingerprint"""
+    for directory, dirs, files in os.walk(static_folder):
+        if directory == static_folder:
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for name in files:
+            if name.startswith('.'):
+                continue
+            yield os.path.relpath(os.path.join(directory, name), static_folder).replace(os.sep, '/')
+
+
+def load_manifest(build_dir):
+    try:
+        with open(os.path.join(build_dir, 'manifest.json')) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename: workers building at the same time never serve half a file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def compress(data):
+    """{suffix: bytes} for the encodings that make data smaller"""
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    return {suffix: body for suffix, body in variants.items() if len(body) < len(data)}
+
+
+def needs_build(static_folder, build_dir):
+    manifest_path = os.path.join(build_dir, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return True
+    built_at = os.path.getmtime(manifest_path)
+    manifest = load_manifest(build_dir)
+    return any(
+        name not in manifest or os.path.getmtime(os.path.join(static_folder, name)) > built_at
+        for name in source_files(static_folder)
+    )
+
+
+def build(static_folder, build_dir):
+    """Fingerprint and precompress static/ into build_dir; returns the new manifest.
+
+    Files from the previous build are kept, so pages rendered by workers that
+    haven't restarted yet still load; anything older is deleted.
+    """
+    previous = load_manifest(build_dir)
+    manifest = {}
+    for name in sorted(source_files(static_folder)):
+        with open(os.path.join(static_folder, name), 'rb') as f:
+            data = f.read()
+        built_name = fingerprinted_name(name, data)
+        manifest[name] = built_name
+        path = os.path.join(build_dir, *built_name.split('/'))
+        if os.path.exists(path):
+            continue  # Same content as an earlier build
+        if is_compressible(name):
+            for suffix, body in compress(data).items():
+                _write(path + suffix, body)
+        _write(path, data)
+
+    _write(os.path.join(build_dir, 'manifest.json'), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+
+    keep = set(manifest.values()) | set(previous.values())
+    for directory, _, files in os.walk(build_dir):
+        for name in files:
+            key = os.path.relpath(os.path.join(directory, name), build_dir).replace(os.sep, '/')
+            base = key[:-3] if key.endswith(('.gz', '.br')) else key
+            if key != 'manifest.json' and base not in keep and not key.endswith('.tmp'):
+                os.remove(os.path.join(directory, name))
+    return manifest
+
+
+def content_type(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def is_built_file(name):
+    """True for fingerprinted files; the manifest and encoded copies aren't served by name"""
+    return name != 'manifest.json' and not name.endswith(('.gz', '.br', '.tmp'))
+
+
+def negotiate(accept_encodings, build_dir, built_name):
+    """(file name, Content-Encoding or None) of the best variant the client accepts"""
+    # A quality lookup: `in` is also true for an encoding refused with q=0
+    for encoding, suffix in ENCODINGS:
+        if accept_encodings[encoding] > 0 and os.path.exists(os.path.join(build_dir, *(built_name + suffix).split('/'))):
+            return built_name + suffix, encoding
+    return built_name, None
@@ -0,0 +1,125 @@
+"""
+Contention check for stock reservations
+
+Starts many checkouts of the same perfume at once, each from its own cart,
+against a stock smaller than the number of buyers. Exactly `stock` of them
+must get a hold and the rest a 409; stock must end at zero, never below.
+The winners are then paid and confirmed, and their holds must all convert.
+
+Usage:
+    python benchmarks/inventory_contention.py --buyers 400 --stock 50 --threads 32
+    DATABASE_URL=postgresql://... python benchmarks/inventory_contention.py
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from werkzeug.serving import make_server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SECRET = 'sk_test_inventory'
+FAKE_PORT = 5072
+
+
+def configure_env():
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'inventory.db')}")
+    os.environ['PAYSTACK_SECRET_KEY'] = SECRET
+    os.environ['PAYSTACK_BASE_URL'] = f'http://127.0.0.1:{FAKE_PORT}'
+    os.environ['WEBHOOK_WORKER_THREADS'] = '0'
+    os.environ.setdefault('SLOW_REQUEST_MS', '60000')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--buyers', type=int, default=400)
+    parser.add_argument('--stock', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=32)
+    args = parser.parse_args()
+
+    configure_env()
+    from app import app
+    from fake_paystack import create_fake_paystack
+    from models import db, Perfume, StockReservation
+    import inventory
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    fake = make_server('127.0.0.1', FAKE_PORT, create_fake_paystack(SECRET), threaded=True)
+    threading.Thread(target=fake.serve_forever, daemon=True).start()
+
+    with app.app_context():
+        perfume = Perfume(name='Contended', description='Contended', price=100, cloudinary_url='', stock=args.stock)
+        db.session.add(perfume)
+        db.session.commit()
+        perfume_id = perfume.id
+
+    # One cart per buyer, filled before the rush
+    clients = []
+    for _ in range(args.buyers):
+        client = app.test_client()
+        client.post('/api/cart/add', json={'id': perfume_id})
+        clients.append(client)
+
+    results = []  # (status, seconds, reference)
+    barrier = threading.Barrier(min(args.threads, args.buyers))
+
+    def checkout(i):
+        if i < barrier.parties:
+            barrier.wait()
+        started = time.perf_counter()
+        response = clients[i].post('/api/payment/initialize', json={
+            'customer_info': {'email': f'buyer{i}@example.com', 'name': f'Buyer {i}'}
+        })
+        results.append((response.status_code, time.perf_counter() - started, (response.json or {}).get('reference')))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(checkout, range(args.buyers)))
+    elapsed = time.perf_counter() - started
+
+    won = [ref for status, _, ref in results if status == 200]
+    refused = sum(1 for status, _, _ in results if status == 409)
+    other = [status for status, _, _ in results if status not in (200, 409)]
+    latencies = sorted(seconds * 1000 for _, seconds, _ in results)
+
+    with app.app_context():
+        stock_after_holds = db.session.get(Perfume, perfume_id).stock
+        held = inventory.levels()[0]['held']
+
+    # Pay and confirm every winner; their holds convert and stock stays put
+    def confirm(ref):
+        requests.get(f'http://127.0.0.1:{FAKE_PORT}/pay/{ref}', allow_redirects=False)
+        app.test_client().get(f'/payment/callback?reference={ref}')
+
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(confirm, won))
+
+    with app.app_context():
+        final_stock = db.session.get(Perfume, perfume_id).stock
+        statuses = dict(db.session.query(StockReservation.status, db.func.count()).group_by(StockReservation.status).all())
+
+    print(f"{args.buyers} checkouts of one perfume with stock {args.stock}, {args.threads} threads, in {elapsed:.2f}s")
+    print(f"held: {len(won)}  refused (409): {refused}  other: {len(other)}")
+    print(f"latency ms  p50 {statistics.median(latencies):.1f}  "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.1f}  max {latencies[-1]:.1f}")
+    print(f"stock after holds: {stock_after_holds}  units held: {held}  final stock: {final_stock}  reservations: {statuses}")
+
+    expected = min(args.stock, args.buyers)
+    ok = (len(won) == expected and not other and held == expected
+          and stock_after_holds == args.stock - expected and final_stock == args.stock - expected
+          and statuses.get(inventory.CONVERTED, 0) == expected)
+    print('OK' if ok else 'FAILED: stock was oversold or holds were lost')
+    fake.shutdown()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
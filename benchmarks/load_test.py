@@ -0,0 +1,313 @@
+"""
+Storefront load test: catalog, product, cart, checkout, webhook and admin paths
+
+Seeds a fresh database with seed.py's generator, serves the app and a fake
+Paystack on local ports, then runs each scenario from --threads client
+threads (one cookie jar each) for --duration seconds. Prints throughput and
+p50/p95/p99 latency per operation.
+
+Results can be saved as a baseline and later runs compared against it;
+an operation whose p95 grew, or whose throughput fell, by more than
+--tolerance is flagged and the script exits 1.
+
+Usage:
+    python benchmarks/load_test.py --perfumes 2000 --orders 20000 --threads 8 --duration 10
+    python benchmarks/load_test.py --save benchmarks/baselines.json
+    python benchmarks/load_test.py --compare benchmarks/baselines.json --tolerance 0.2
+    python benchmarks/load_test.py --scenarios catalog,cart
+    DATABASE_URL=postgresql://... python benchmarks/load_test.py
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+from werkzeug.serving import make_server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SECRET = 'sk_test_load'
+LIST_FIELDS = 'name,price,compare_at_price,cloudinary_url,image_srcset,size,notes'
+SORTS = ['newest', 'price_asc', 'price_desc', 'name']
+CUSTOMER = {'name': 'Load Test', 'email': 'load@example.com', 'phone': '0240000000',
+            'address': '1 Oxford Street', 'city': 'Accra'}
+
+
+def percentile(sorted_samples, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_samples:
+        return 0.0
+    index = max(0, min(len(sorted_samples) - 1, int(round(fraction * len(sorted_samples) + 0.5)) - 1))
+    return sorted_samples[index]
+
+
+class Recorder:
+    """Latencies (ms) and error counts per operation, shared by the client threads"""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.enabled = False
+        self._lock = threading.Lock()
+
+    def record(self, operation, ms, ok):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.samples.setdefault(operation, []).append(ms)
+            if not ok:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+
+
+class Client:
+    """One simulated shopper: a cookie jar plus timed requests"""
+
+    def __init__(self, base_url, recorder, rng, context):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.rng = rng
+        self.context = context
+        self.http = requests.Session()
+        self.state = {}  # Per-shopper flags, e.g. whether it has logged in
+
+    def timed(self, operation, method, path, expect=(200,), **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.http.request(method, self.base_url + path, allow_redirects=False, **kwargs)
+        except requests.RequestException:
+            self.recorder.record(operation, (time.perf_counter() - started) * 1000, False)
+            return None
+        self.recorder.record(operation, (time.perf_counter() - started) * 1000, response.status_code in expect)
+        return response
+
+    def random_perfume(self):
+        return self.rng.choice(self.context['perfume_ids'])
+
+
+# ---- Scenarios: one iteration each, timing every request that matters ----
+
+def catalog_scenario(client):
+    params = {'limit': 24, 'fields': LIST_FIELDS, 'sort': client.rng.choice(SORTS)}
+    client.timed('catalog_api', 'GET', '/api/perfumes', params=params)
+    client.timed('shop_page', 'GET', '/shop')
+
+
+def product_scenario(client):
+    client.timed('product_page', 'GET', f'/product/{client.random_perfume()}')
+    client.timed('home_page', 'GET', '/')
+
+
+def cart_scenario(client):
+    perfume_id = client.random_perfume()
+    client.timed('cart_add', 'POST', '/api/cart/batch', json={'ops': [{'op': 'add', 'id': perfume_id}]})
+    client.timed('cart_update', 'POST', '/api/cart/batch',
+                 json={'ops': [{'op': 'set', 'id': perfume_id, 'quantity': client.rng.randint(1, 5)}]})
+
+
+def checkout_scenario(client):
+    # initialize keeps the cart until payment completes, so one fill is enough
+    if not client.state.get('has_cart'):
+        client.http.post(client.base_url + '/api/cart/batch',
+                         json={'ops': [{'op': 'add', 'id': client.random_perfume(), 'quantity': 2}]})
+        client.state['has_cart'] = True
+    client.timed('payment_initialize', 'POST', '/api/payment/initialize', json={'customer_info': CUSTOMER})
+
+
+def webhook_scenario(client):
+    # A new paid transaction on the fake gateway per event, set up outside the timing
+    fake = client.context['fake_client']
+    perfume_id = client.random_perfume()
+    items = [{'id': perfume_id, 'name': 'Load', 'price': 100.0, 'image': '', 'quantity': 1}]
+    reference = fake.post('/transaction/initialize', headers={'Authorization': f'Bearer {SECRET}'}, json={
+        'email': CUSTOMER['email'], 'amount': 10000, 'metadata': {'customer_info': CUSTOMER, 'items': items},
+    }).json['data']['reference']
+    fake.get(f'/pay/{reference}')
+    charge = fake.get(f'/transaction/verify/{reference}', headers={'Authorization': f'Bearer {SECRET}'}).json['data']
+
+    body = json.dumps({'event': 'charge.success', 'data': charge}).encode('utf-8')
+    signature = hmac.new(SECRET.encode('utf-8'), body, hashlib.sha512).hexdigest()
+    client.timed('webhook', 'POST', '/api/paystack/webhook', data=body,
+                 headers={'Content-Type': 'application/json', 'x-paystack-signature': signature})
+
+
+def admin_orders_scenario(client):
+    if not client.state.get('logged_in'):
+        client.http.post(client.base_url + '/admin/login', data=client.context['admin_credentials'])
+        client.state['logged_in'] = True
+    params = {'limit': 50, 'view': 'summary', 'status': client.rng.choice(['confirmed', 'all'])}
+    response = client.timed('admin_orders', 'GET', '/api/admin/orders', params=params)
+    if response is not None and response.ok and response.json().get('next_cursor'):
+        client.timed('admin_orders_next', 'GET', '/api/admin/orders',
+                     params={**params, 'cursor': response.json()['next_cursor']})
+
+
+SCENARIOS = {
+    'catalog': catalog_scenario,
+    'product': product_scenario,
+    'cart': cart_scenario,
+    'checkout': checkout_scenario,
+    'webhook': webhook_scenario,
+    'admin_orders': admin_orders_scenario,
+}
+
+
+def run_scenario(name, base_url, context, threads, duration, warmup, seed):
+    recorder = Recorder()
+    stop_at = [None]
+
+    def worker(index):
+        client = Client(base_url, recorder, random.Random(f'{seed}-{name}-{index}'), context)
+        while stop_at[0] is None or time.perf_counter() < stop_at[0]:
+            SCENARIOS[name](client)
+
+    pool = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    time.sleep(warmup)
+    recorder.enabled = True
+    started = time.perf_counter()
+    stop_at[0] = started + duration
+    for thread in pool:
+        thread.join()
+    recorder.enabled = False
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for operation, samples in recorder.samples.items():
+        samples.sort()
+        results[operation] = {
+            'requests': len(samples),
+            'errors': recorder.errors.get(operation, 0),
+            'throughput': round(len(samples) / elapsed, 2),
+            'p50_ms': round(percentile(samples, 0.50), 2),
+            'p95_ms': round(percentile(samples, 0.95), 2),
+            'p99_ms': round(percentile(samples, 0.99), 2),
+        }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print each operation against the baseline; returns the names that regressed"""
+    regressions = []
+    print(f"\n{'operation':<20} {'p95 ms':>9} {'base':>9} {'change':>8} {'req/s':>9} {'base':>9} {'change':>8}")
+    for operation, result in sorted(results.items()):
+        base = baseline['results'].get(operation)
+        if base is None:
+            print(f"{operation:<20} {result['p95_ms']:>9.2f} {'-':>9} {'new':>8}")
+            continue
+        p95_change = (result['p95_ms'] - base['p95_ms']) / base['p95_ms'] if base['p95_ms'] else 0.0
+        rate_change = (result['throughput'] - base['throughput']) / base['throughput'] if base['throughput'] else 0.0
+        regressed = p95_change > tolerance or rate_change < -tolerance
+        if regressed:
+            regressions.append(operation)
+        print(f"{operation:<20} {result['p95_ms']:>9.2f} {base['p95_ms']:>9.2f} {p95_change:>+8.0%} "
+              f"{result['throughput']:>9.1f} {base['throughput']:>9.1f} {rate_change:>+8.0%}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--perfumes', type=int, default=2000)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10, help='Measured seconds per scenario')
+    parser.add_argument('--warmup', type=float, default=2, help='Unmeasured seconds before each scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', metavar='PATH', help='Write results as a baseline JSON file')
+    parser.add_argument('--compare', metavar='PATH', help='Compare against a baseline JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed p95/throughput change, e.g. 0.2 = 20%%')
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+
+    from fake_paystack import create_fake_paystack
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    fake_app = create_fake_paystack(SECRET)
+    fake_server = make_server('127.0.0.1', 0, fake_app, threaded=True)
+    threading.Thread(target=fake_server.serve_forever, daemon=True).start()
+
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'load.db')}")
+    os.environ['PAYSTACK_SECRET_KEY'] = SECRET
+    os.environ['PAYSTACK_BASE_URL'] = f'http://127.0.0.1:{fake_server.server_port}'
+    os.environ.setdefault('SLOW_REQUEST_MS', '60000')
+    from app import app
+    from models import db, Perfume
+    import seed
+
+    print(f"Seeding {args.perfumes} perfumes and {args.orders} orders...")
+    seed.generate(args.perfumes, args.orders, args.seed)
+    with app.app_context():
+        perfume_ids = [row.id for row in db.session.query(Perfume.id)]
+        dialect = db.engine.dialect.name
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    context = {
+        'perfume_ids': perfume_ids,
+        'fake_client': fake_app.test_client(),
+        'admin_credentials': {'username': app.config['ADMIN_USERNAME'], 'password': app.config['ADMIN_PASSWORD']},
+    }
+
+    results = {}
+    print(f"\n{'operation':<20} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name in names:
+        scenario_results = run_scenario(name, base_url, context, args.threads, args.duration, args.warmup, args.seed)
+        for operation, r in sorted(scenario_results.items()):
+            print(f"{operation:<20} {r['requests']:>9} {r['errors']:>7} {r['throughput']:>9.1f} "
+                  f"{r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f}")
+        results.update(scenario_results)
+
+    server.shutdown()
+    fake_server.shutdown()
+
+    meta = {
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'database': dialect,
+        'perfumes': args.perfumes,
+        'orders': args.orders,
+        'threads': args.threads,
+        'duration': args.duration,
+    }
+
+    failed = any(r['errors'] for r in results.values())
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        differing = [key for key in ('database', 'perfumes', 'orders', 'threads')
+                     if baseline['meta'].get(key) != meta[key]]
+        if differing:
+            print(f"\nWarning: baseline was recorded with different {', '.join(differing)}")
+        regressions = compare(results, baseline, args.tolerance)
+        print(f"\n{len(regressions)} regressions beyond {args.tolerance:.0%}" + (f": {', '.join(regressions)}" if regressions else ''))
+        failed = failed or bool(regressions)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\nSaved baseline to {args.save}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
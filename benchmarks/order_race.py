@@ -0,0 +1,138 @@
+"""
+Concurrency stress check for order finalization
+
+Confirms many Paystack references through the payment callback and the
+webhook queue at the same moment, then checks that every reference ended up
+with exactly one order and no request failed.
+
+Usage:
+    python benchmarks/order_race.py --references 200 --threads 16
+    DATABASE_URL=postgresql://... python benchmarks/order_race.py
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from werkzeug.serving import make_server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SECRET = 'sk_test_race'
+FAKE_PORT = 5071
+
+
+def configure_env():
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'race.db')}")
+    os.environ['PAYSTACK_SECRET_KEY'] = SECRET
+    os.environ['PAYSTACK_BASE_URL'] = f'http://127.0.0.1:{FAKE_PORT}'
+    # Drive the queue from this script so callbacks and workers overlap on purpose
+    os.environ['WEBHOOK_WORKER_THREADS'] = '0'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--references', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+
+    configure_env()
+    from app import app
+    from fake_paystack import create_fake_paystack
+    from models import db, Order, Perfume
+    import webhook_queue
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    fake = make_server('127.0.0.1', FAKE_PORT, create_fake_paystack(SECRET), threaded=True)
+    threading.Thread(target=fake.serve_forever, daemon=True).start()
+
+    # Paid transactions on the fake gateway
+    with app.app_context():
+        perfume = Perfume(name='Race', description='Race', price=100, cloudinary_url='')
+        db.session.add(perfume)
+        db.session.commit()
+        perfume_id = perfume.id
+    client = app.test_client()
+    client.post('/api/cart/add', json={'id': perfume_id})
+    references = []
+    for i in range(args.references):
+        result = client.post('/api/payment/initialize', json={
+            'customer_info': {'email': f'race{i}@example.com', 'name': f'Race {i}'}
+        }).json
+        # Approve the charge without the fake's own webhook; this script sends them
+        requests.get(result['authorization_url'], allow_redirects=False)
+        references.append(result['reference'])
+
+    errors = []
+    stop = threading.Event()
+
+    def callback(ref):
+        response = app.test_client().get(f'/payment/callback?reference={ref}')
+        if response.status_code != 200 or b'Order Confirmed' not in response.data:
+            errors.append(f'callback {ref}: {response.status_code}')
+
+    def webhook(ref):
+        verify = requests.get(f'http://127.0.0.1:{FAKE_PORT}/transaction/verify/{ref}',
+                              headers={'Authorization': f'Bearer {SECRET}'}).json()
+        body = json.dumps({'event': 'charge.success', 'data': verify['data']}).encode('utf-8')
+        signature = hmac.new(SECRET.encode('utf-8'), body, hashlib.sha512).hexdigest()
+        response = app.test_client().post('/api/paystack/webhook', data=body, content_type='application/json',
+                                          headers={'x-paystack-signature': signature})
+        if response.status_code != 200:
+            errors.append(f'webhook {ref}: {response.status_code}')
+
+    def drain():
+        with app.app_context():
+            while not stop.is_set():
+                try:
+                    if not webhook_queue.process_batch(batch_size=20):
+                        time.sleep(0.01)
+                except Exception as e:
+                    errors.append(f'worker: {e!r}')
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+    drainers = [threading.Thread(target=drain) for _ in range(4)]
+    for t in drainers:
+        t.start()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        for ref in references:
+            pool.submit(callback, ref)
+            pool.submit(webhook, ref)
+    with app.app_context():
+        while webhook_queue.queue_depth()['pending'] or webhook_queue.queue_depth()['processing']:
+            time.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for t in drainers:
+        t.join()
+
+    with app.app_context():
+        counts = dict(db.session.query(Order.payment_ref, db.func.count())
+                      .filter(Order.payment_ref.in_(references))
+                      .group_by(Order.payment_ref).all())
+    missing = [r for r in references if counts.get(r, 0) == 0]
+    duplicated = [r for r, n in counts.items() if n > 1]
+
+    print(f"{len(references)} references, callback + webhook each, in {elapsed:.2f}s")
+    print(f"orders: {sum(counts.values())}  missing: {len(missing)}  duplicated: {len(duplicated)}  errors: {len(errors)}")
+    for error in errors[:10]:
+        print(f"  {error}")
+    fake.shutdown()
+    sys.exit(1 if missing or duplicated or errors else 0)
+
+
+if __name__ == '__main__':
+    main()
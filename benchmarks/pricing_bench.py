@@ -0,0 +1,87 @@
+"""
+Checkout pricing benchmark: one IN (...) query vs a lookup per cart line
+
+Seeds a catalog, then prices carts of increasing size three ways: a
+primary-key lookup per line summed as floats (the old shape), the
+PriceBook with a cold cache (one bulk query), and the PriceBook warm.
+
+Usage:
+    python benchmarks/pricing_bench.py --perfumes 2000 --sizes 10,100,500 --repeat 20
+    DATABASE_URL=postgresql://... python benchmarks/pricing_bench.py
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def timed(fn, repeat):
+    """Median milliseconds per call"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--perfumes', type=int, default=2000)
+    parser.add_argument('--sizes', default='10,100,500')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'pricing.db')}")
+    os.environ['WEBHOOK_WORKER_THREADS'] = '0'
+    from app import app
+    from models import db, Perfume
+    from pricing import PriceBook
+
+    rng = random.Random(42)
+    with app.app_context():
+        db.session.add_all(
+            Perfume(name=f'Bench {i}', description='Benchmark perfume', cloudinary_url='',
+                    price=round(rng.uniform(100, 2000), 2),
+                    compare_at_price=round(rng.uniform(2000, 2500), 2) if i % 3 == 0 else None)
+            for i in range(args.perfumes)
+        )
+        db.session.commit()
+        ids = [row.id for row in db.session.query(Perfume.id)]
+
+        print(f"{'lines':>6} {'per-item ms':>12} {'bulk cold ms':>13} {'bulk warm ms':>13} {'queries':>12}")
+        for size in [int(s) for s in args.sizes.split(',')]:
+            cart = [{'id': perfume_id, 'quantity': rng.randint(1, 3)} for perfume_id in rng.sample(ids, size)]
+
+            def per_item():
+                db.session.expunge_all()
+                total = 0.0
+                for line in cart:
+                    perfume = db.session.get(Perfume, line['id'])
+                    total += perfume.price * line['quantity']
+                return total
+
+            book = PriceBook(ttl=60)
+
+            def bulk_cold():
+                book._entries.clear()
+                return book.quote(cart)['total']
+
+            def bulk_warm():
+                return book.quote(cart)['total']
+
+            slow = timed(per_item, args.repeat)
+            cold = timed(bulk_cold, args.repeat)
+            book.quote(cart)
+            warm = timed(bulk_warm, args.repeat)
+            print(f"{size:>6} {slow:>12.2f} {cold:>13.2f} {warm:>13.2f} {f'{size} vs 1':>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""
+In-process caches for Maison Écorce
+
+Each gunicorn worker keeps its own copy. Writers bump a VersionStamp, a
+file whose mtime every worker checks with a single stat() before serving
+from its cache, so a write in one worker invalidates all of them.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class VersionStamp:
+    """Cross-process version marker backed by a file's modification time"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def read(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def bump(self):
+        # Never reuse a stamp, even if two bumps land within the clock's resolution
+        stamp = max(time.time_ns(), self.read() + 1)
+        with open(self.path, 'a'):
+            pass
+        os.utime(self.path, ns=(stamp, stamp))
+
+
+class VersionedCache:
+    """Serialized response bodies keyed by request arguments.
+
+    Every entry belongs to the current version; bumping the version drops
+    them all, so writers only need to call bump() after committing.
+    """
+
+    def __init__(self, max_entries=256, stamp=None):
+        self.max_entries = max_entries
+        self.stamp = stamp
+        self.version = 0
+        self._seen_stamp = stamp.read() if stamp else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bump(self):
+        if self.stamp:
+            self.stamp.bump()
+        with self._lock:
+            self._advance()
+
+    def _advance(self):
+        self.version += 1
+        self._entries.clear()
+        if self.stamp:
+            self._seen_stamp = self.stamp.read()
+
+    def get_or_build(self, key, builder):
+        """Return (body, etag) for key, calling builder() for the bytes on a miss"""
+        current_stamp = self.stamp.read() if self.stamp else None
+        with self._lock:
+            if current_stamp != self._seen_stamp:
+                self._advance()
+            version = self.version
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        body = builder()
+        # The stamp is shared by all workers, so their ETags for the same body agree
+        marker = current_stamp if self.stamp else version
+        entry = (body, f"{marker}-{hashlib.sha1(body).hexdigest()[:16]}")
+
+        with self._lock:
+            # Don't store a body built from rows that a concurrent write replaced
+            if self.version == version:
+                self._entries[key] = entry
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+
+
+class CachedValue:
+    """A single lazily loaded value, reloaded after invalidate() or a stamp change"""
+
+    _MISSING = object()
+
+    def __init__(self, loader, stamp=None):
+        self.loader = loader
+        self.stamp = stamp
+        self._value = self._MISSING
+        self._loaded_stamp = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        current_stamp = self.stamp.read() if self.stamp else None
+        with self._lock:
+            if self._value is not self._MISSING and current_stamp == self._loaded_stamp:
+                return self._value
+
+        value = self.loader()
+        with self._lock:
+            self._value = value
+            self._loaded_stamp = current_stamp
+        return value
+
+    def invalidate(self):
+        if self.stamp:
+            self.stamp.bump()
+        with self._lock:
+            self._value = self._MISSING
+
+
+class ResponseCache:
+    """Whole responses for anonymous page views, shared by every visitor.
+
+    Entries expire after their own ttl and are evicted least recently used
+    once their bodies add up to max_bytes. A change to any of the stamps
+    (catalog, settings) drops everything.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_entries=2048, stamps=()):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.stamps = stamps
+        self.version = 0
+        self.size = 0
+        self.counters = {'hits': 0, 'misses': 0, 'bypasses': 0, 'stores': 0, 'evictions': 0, 'invalidations': 0}
+        self._seen_stamps = self._read_stamps()
+        self._entries = OrderedDict()  # key -> (entry, size, expires_at)
+        self._lock = threading.Lock()
+
+    def _read_stamps(self):
+        return tuple(stamp.read() for stamp in self.stamps)
+
+    def _sync(self):
+        # Called with the lock held
+        current = self._read_stamps()
+        if current != self._seen_stamps:
+            self._seen_stamps = current
+            self.version += 1
+            self.size = 0
+            self._entries.clear()
+            self.counters['invalidations'] += 1
+
+    def lookup(self, key):
+        """(entry or None, version to pass to store())"""
+        now = time.monotonic()
+        with self._lock:
+            self._sync()
+            cached = self._entries.get(key)
+            if cached is not None and cached[2] > now:
+                self._entries.move_to_end(key)
+                self.counters['hits'] += 1
+                return cached[0], self.version
+            if cached is not None:
+                del self._entries[key]
+                self.size -= cached[1]
+            self.counters['misses'] += 1
+            return None, self.version
+
+    def store(self, key, entry, size, ttl, version):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._sync()
+            # Built from rows a concurrent write replaced
+            if version != self.version:
+                return
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self._entries[key] = (entry, size, time.monotonic() + ttl)
+            self.size += size
+            self.counters['stores'] += 1
+            while self.size > self.max_bytes or len(self._entries) > self.max_entries:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                self.counters['evictions'] += 1
+
+    def bypass(self):
+        with self._lock:
+            self.counters['bypasses'] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters['hits'] + self.counters['misses']
+            return {
+                **self.counters,
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hit_ratio': round(self.counters['hits'] / lookups, 4) if lookups else None,
+            }
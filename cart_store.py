@@ -0,0 +1,269 @@
+"""
+Server-side cart storage
+
+The session cookie only carries a cart id; items and pending checkout data
+live in a store. SqlCartStore keeps carts in the carts/cart_items tables
+and is safe across gunicorn workers. MemoryCartStore is an LRU with TTL
+eviction for single-process deployments and development.
+
+Changes are applied as a list of operations that commit together and bump
+the cart's version once. Each operation touches one item row, so the full
+cart is never rewritten. Passing the version the client last saw makes the
+batch conditional, which is how `If-Match` on /api/cart/batch works.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from models import db, Cart, CartItem
+from upsert import increment
+
+ITEM_FIELDS = ('id', 'name', 'price', 'image', 'quantity')
+MAX_OPS = 100
+
+
+class CartOpError(ValueError):
+    pass
+
+
+class CartVersionConflict(Exception):
+    """The cart changed since the version the client sent"""
+
+    def __init__(self, version):
+        super().__init__(f'Cart is at version {version}')
+        self.version = version
+
+
+def _int(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise CartOpError(f'{name} must be an integer')
+
+
+def parse_ops(ops):
+    """Validate a batch before anything is written; returns normalized op dicts"""
+    if not isinstance(ops, list):
+        raise CartOpError('ops must be a list')
+    if len(ops) > MAX_OPS:
+        raise CartOpError(f'At most {MAX_OPS} operations per batch')
+
+    parsed = []
+    for op in ops:
+        kind = op.get('op') if isinstance(op, dict) else None
+        if kind == 'clear':
+            parsed.append({'op': 'clear'})
+        elif kind == 'add':
+            # Name, price and image come from the catalog, not the client; see app.priced_ops
+            quantity = _int(op.get('quantity', 1), 'quantity')
+            if quantity < 1:
+                raise CartOpError('add quantity must be at least 1')
+            parsed.append({'op': 'add', 'id': _int(op.get('id'), 'id'), 'quantity': quantity})
+        elif kind == 'set':
+            parsed.append({'op': 'set', 'id': _int(op.get('id'), 'id'),
+                           'quantity': _int(op.get('quantity'), 'quantity')})
+        elif kind == 'remove':
+            parsed.append({'op': 'remove', 'id': _int(op.get('id'), 'id')})
+        else:
+            raise CartOpError("op must be one of 'add', 'set', 'remove', 'clear'")
+    return parsed
+
+
+class SqlCartStore:
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def _expired_before(self):
+        return datetime.utcnow() - timedelta(seconds=self.ttl)
+
+    def _drop(self, cart_id):
+        db.session.query(CartItem).filter_by(cart_id=cart_id).delete(synchronize_session=False)
+        db.session.query(Cart).filter_by(id=cart_id).delete(synchronize_session=False)
+
+    def _load(self, cart_id):
+        """(version, data) for a live cart, or None; expired carts are dropped"""
+        row = db.session.query(Cart.version, Cart.data, Cart.updated_at).filter(Cart.id == cart_id).first()
+        if row is None:
+            return None
+        if row.updated_at and row.updated_at < self._expired_before():
+            self._drop(cart_id)
+            db.session.commit()
+            return None
+        return row.version, row.data or {}
+
+    def _bump(self, cart_id, expected_version, loaded):
+        now = datetime.utcnow()
+        if expected_version is None or (expected_version == 0 and loaded is None):
+            increment(Cart, {'id': cart_id}, {'version': 1}, values={'updated_at': now})
+            return
+        # Compare-and-set, so two batches sent against the same version can't both apply
+        updated = (
+            db.session.query(Cart)
+            .filter(Cart.id == cart_id, Cart.version == expected_version)
+            .update({'version': Cart.version + 1, 'updated_at': now}, synchronize_session=False)
+        )
+        if not updated:
+            db.session.rollback()
+            raise CartVersionConflict(self.version(cart_id))
+
+    def _apply_op(self, cart_id, op):
+        items = db.session.query(CartItem).filter_by(cart_id=cart_id)
+        if op['op'] == 'clear':
+            items.delete(synchronize_session=False)
+        elif op['op'] == 'add':
+            increment(
+                CartItem,
+                {'cart_id': cart_id, 'perfume_id': op['id']},
+                {'quantity': op['quantity']},
+                values={'name': op['name'], 'price': op['price'], 'image': op['image']},
+            )
+        elif op['op'] == 'set' and op['quantity'] > 0:
+            items.filter_by(perfume_id=op['id']).update({'quantity': op['quantity']}, synchronize_session=False)
+        else:
+            items.filter_by(perfume_id=op['id']).delete(synchronize_session=False)
+
+    def apply(self, cart_id, ops, expected_version=None):
+        """Apply parsed ops in one transaction; returns the new version"""
+        loaded = self._load(cart_id)
+        self._bump(cart_id, expected_version, loaded)
+        for op in ops:
+            self._apply_op(cart_id, op)
+        db.session.commit()
+        return self.version(cart_id)
+
+    def version(self, cart_id):
+        loaded = self._load(cart_id)
+        return loaded[0] if loaded else 0
+
+    def snapshot(self, cart_id):
+        """(version, items) in the order items were first added"""
+        loaded = self._load(cart_id)
+        if loaded is None:
+            return 0, []
+        rows = (
+            db.session.query(CartItem.perfume_id, CartItem.name, CartItem.price, CartItem.image, CartItem.quantity)
+            .filter(CartItem.cart_id == cart_id)
+            .order_by(CartItem.added_at, CartItem.perfume_id)
+            .all()
+        )
+        return loaded[0], [dict(zip(ITEM_FIELDS, row)) for row in rows]
+
+    def clear(self, cart_id):
+        """Empty the cart and drop pending data, keeping the version moving forward"""
+        self.apply(cart_id, [{'op': 'clear'}])
+        db.session.query(Cart).filter_by(id=cart_id).update({'data': None}, synchronize_session=False)
+        db.session.commit()
+
+    def get_data(self, cart_id, key, default=None):
+        loaded = self._load(cart_id)
+        return loaded[1].get(key, default) if loaded else default
+
+    def set_data(self, cart_id, key, value):
+        loaded = self._load(cart_id)
+        data = dict(loaded[1]) if loaded else {}
+        data[key] = value
+        # Pending data isn't part of what clients render, so the version stays put
+        increment(Cart, {'id': cart_id}, {'version': 0}, values={'updated_at': datetime.utcnow()})
+        db.session.query(Cart).filter_by(id=cart_id).update({'data': data}, synchronize_session=False)
+        db.session.commit()
+
+    def purge_expired(self):
+        expired = db.session.query(Cart.id).filter(Cart.updated_at < self._expired_before())
+        db.session.query(CartItem).filter(CartItem.cart_id.in_(expired.scalar_subquery())).delete(synchronize_session=False)
+        count = db.session.query(Cart).filter(Cart.updated_at < self._expired_before()).delete(synchronize_session=False)
+        db.session.commit()
+        return count
+
+
+class MemoryCartStore:
+    """Per-process LRU of carts; idle carts expire after ttl seconds"""
+
+    def __init__(self, ttl, max_carts=10000):
+        self.ttl = ttl
+        self.max_carts = max_carts
+        self._carts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        # Least recently used first, so expired carts are always at the front
+        while self._carts:
+            cart_id, cart = next(iter(self._carts.items()))
+            if len(self._carts) <= self.max_carts and now - cart['touched'] < self.ttl:
+                break
+            del self._carts[cart_id]
+
+    def _cart(self, cart_id, create=False):
+        now = time.monotonic()
+        self._evict(now)
+        cart = self._carts.get(cart_id)
+        if cart is None and create:
+            cart = self._carts[cart_id] = {'items': OrderedDict(), 'data': {}, 'version': 0, 'touched': now}
+        if cart is not None:
+            # Reads count as activity too, keeping LRU order the same as expiry order
+            self._carts.move_to_end(cart_id)
+            cart['touched'] = now
+        return cart
+
+    def apply(self, cart_id, ops, expected_version=None):
+        with self._lock:
+            existing = self._cart(cart_id)
+            current = existing['version'] if existing else 0
+            if expected_version is not None and expected_version != current:
+                raise CartVersionConflict(current)
+
+            cart = self._cart(cart_id, create=True)
+            items = cart['items']
+            for op in ops:
+                if op['op'] == 'clear':
+                    items.clear()
+                elif op['op'] == 'add':
+                    entry = items.setdefault(op['id'], {'id': op['id'], 'quantity': 0})
+                    entry.update(name=op['name'], price=op['price'], image=op['image'])
+                    entry['quantity'] += op['quantity']
+                elif op['op'] == 'set' and op['quantity'] > 0:
+                    if op['id'] in items:
+                        items[op['id']]['quantity'] = op['quantity']
+                else:
+                    items.pop(op['id'], None)
+            cart['version'] += 1
+            return cart['version']
+
+    def version(self, cart_id):
+        with self._lock:
+            cart = self._cart(cart_id)
+            return cart['version'] if cart else 0
+
+    def snapshot(self, cart_id):
+        with self._lock:
+            cart = self._cart(cart_id)
+            if cart is None:
+                return 0, []
+            return cart['version'], [dict(item) for item in cart['items'].values()]
+
+    def clear(self, cart_id):
+        self.apply(cart_id, [{'op': 'clear'}])
+        with self._lock:
+            self._cart(cart_id, create=True)['data'] = {}
+
+    def get_data(self, cart_id, key, default=None):
+        with self._lock:
+            cart = self._cart(cart_id)
+            return cart['data'].get(key, default) if cart else default
+
+    def set_data(self, cart_id, key, value):
+        with self._lock:
+            self._cart(cart_id, create=True)['data'][key] = value
+
+    def purge_expired(self):
+        with self._lock:
+            before = len(self._carts)
+            self._evict(time.monotonic())
+            return before - len(self._carts)
+
+
+def create_cart_store(config):
+    if config['CART_BACKEND'] == 'memory':
+        return MemoryCartStore(config['CART_TTL'], config['CART_MEMORY_MAX_CARTS'])
+    return SqlCartStore(config['CART_TTL'])
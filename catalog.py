@@ -0,0 +1,200 @@
+"""
+Catalog queries for the storefront API: filtering (price, size, notes),
+sorting, sparse field projection and keyset pagination over perfumes
+"""
+
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+from models import db, Perfume, image_srcsets
+from database import read_session
+import notes
+import pagination
+
+PERFUME_FIELDS = ('id', 'name', 'description', 'price', 'compare_at_price',
+                  'cloudinary_url', 'image_srcset', 'size', 'notes', 'created_at')
+
+# Fields computed from another column: field -> (column name, serializer)
+DERIVED_FIELDS = {
+    'image_srcset': ('image_variants', image_srcsets),
+}
+
+# sort name -> (column, descending); id breaks ties so every row has a unique position
+SORTS = {
+    'newest': (Perfume.created_at, True),
+    'oldest': (Perfume.created_at, False),
+    'price_asc': (Perfume.price, False),
+    'price_desc': (Perfume.price, True),
+    'name': (Perfume.name, False),
+}
+
+DEFAULT_LIMIT = 24
+MAX_LIMIT = 100
+
+
+class CatalogQueryError(ValueError):
+    pass
+
+
+def decode_cursor(cursor, sort):
+    try:
+        cursor_sort, value, last_id = pagination.decode_cursor(cursor, 3)
+    except ValueError:
+        raise CatalogQueryError('Invalid cursor')
+    if cursor_sort != sort:
+        raise CatalogQueryError('Cursor does not match sort order')
+    # Crafted cursors would otherwise reach the row comparison and fail in the database
+    if not isinstance(last_id, int) or isinstance(last_id, bool):
+        raise CatalogQueryError('Invalid cursor')
+    column = SORTS[sort][0]
+    if column is Perfume.created_at:
+        try:
+            value = datetime.fromisoformat(value)
+        except (ValueError, TypeError):
+            raise CatalogQueryError('Invalid cursor')
+    elif column is Perfume.price:
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            raise CatalogQueryError('Invalid cursor')
+    elif not isinstance(value, str):
+        raise CatalogQueryError('Invalid cursor')
+    return value, last_id
+
+
+def _parse_price(args, name):
+    value = args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise CatalogQueryError(f'{name} must be a number')
+
+
+def parse_args(args):
+    """Validate request args into a hashable, normalized query spec"""
+    sort = args.get('sort', 'newest')
+    if sort not in SORTS:
+        raise CatalogQueryError(f"sort must be one of: {', '.join(SORTS)}")
+
+    fields = None
+    if args.get('fields'):
+        fields = tuple(f.strip() for f in args['fields'].split(',') if f.strip())
+        unknown = [f for f in fields if f not in PERFUME_FIELDS]
+        if unknown:
+            raise CatalogQueryError(f"Unknown fields: {', '.join(unknown)}")
+        if 'id' not in fields:
+            fields = ('id',) + fields
+
+    sizes = None
+    if args.get('size'):
+        sizes = tuple(sorted(s.strip() for s in args['size'].split(',') if s.strip()))
+
+    note_slugs = None
+    if args.get('notes'):
+        note_slugs = tuple(sorted({notes.slugify(n) for n in args['notes'].split(',') if notes.slugify(n)}))
+    notes_mode = args.get('notes_mode', 'any')
+    if notes_mode not in ('any', 'all'):
+        raise CatalogQueryError("notes_mode must be 'any' or 'all'")
+
+    paginate = 'limit' in args or 'cursor' in args
+    limit = None
+    if paginate:
+        try:
+            limit = int(args.get('limit', DEFAULT_LIMIT))
+        except ValueError:
+            raise CatalogQueryError('limit must be an integer')
+        limit = max(1, min(limit, MAX_LIMIT))
+
+    return {
+        'sort': sort,
+        'fields': fields,
+        'min_price': _parse_price(args, 'min_price'),
+        'max_price': _parse_price(args, 'max_price'),
+        'sizes': sizes,
+        'notes': note_slugs,
+        'notes_mode': notes_mode,
+        'limit': limit,
+        'cursor': args.get('cursor') or None,
+    }
+
+
+def spec_key(spec):
+    return tuple(sorted(spec.items()))
+
+
+def filtered_query(spec, columns):
+    query = read_session().query(*columns)
+    if spec['min_price'] is not None:
+        query = query.filter(Perfume.price >= spec['min_price'])
+    if spec['max_price'] is not None:
+        query = query.filter(Perfume.price <= spec['max_price'])
+    if spec['sizes']:
+        query = query.filter(Perfume.size.in_(spec['sizes']))
+    if spec['notes']:
+        query = query.filter(notes.note_filter(spec['notes'], spec['notes_mode']))
+    return query
+
+
+def _serialize(row, fields):
+    data = {}
+    for field in fields:
+        if field in DERIVED_FIELDS:
+            column, serialize = DERIVED_FIELDS[field]
+            data[field] = serialize(getattr(row, column))
+            continue
+        value = getattr(row, field)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        data[field] = value
+    return data
+
+
+def _columns(fields):
+    return [getattr(Perfume, DERIVED_FIELDS[f][0] if f in DERIVED_FIELDS else f) for f in fields]
+
+
+def perfumes_by_id(ids, fields=PERFUME_FIELDS):
+    """Catalog rows for ids, in the order given and in the same shape as listings"""
+    rows = {row.id: row for row in read_session().query(*_columns(fields)).filter(Perfume.id.in_(ids))}
+    return [_serialize(rows[i], fields) for i in ids if i in rows]
+
+
+def query_perfumes(spec):
+    """Run a parsed spec; returns a list, or a page dict when limit/cursor was given"""
+    sort = spec['sort']
+    sort_column, descending = SORTS[sort]
+    fields = spec['fields'] or PERFUME_FIELDS
+
+    columns = _columns(fields)
+    if sort_column.key not in fields:
+        columns.append(sort_column)
+
+    query = filtered_query(spec, columns)
+
+    if spec['cursor']:
+        value, last_id = decode_cursor(spec['cursor'], sort)
+        position = tuple_(sort_column, Perfume.id)
+        query = query.filter(position < (value, last_id) if descending else position > (value, last_id))
+
+    if descending:
+        query = query.order_by(sort_column.desc(), Perfume.id.desc())
+    else:
+        query = query.order_by(sort_column.asc(), Perfume.id.asc())
+
+    if spec['limit'] is None:
+        return [_serialize(row, fields) for row in query.all()]
+
+    rows = query.limit(spec['limit'] + 1).all()
+    has_more = len(rows) > spec['limit']
+    rows = rows[:spec['limit']]
+
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = pagination.encode_cursor(sort, getattr(last, sort_column.key), last.id)
+
+    return {
+        'items': [_serialize(row, fields) for row in rows],
+        'next_cursor': next_cursor,
+    }
@@ -0,0 +1,334 @@
+"""
+Bulk catalog import and export (CSV or JSON Lines)
+
+Imports are read as a stream and written in chunks. Each chunk is validated
+and matched to existing perfumes with one query: by SKU, or by name for rows
+without one. It is then written with one bulk INSERT and one bulk UPDATE by
+primary key, and committed. A row that fails validation, or repeats the
+SKU or name of an earlier row in any chunk, is reported by line and
+skipped; the rest of its chunk is still saved. Only one chunk, plus the
+keys seen so far, is in memory at a time.
+
+A field missing from a row (or from the CSV header) leaves the stored value
+alone, so a file of just `sku,price` reprices the catalog, and `sku,stock`
+sets stock levels (blank: not tracked). New perfumes need name, description,
+price and image_url. Exports write the same fields, so an export can be
+edited and imported again.
+"""
+
+import csv
+import io
+import json
+import math
+import os
+from datetime import datetime
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Perfume
+import notes
+import sales
+import storage
+
+FIELDS = ('sku', 'name', 'description', 'price', 'compare_at_price', 'size', 'notes', 'image_url', 'stock')
+REQUIRED_ON_INSERT = ('name', 'description', 'price', 'image_url')
+NOT_BLANK = {'name', 'description', 'price', 'size', 'image_url'}
+MAX_LENGTHS = {'sku': 64, 'name': 200, 'size': 50, 'notes': 300, 'image_url': 500}
+ATTRIBUTES = {'image_url': 'cloudinary_url'}  # Field name -> Perfume attribute, where they differ
+DEFAULT_SIZE = '50ml'
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+FORMATS = ('csv', 'jsonl')
+MIMETYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+class ImportFormatError(ValueError):
+    """The file can't be read as a catalog at all (unknown format, bad header)"""
+
+
+def detect_format(filename=None, requested=None):
+    fmt = (requested or os.path.splitext(filename or '')[1].lstrip('.')).lower()
+    if fmt in ('ndjson', 'json'):
+        fmt = 'jsonl'
+    if fmt not in FORMATS:
+        raise ImportFormatError(f"format must be one of {', '.join(FORMATS)}")
+    return fmt
+
+
+# ---- Reading ----
+
+def read_csv(stream):
+    """(line, raw dict or None, problem or None) per CSV record"""
+    reader = csv.DictReader(stream)
+    header = [name.strip() for name in reader.fieldnames or []]
+    if 'sku' not in header and 'name' not in header:
+        raise ImportFormatError('CSV header must include a sku or name column')
+    reader.fieldnames = header
+    for raw in reader:
+        if None in raw:
+            yield reader.line_num, None, 'more fields than the header'
+        else:
+            yield reader.line_num, raw, None
+
+
+def read_jsonl(stream):
+    """(line, raw dict or None, problem or None) per non-blank line"""
+    for line, text in enumerate(stream, 1):
+        if not text.strip():
+            continue
+        try:
+            raw = json.loads(text)
+        except ValueError as e:
+            yield line, None, f'invalid JSON: {e}'
+            continue
+        if not isinstance(raw, dict):
+            yield line, None, 'expected a JSON object'
+            continue
+        yield line, raw, None
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+def read_records(stream, fmt):
+    return READERS[fmt](stream)
+
+
+# ---- Validation ----
+
+def clean_row(raw):
+    """Validate the fields present in a row; returns ({Perfume attribute: value}, [errors])"""
+    values, errors = {}, []
+    for field in FIELDS:
+        if field not in raw:
+            continue
+        value = raw[field]
+        if isinstance(value, str):
+            value = value.strip()
+
+        if field in ('price', 'compare_at_price'):
+            if value is None or value == '':
+                if field in NOT_BLANK:
+                    errors.append(f'{field} is required')
+                    continue
+                value = None
+            else:
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    errors.append(f'{field} must be a number')
+                    continue
+                if not math.isfinite(value) or value < 0:
+                    errors.append(f'{field} must be zero or more')
+                    continue
+        elif field == 'stock':
+            if value is None or value == '':
+                value = None  # Not stock-tracked
+            else:
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    errors.append('stock must be a whole number')
+                    continue
+                if value < 0:
+                    errors.append('stock must be zero or more')
+                    continue
+        else:
+            value = '' if value is None else str(value)
+            if not value and field in NOT_BLANK:
+                errors.append(f'{field} is required')
+                continue
+            if len(value) > MAX_LENGTHS.get(field, len(value)):
+                errors.append(f'{field} is longer than {MAX_LENGTHS[field]} characters')
+                continue
+            if field == 'image_url' and not value.startswith(('http://', 'https://', '/')):
+                errors.append('image_url must be an http(s) URL or a path')
+                continue
+            if field == 'sku':
+                value = value or None
+
+        values[ATTRIBUTES.get(field, field)] = value
+
+    if not errors and not values.get('sku') and not values.get('name'):
+        errors.append('sku or name is required')
+    return values, errors
+
+
+def match_key(values):
+    return ('sku', values['sku']) if values.get('sku') else ('name', values['name'])
+
+
+# ---- Import ----
+
+class ImportReport:
+    """Counts for the whole import; the first MAX_REPORTED_ERRORS row errors are kept"""
+
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def to_dict(self):
+        return {
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+def _existing_matches(chunk):
+    """{match key: [rows]} for the perfumes the chunk's keys point at, in one query"""
+    skus = {values['sku'] for _, values in chunk if values.get('sku')}
+    names = {values['name'] for _, values in chunk if not values.get('sku')}
+    criteria = []
+    if skus:
+        criteria.append(Perfume.sku.in_(skus))
+    if names:
+        criteria.append(Perfume.name.in_(names))
+    matches = {}
+    query = db.session.query(Perfume.id, Perfume.sku, Perfume.name, Perfume.cloudinary_url).filter(db.or_(*criteria))
+    for row in query:
+        if row.sku in skus:
+            matches.setdefault(('sku', row.sku), []).append(row)
+        if row.name in names:
+            matches.setdefault(('name', row.name), []).append(row)
+    return matches
+
+
+def _write_chunk(chunk, report, seen):
+    """Upsert one chunk of (line, values) and commit it; seen maps the import's match keys to their first line"""
+    matches = _existing_matches(chunk)
+    inserts, updates = [], []
+    for line, values in chunk:
+        key = match_key(values)
+        if key in seen:
+            report.error(line, f'same {key[0]} as line {seen[key]}')
+            continue
+        seen[key] = line
+        found = matches.get(key, [])
+        if len(found) > 1:
+            report.error(line, f'name matches {len(found)} perfumes; give it a sku')
+        elif found:
+            updates.append((line, found[0], values))
+        else:
+            missing = [field for field in REQUIRED_ON_INSERT if ATTRIBUTES.get(field, field) not in values]
+            if missing:
+                report.error(line, f"new perfume needs {', '.join(missing)}")
+            else:
+                inserts.append((line, values))
+
+    now = datetime.utcnow()
+    relink = {}
+    try:
+        if inserts:
+            rows = [{'sku': None, 'compare_at_price': None, 'size': DEFAULT_SIZE, 'notes': '', 'stock': None,
+                     'created_at': now, **values}
+                    for _, values in inserts]
+            # Keys are unique within the chunk, so ids are matched back by key; asking for
+            # them in parameter order would make SQLite insert one row per statement
+            returned = db.session.execute(Perfume.__table__.insert().returning(Perfume.id, Perfume.sku, Perfume.name), rows)
+            ids = {match_key(row._mapping): row.id for row in returned}
+            for row in rows:
+                storage.acquire(row['cloudinary_url'])
+                if row['notes']:
+                    relink[ids[match_key(row)]] = row['notes']
+            sales.adjust_perfume_count(len(rows))
+
+        if updates:
+            params = []
+            for _, existing, values in updates:
+                values = {'id': existing.id, **values}
+                if 'cloudinary_url' in values and values['cloudinary_url'] != existing.cloudinary_url:
+                    values['image_variants'] = None  # Variants belong to the old upload
+                    storage.release(existing.cloudinary_url)
+                    storage.acquire(values['cloudinary_url'])
+                if 'notes' in values:
+                    relink[existing.id] = values['notes']
+                params.append(values)
+            db.session.execute(db.update(Perfume), params)
+
+        notes.replace_perfume_links(relink)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        # E.g. another import took the same SKU meanwhile; later chunks still run
+        db.session.rollback()
+        for line in sorted([line for line, _ in inserts] + [line for line, _, _ in updates]):
+            report.error(line, f'not saved: {e.__class__.__name__}')
+        return
+    report.inserted += len(inserts)
+    report.updated += len(updates)
+
+
+def import_records(records, chunk_size=CHUNK_SIZE):
+    """Import (line, raw, problem) records from read_records(); returns an ImportReport"""
+    report = ImportReport()
+    chunk = []
+    seen = {}  # Across chunks, so a repeated key is an error whatever the chunk size
+    for line, raw, problem in records:
+        if problem:
+            report.error(line, problem)
+            continue
+        values, errors = clean_row(raw)
+        if errors:
+            report.error(line, '; '.join(errors))
+            continue
+        chunk.append((line, values))
+        if len(chunk) >= chunk_size:
+            _write_chunk(chunk, report, seen)
+            chunk = []
+    if chunk:
+        _write_chunk(chunk, report, seen)
+
+    notes.recount_notes()
+    db.session.commit()
+    return report
+
+
+# ---- Export ----
+
+def export_rows(session, batch_size=CHUNK_SIZE):
+    """Every perfume as {field: value}, in id order, read one keyset batch at a time"""
+    columns = (Perfume.id, Perfume.sku, Perfume.name, Perfume.description, Perfume.price,
+               Perfume.compare_at_price, Perfume.size, Perfume.notes, Perfume.cloudinary_url, Perfume.stock)
+    last_id = 0
+    while True:
+        batch = session.query(*columns).filter(Perfume.id > last_id).order_by(Perfume.id).limit(batch_size).all()
+        if not batch:
+            return
+        for row in batch:
+            yield {field: getattr(row, ATTRIBUTES.get(field, field)) for field in FIELDS}
+        last_id = batch[-1].id
+
+
+def export_chunks(rows, fmt, fields=FIELDS, rows_per_chunk=CHUNK_SIZE):
+    """Encode rows as CSV (with a header) or JSON Lines, yielding text every rows_per_chunk rows"""
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.DictWriter(buffer, fields)
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        def write(row):
+            buffer.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+    pending = 0
+    for row in rows:
+        write(row)
+        pending += 1
+        if pending >= rows_per_chunk:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -10,13 +10,86 @@ class Config:
         SQLALCHEMY_DATABASE_URI = SQLALCHEMY_DATABASE_URI.replace("postgres://", "postgresql://", 1)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Engine pools (database.py) are per worker process: Postgres needs
+    # max_connections >= workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW), plus headroom for maintenance
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))  # Seconds to wait for a free connection
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))  # Reconnect before server/proxy idle timeouts
+    SQLITE_WAL = os.getenv('SQLITE_WAL', 'true').lower() in ('1', 'true', 'yes')
+    SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', '5'))  # Seconds a writer waits for the lock
+    
+    # Optional read replica for catalog, search and admin reads; they stay on the primary
+    # for DATABASE_REPLICA_LAG seconds after a catalog write so caches never fill from stale rows
+    DATABASE_REPLICA_URL = os.getenv('DATABASE_REPLICA_URL')
+    if DATABASE_REPLICA_URL and DATABASE_REPLICA_URL.startswith("postgres://"):
+        DATABASE_REPLICA_URL = DATABASE_REPLICA_URL.replace("postgres://", "postgresql://", 1)
+    DATABASE_REPLICA_LAG = float(os.getenv('DATABASE_REPLICA_LAG', '5'))
+    
     # File Uploads
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', os.path.join(os.getcwd(), 'static', 'uploads'))
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp', 'gif'}
     
+    # Upload storage: 'local' (UPLOAD_FOLDER, served from /static/uploads) or 's3' (needs boto3)
+    STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local')
+    S3_BUCKET = os.getenv('S3_BUCKET')
+    S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')  # e.g. MinIO or fake_s3.py; unset for AWS
+    S3_PUBLIC_URL = os.getenv('S3_PUBLIC_URL')  # Base URL browsers load objects from, e.g. a CDN
+    S3_PREFIX = os.getenv('S3_PREFIX', '')
+    S3_REGION = os.getenv('S3_REGION')
+    
+    # Upload variants (images.py): widths in pixels, encoder processes, WebP/AVIF/JPEG quality
+    IMAGE_VARIANT_WIDTHS = tuple(int(w) for w in os.getenv('IMAGE_VARIANT_WIDTHS', '320,640,1024,1600').split(','))
+    IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '2'))
+    IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', '80'))
+    IMAGE_AVIF = os.getenv('IMAGE_AVIF', 'true').lower() in ('1', 'true', 'yes')  # Only if Pillow has AVIF support
+    
+    # Fingerprinted, precompressed copies of static/ (assets.py), rebuilt at startup when a file changed
+    ASSET_BUILD_DIR = os.getenv('ASSET_BUILD_DIR', os.path.join(os.getcwd(), 'instance', 'assets'))
+    
+    # In-process caches: writers touch files here so every worker on the host invalidates
+    CACHE_STAMP_DIR = os.getenv('CACHE_STAMP_DIR', os.path.join(os.getcwd(), 'instance', 'cache'))
+    
+    # Full-page cache for anonymous storefront views: total body size, and seconds per route (0 disables)
+    PAGE_CACHE_MAX_BYTES = int(os.getenv('PAGE_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+    PAGE_CACHE_TTL_INDEX = int(os.getenv('PAGE_CACHE_TTL_INDEX', '60'))
+    PAGE_CACHE_TTL_SHOP = int(os.getenv('PAGE_CACHE_TTL_SHOP', '60'))
+    PAGE_CACHE_TTL_PRODUCT = int(os.getenv('PAGE_CACHE_TTL_PRODUCT', '300'))
+    
+    # Server-side carts: 'sql' works across workers, 'memory' is per-process (development)
+    CART_BACKEND = os.getenv('CART_BACKEND', 'sql')
+    CART_TTL = int(os.getenv('CART_TTL', str(30 * 24 * 3600)))  # Seconds a cart may sit idle
+    CART_MEMORY_MAX_CARTS = int(os.getenv('CART_MEMORY_MAX_CARTS', '10000'))
+    
+    # Stock holds taken when a payment starts: seconds they last unpaid, and how often each
+    # worker's sweeper gives expired ones back (0 disables; run `flask release-reservations` instead)
+    RESERVATION_TTL = int(os.getenv('RESERVATION_TTL', '900'))
+    RESERVATION_SWEEP_INTERVAL = float(os.getenv('RESERVATION_SWEEP_INTERVAL', '30'))
+    
+    # Seconds each worker may reuse a perfume's price at checkout (perfume edits invalidate sooner)
+    PRICE_CACHE_TTL = int(os.getenv('PRICE_CACHE_TTL', '30'))
+    
+    # Instrumentation: requests slower than this are logged with their SQL; the token lets
+    # a Prometheus scraper read /admin/metrics without an admin session
+    SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', '500'))
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+    
     # Paystack
     PAYSTACK_SECRET_KEY = os.getenv('PAYSTACK_SECRET_KEY')
     PAYSTACK_PUBLIC_KEY = os.getenv('PAYSTACK_PUBLIC_KEY')
+    PAYSTACK_BASE_URL = os.getenv('PAYSTACK_BASE_URL', 'https://api.paystack.co')  # Point at fake_paystack.py for offline testing
+    PAYSTACK_CONNECT_TIMEOUT = float(os.getenv('PAYSTACK_CONNECT_TIMEOUT', '3.05'))
+    PAYSTACK_READ_TIMEOUT = float(os.getenv('PAYSTACK_READ_TIMEOUT', '10'))
+    PAYSTACK_MAX_RETRIES = int(os.getenv('PAYSTACK_MAX_RETRIES', '2'))
+    PAYSTACK_BREAKER_THRESHOLD = int(os.getenv('PAYSTACK_BREAKER_THRESHOLD', '5'))  # Consecutive failures before failing fast
+    PAYSTACK_BREAKER_RESET = float(os.getenv('PAYSTACK_BREAKER_RESET', '30'))  # Seconds before a trial call
+    
+    # Webhook queue workers (set threads to 0 when running `flask webhooks-work` separately)
+    WEBHOOK_WORKER_THREADS = int(os.getenv('WEBHOOK_WORKER_THREADS', '2'))
+    WEBHOOK_BATCH_SIZE = int(os.getenv('WEBHOOK_BATCH_SIZE', '50'))
+    WEBHOOK_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', '8'))  # Then the event is parked as dead
+    WEBHOOK_POLL_INTERVAL = float(os.getenv('WEBHOOK_POLL_INTERVAL', '1.0'))
+    WEBHOOK_VISIBILITY_TIMEOUT = int(os.getenv('WEBHOOK_VISIBILITY_TIMEOUT', '300'))  # Seconds before a stuck claim is retried
     
     # Admin
     ADMIN_USERNAME = os.getenv('ADMIN_USERNAME', 'admin')
@@ -0,0 +1,188 @@
+"""
+Database engine configuration
+
+configure(config) fills in SQLALCHEMY_ENGINE_OPTIONS and the optional
+read-replica bind before db.init_app(app); init_app() then finishes the
+engines once they exist:
+
+- SQLite runs in WAL mode with a busy timeout, so readers don't wait
+  behind a writer and writers wait instead of failing with "database is
+  locked".
+- Other databases get a pre-pinged, recycled pool sized per gunicorn worker.
+- Pools are replaced in forked children (gunicorn --preload), and their
+  checkout waits, overflow and timeouts are exported at /admin/metrics.
+
+read_session() is for catalog and admin reads that can tolerate replication
+lag. It uses DATABASE_REPLICA_URL when set, and the primary otherwise, or
+for a few seconds after a watched write.
+"""
+
+import os
+import threading
+import time
+
+from flask import g
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+
+import metrics
+
+REPLICA = 'replica'
+
+SQLITE_PRAGMAS = (
+    'PRAGMA synchronous=NORMAL',  # Durable at each checkpoint; safe with WAL
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-20000',  # KiB, per connection
+)
+
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+pool_waits = metrics.Histogram('db_pool_checkout_wait_seconds', 'Time to get a connection from the pool',
+                               ('bind',), POOL_WAIT_BUCKETS)
+pool_events = {}  # (bind, event) -> count
+_pool_events_lock = threading.Lock()
+
+
+def _count(bind, name):
+    with _pool_events_lock:
+        pool_events[(bind, name)] = pool_events.get((bind, name), 0) + 1
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited; subclassed per bind for the label"""
+
+    bind = 'default'
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeout:
+            _count(self.bind, 'timeouts')
+            raise
+        finally:
+            pool_waits.observe(time.perf_counter() - started, self.bind)
+        if self.overflow() > 0:
+            _count(self.bind, 'overflow_checkouts')
+        return connection
+
+
+def is_sqlite_memory(url):
+    return url in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in url
+
+
+def engine_options(url, config, bind='default'):
+    if is_sqlite_memory(url):
+        return {}  # Flask-SQLAlchemy shares one connection
+    pool_class = type(f'InstrumentedQueuePool_{bind}', (InstrumentedQueuePool,), {'bind': bind})
+    options = {
+        'poolclass': pool_class,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+    }
+    if url.startswith('sqlite'):
+        # Seconds a writer waits for the lock before "database is locked"
+        options['connect_args'] = {'timeout': config['SQLITE_BUSY_TIMEOUT']}
+    else:
+        options['pool_pre_ping'] = True  # Survives server restarts and idle disconnects
+        options['pool_recycle'] = config['DB_POOL_RECYCLE']
+    return options
+
+
+def configure(config):
+    """Engine options and binds for Flask-SQLAlchemy; call before db.init_app(app)"""
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(config['SQLALCHEMY_DATABASE_URI'], config)
+    replica_url = config.get('DATABASE_REPLICA_URL')
+    if replica_url:
+        config['SQLALCHEMY_BINDS'] = {
+            REPLICA: {'url': replica_url, **engine_options(replica_url, config, bind=REPLICA)},
+        }
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+class ReadReplica:
+    """Routes read_session() to the replica engine, unless a watched stamp was bumped recently"""
+
+    def __init__(self):
+        self.engine = None
+        self.lag = 0
+        self.stamps = []
+
+    def watch(self, stamp):
+        """Use the primary for `lag` seconds after this stamp is bumped, so caches aren't filled from stale rows"""
+        self.stamps.append(stamp)
+
+    def recently_written(self):
+        now = time.time_ns()
+        return any(now - stamp.read() < self.lag * 1e9 for stamp in self.stamps)
+
+
+replica = ReadReplica()
+
+
+def init_app(app, db):
+    """Per-engine setup; call after db.init_app(app) and before the first query"""
+    with app.app_context():
+        engines = dict(db.engines)
+
+    for engine in engines.values():
+        if engine.dialect.name == 'sqlite' and app.config['SQLITE_WAL'] and not is_sqlite_memory(str(engine.url)):
+            event.listen(engine, 'connect', _set_sqlite_pragmas)
+
+    # A pool copied into a forked worker would share sockets with its parent
+    def reset_pools():
+        for engine in engines.values():
+            engine.dispose(close=False)
+    os.register_at_fork(after_in_child=reset_pools)
+
+    replica.engine = engines.get(REPLICA)
+    replica.lag = app.config['DATABASE_REPLICA_LAG']
+
+    @app.teardown_appcontext
+    def close_replica_session(exc=None):
+        session = g.pop('replica_session', None)
+        if session is not None:
+            session.close()
+
+
+def read_session():
+    """Session for reads that may lag the primary slightly (catalog, search, admin lists)"""
+    from models import db
+    if replica.engine is None or replica.recently_written():
+        return db.session
+    if 'replica_session' not in g:
+        g.replica_session = Session(bind=replica.engine)
+    return g.replica_session
+
+
+def pool_metric_lines(engines):
+    """Exposition lines for pool state and the recorded checkout waits"""
+    gauges = []
+    for name, engine in sorted(engines.items(), key=lambda item: str(item[0])):
+        pool = engine.pool
+        if not isinstance(pool, QueuePool):
+            continue
+        bind = name or 'default'
+        gauges.extend([
+            ({'bind': bind, 'state': 'size'}, pool.size()),
+            ({'bind': bind, 'state': 'checked_out'}, pool.checkedout()),
+            ({'bind': bind, 'state': 'idle'}, pool.checkedin()),
+            ({'bind': bind, 'state': 'overflow'}, max(pool.overflow(), 0)),
+        ])
+    with _pool_events_lock:
+        counts = sorted(pool_events.items())
+    return (
+        metrics.render_samples('db_pool_connections', 'gauge', 'Connections per pool state', gauges)
+        + metrics.render_samples('db_pool_events_total', 'counter', 'Checkouts beyond pool_size, and pool timeouts',
+                                 [({'bind': bind, 'event': name}, count) for (bind, name), count in counts])
+        + pool_waits.render()
+    )
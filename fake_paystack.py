@@ -0,0 +1,138 @@
+"""
+Local stand-in for the Paystack API, for offline testing and benchmarks
+
+Implements transaction initialize/verify, a hosted "checkout" page that
+marks the transaction paid and redirects to the callback URL, and signed
+charge.success webhooks. Latency and failure rate can be injected to
+exercise the client's timeouts, retries and circuit breaker.
+
+Usage:
+    python fake_paystack.py --port 5055 --secret sk_test_local \\
+        --webhook-url http://localhost:5002/api/paystack/webhook
+    PAYSTACK_BASE_URL=http://localhost:5055 PAYSTACK_SECRET_KEY=sk_test_local python app.py
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+import uuid
+
+import requests
+from flask import Flask, jsonify, redirect, request
+
+
+def create_fake_paystack(secret_key, latency=0.0, failure_rate=0.0, webhook_url=None):
+    fake = Flask(__name__)
+    fake.config['FAKE'] = {
+        'latency': latency,
+        'failure_rate': failure_rate,
+        'webhook_url': webhook_url,
+    }
+    transactions = {}
+    lock = threading.Lock()
+
+    def sign(body):
+        return hmac.new(secret_key.encode('utf-8'), body, hashlib.sha512).hexdigest()
+
+    def send_webhook(txn):
+        url = fake.config['FAKE']['webhook_url']
+        if not url:
+            return
+        body = json.dumps({'event': 'charge.success', 'data': txn}).encode('utf-8')
+        try:
+            requests.post(url, data=body, timeout=5, headers={
+                'Content-Type': 'application/json',
+                'x-paystack-signature': sign(body),
+            })
+        except requests.RequestException as e:
+            print(f"Webhook delivery failed: {e}")
+
+    @fake.before_request
+    def inject_faults():
+        if request.path.startswith('/_control') or request.path.startswith('/pay/'):
+            return None
+        settings = fake.config['FAKE']
+        if settings['latency']:
+            time.sleep(settings['latency'])
+        if random.random() < settings['failure_rate']:
+            return jsonify({'status': False, 'message': 'Injected failure'}), 503
+        if request.headers.get('Authorization') != f'Bearer {secret_key}':
+            return jsonify({'status': False, 'message': 'Invalid key'}), 401
+        return None
+
+    @fake.route('/transaction/initialize', methods=['POST'])
+    def initialize():
+        data = request.json or {}
+        if not data.get('email') or not data.get('amount'):
+            return jsonify({'status': False, 'message': 'email and amount are required'}), 400
+        reference = data.get('reference') or uuid.uuid4().hex[:12]
+        txn = {
+            'reference': reference,
+            'amount': int(data['amount']),
+            'currency': data.get('currency', 'NGN'),
+            'customer': {'email': data['email']},
+            'metadata': data.get('metadata', {}),
+            'callback_url': data.get('callback_url'),
+            'status': 'abandoned',
+        }
+        with lock:
+            transactions[reference] = txn
+        return jsonify({
+            'status': True,
+            'message': 'Authorization URL created',
+            'data': {
+                'authorization_url': f"{request.host_url.rstrip('/')}/pay/{reference}",
+                'access_code': uuid.uuid4().hex[:16],
+                'reference': reference,
+            },
+        })
+
+    @fake.route('/transaction/verify/<reference>')
+    def verify(reference):
+        with lock:
+            txn = transactions.get(reference)
+        if not txn:
+            return jsonify({'status': False, 'message': 'Transaction reference not found'}), 400
+        return jsonify({'status': True, 'message': 'Verification successful', 'data': txn})
+
+    @fake.route('/pay/<reference>')
+    def pay(reference):
+        """Hosted checkout: approve the charge, fire the webhook, return to the shop"""
+        with lock:
+            txn = transactions.get(reference)
+            if not txn:
+                return 'Unknown transaction', 404
+            txn['status'] = 'success'
+        send_webhook(txn)
+        if txn['callback_url']:
+            return redirect(f"{txn['callback_url']}?trxref={reference}&reference={reference}")
+        return 'Payment approved'
+
+    @fake.route('/_control', methods=['POST'])
+    def control():
+        """Adjust latency, failure_rate or webhook_url at runtime"""
+        fake.config['FAKE'].update({
+            key: value for key, value in (request.json or {}).items()
+            if key in fake.config['FAKE']
+        })
+        return jsonify(fake.config['FAKE'])
+
+    return fake
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local fake Paystack API')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--secret', default='sk_test_local')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every API call')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of API calls answered with 503')
+    parser.add_argument('--webhook-url', default=None)
+    args = parser.parse_args()
+
+    create_fake_paystack(args.secret, args.latency, args.failure_rate, args.webhook_url).run(
+        port=args.port, threaded=True
+    )
@@ -0,0 +1,106 @@
+"""
+Local stand-in for an S3-compatible object store, for offline testing
+
+Implements the path-style calls storage.S3Storage makes: PutObject,
+GetObject, HeadObject, DeleteObject and ListObjectsV2. Objects are kept in
+memory and readable without credentials at /<bucket>/<key>, like a public
+bucket. Request signatures are not checked. For anything closer to real S3,
+run MinIO instead.
+
+Usage:
+    python fake_s3.py --port 5060
+    STORAGE_BACKEND=s3 S3_BUCKET=uploads S3_ENDPOINT_URL=http://localhost:5060 \\
+        S3_PUBLIC_URL=http://localhost:5060/uploads \\
+        AWS_ACCESS_KEY_ID=test AWS_SECRET_ACCESS_KEY=test python app.py
+"""
+
+import argparse
+import hashlib
+import threading
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+
+from flask import Flask, Response, request
+
+
+def create_fake_s3():
+    fake = Flask(__name__)
+    objects = {}  # (bucket, key) -> {'body', 'content_type', 'cache_control', 'etag', 'modified'}
+    lock = threading.Lock()
+
+    def not_found(key):
+        body = f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>NoSuchKey</Code><Key>{escape(key)}</Key></Error>'
+        return Response(body, status=404, mimetype='application/xml')
+
+    def headers(obj):
+        return {
+            'ETag': obj['etag'],
+            'Last-Modified': obj['modified'].strftime('%a, %d %b %Y %H:%M:%S GMT'),
+            'Cache-Control': obj['cache_control'] or '',
+            'Content-Length': str(len(obj['body'])),
+        }
+
+    @fake.route('/<bucket>', methods=['GET'])
+    def list_objects(bucket):
+        prefix = request.args.get('prefix', '')
+        max_keys = int(request.args.get('max-keys', 1000))
+        after = request.args.get('continuation-token') or request.args.get('start-after') or ''
+        with lock:
+            keys = sorted(k for b, k in objects if b == bucket and k.startswith(prefix) and k > after)
+            page = keys[:max_keys]
+            entries = ''.join(
+                f"<Contents><Key>{escape(k)}</Key>"
+                f"<LastModified>{objects[(bucket, k)]['modified'].strftime('%Y-%m-%dT%H:%M:%S.000Z')}</LastModified>"
+                f"<ETag>{objects[(bucket, k)]['etag']}</ETag><Size>{len(objects[(bucket, k)]['body'])}</Size>"
+                f"<StorageClass>STANDARD</StorageClass></Contents>"
+                for k in page
+            )
+        truncated = len(keys) > max_keys
+        token = f'<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>' if truncated else ''
+        body = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            f'<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix><KeyCount>{len(page)}</KeyCount>'
+            f'<MaxKeys>{max_keys}</MaxKeys><IsTruncated>{str(truncated).lower()}</IsTruncated>{token}{entries}'
+            '</ListBucketResult>'
+        )
+        return Response(body, mimetype='application/xml')
+
+    @fake.route('/<bucket>/<path:key>', methods=['PUT'])
+    def put_object(bucket, key):
+        body = request.get_data()
+        obj = {
+            'body': body,
+            'content_type': request.headers.get('Content-Type', 'binary/octet-stream'),
+            'cache_control': request.headers.get('Cache-Control'),
+            'etag': f'"{hashlib.md5(body).hexdigest()}"',
+            'modified': datetime.now(timezone.utc),
+        }
+        with lock:
+            objects[(bucket, key)] = obj
+        return Response(status=200, headers={'ETag': obj['etag']})
+
+    @fake.route('/<bucket>/<path:key>', methods=['GET', 'HEAD'])
+    def get_object(bucket, key):
+        with lock:
+            obj = objects.get((bucket, key))
+        if obj is None:
+            return not_found(key)
+        return Response(obj['body'] if request.method == 'GET' else b'', mimetype=obj['content_type'],
+                        headers=headers(obj))
+
+    @fake.route('/<bucket>/<path:key>', methods=['DELETE'])
+    def delete_object(bucket, key):
+        with lock:
+            objects.pop((bucket, key), None)
+        return Response(status=204)
+
+    return fake
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local fake S3 object store')
+    parser.add_argument('--port', type=int, default=5060)
+    args = parser.parse_args()
+
+    create_fake_s3().run(port=args.port, threaded=True)
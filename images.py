@@ -0,0 +1,192 @@
+"""
+Upload image pipeline
+
+Each upload is decoded once in a worker process, rotated upright, stripped
+of EXIF/XMP metadata and resized to a few widths. Every width is encoded as
+WebP (plus AVIF where Pillow supports it) and in the upload's own format as
+the fallback. Files are content-addressed by the SHA-256 of the uploaded
+bytes, so re-uploading the same photo reuses the existing variants:
+
+    ab/abcdef.../640w.webp
+    ab/abcdef.../manifest.json
+
+The keys live in a storage.py backend. The manifest is what gets stored on
+the perfume (Perfume.image_variants).
+"""
+
+import io
+import json
+import mimetypes
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+# Upload format -> (fallback Pillow format, extension, MIME type)
+FALLBACK_FORMATS = {
+    'JPEG': ('JPEG', 'jpg', 'image/jpeg'),
+    'PNG': ('PNG', 'png', 'image/png'),
+    'GIF': ('PNG', 'png', 'image/png'),  # First frame only
+    'WEBP': ('WEBP', 'webp', 'image/webp'),
+}
+MODERN_FORMATS = (('WEBP', 'webp', 'image/webp'), ('AVIF', 'avif', 'image/avif'))
+
+# Static file serving guesses Content-Type from the extension; Python < 3.11 doesn't know .avif
+mimetypes.add_type('image/avif', '.avif')
+
+
+class ImageError(ValueError):
+    pass
+
+
+def blob_prefix(digest):
+    # Two-character fan-out keeps directory listings short on local disk
+    return f'{digest[:2]}/{digest}/'
+
+
+def _encode(image, fmt, quality):
+    buffer = io.BytesIO()
+    if fmt == 'JPEG':
+        image.convert('RGB').save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+    elif fmt == 'PNG':
+        image.save(buffer, 'PNG', optimize=True)
+    else:
+        image.save(buffer, fmt, quality=quality)
+    return buffer.getvalue()
+
+
+def process_image(data, widths, quality=80, avif=True):
+    """Decode, normalize and encode every variant. Runs in a worker process.
+
+    Returns {'width', 'height', 'files': {name: bytes}, 'variants': [...]}
+    with variant widths ascending. Raises ImageError for unreadable uploads.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            source_format = source.format
+            source.seek(0)
+            # Apply the EXIF orientation, then drop EXIF along with everything else in .info
+            image = ImageOps.exif_transpose(source)
+            image.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise ImageError(f'Unreadable image: {e}')
+    if source_format not in FALLBACK_FORMATS:
+        raise ImageError(f'Unsupported image format: {source_format}')
+
+    if image.mode not in ('RGB', 'RGBA'):
+        has_alpha = image.mode in ('LA', 'PA') or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+    image.info = {}
+
+    fallback = FALLBACK_FORMATS[source_format]
+    formats = [fmt for fmt in MODERN_FORMATS if fmt[0] != 'AVIF' or (avif and features.check('avif'))]
+    if fallback not in formats:
+        formats.append(fallback)
+
+    # Never upscale: widths above the original collapse into the original width
+    targets = sorted({min(width, image.width) for width in widths})
+
+    files = {}
+    variants = []
+    for width in targets:
+        if width == image.width:
+            resized = image
+        else:
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.LANCZOS)
+        for fmt, ext, mime in formats:
+            name = f'{width}w.{ext}'
+            files[name] = _encode(resized, fmt, quality)
+            variants.append({'width': width, 'type': mime, 'file': name})
+
+    return {
+        'width': image.width,
+        'height': image.height,
+        'fallback_type': fallback[2],
+        'files': files,
+        'variants': variants,
+    }
+
+
+class ImagePipeline:
+    """Stores uploads as content-addressed variant sets, encoding in a process pool"""
+
+    def __init__(self, storage, widths, workers=2, quality=80, avif=True, timeout=120):
+        self.storage = storage
+        self.widths = widths
+        self.workers = workers
+        self.quality = quality
+        self.avif = avif
+        self.timeout = timeout
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, storage):
+        return cls(
+            storage=storage,
+            widths=config['IMAGE_VARIANT_WIDTHS'],
+            workers=config['IMAGE_WORKERS'],
+            quality=config['IMAGE_QUALITY'],
+            avif=config['IMAGE_AVIF'],
+        )
+
+    def _pool(self):
+        with self._lock:
+            # A pool inherited through fork (gunicorn --preload) can't be used by the child
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    # spawn: forking a process with live request threads can copy held locks
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def store(self, digest, data):
+        """Process and store an upload (digest: its SHA-256); returns its manifest"""
+        prefix = blob_prefix(digest)
+        manifest_key = prefix + 'manifest.json'
+        if self.storage.exists(manifest_key):
+            return json.loads(self.storage.get(manifest_key))
+
+        # The request thread only waits; decoding and encoding happen in another process
+        future = self._pool().submit(process_image, data, self.widths, self.quality, self.avif)
+        try:
+            result = future.result(self.timeout)
+        except FutureTimeout:
+            future.cancel()  # Only helps if it hasn't started; a running worker finishes on its own
+            raise ImageError(f'Image took longer than {self.timeout}s to process')
+        except BrokenProcessPool:
+            # e.g. a worker killed for running out of memory; start a fresh pool next time
+            with self._lock:
+                self._executor = None
+            raise ImageError('Image worker crashed while processing the upload')
+
+        types = {v['file']: v['type'] for v in result['variants']}
+        for name, content in result['files'].items():
+            self.storage.put(prefix + name, content, types[name])
+
+        variants = [{'width': v['width'], 'type': v['type'], 'url': self.storage.url(prefix + v['file'])}
+                    for v in result['variants']]
+        manifest = {
+            'digest': digest,
+            'width': result['width'],
+            'height': result['height'],
+            # Largest fallback-format variant, for plain <img src> and old clients
+            'src': [v['url'] for v in variants if v['type'] == result['fallback_type']][-1],
+            'variants': variants,
+        }
+        # Written last: its presence means every variant is stored
+        self.storage.put(manifest_key, json.dumps(manifest).encode('utf-8'), 'application/json')
+        return manifest
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
@@ -0,0 +1,240 @@
+"""
+Stock levels and checkout reservations
+
+Perfume.stock counts the units still free to sell; None means the perfume
+isn't stock-tracked. Starting a payment takes its units right away with a
+conditional decrement per line:
+
+    UPDATE perfumes SET stock = stock - :n WHERE id = :id AND (stock IS NULL OR stock >= :n)
+
+Concurrent checkouts of the last units therefore serialize on the row and
+can't both succeed; there is no read-modify-write to race. The units taken
+are recorded as `held` reservations with an expiry. Confirming the order
+marks them `converted`. A sweeper marks expired ones `released` and gives
+their units back. Both are conditional on status = 'held', so a hold is
+either sold or released, never both.
+"""
+
+import threading
+import traceback
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, select, update
+
+from models import db, Perfume, StockReservation
+import order_items
+
+HELD = 'held'
+CONVERTED = 'converted'
+RELEASED = 'released'
+
+
+class OutOfStock(Exception):
+    """Some lines couldn't be reserved; nothing was taken"""
+
+    def __init__(self, ids):
+        super().__init__(f'Not enough stock for perfumes {ids}')
+        self.ids = ids
+
+
+def _merge_lines(quantities):
+    """[(perfume_id, quantity)] with duplicates summed, in id order so transactions lock rows in one sequence"""
+    merged = defaultdict(int)
+    for perfume_id, quantity in quantities:
+        if quantity > 0:
+            merged[int(perfume_id)] += int(quantity)
+    return sorted(merged.items())
+
+
+def _adjust_stock(lines, sign):
+    for perfume_id, quantity in lines:
+        db.session.execute(
+            update(Perfume)
+            .where(Perfume.id == perfume_id)
+            .values(stock=Perfume.stock + sign * quantity)  # NULL (untracked) stays NULL
+            .execution_options(synchronize_session=False)
+        )
+
+
+def _take(reference, lines, expires_at):
+    with db.session.begin_nested():
+        short, taken = [], []
+        for perfume_id, quantity in lines:
+            remaining = db.session.execute(
+                update(Perfume)
+                .where(Perfume.id == perfume_id, or_(Perfume.stock.is_(None), Perfume.stock >= quantity))
+                .values(stock=Perfume.stock - quantity)
+                .returning(Perfume.stock)
+                .execution_options(synchronize_session=False)
+            ).first()
+            if remaining is None:
+                short.append(perfume_id)
+            elif remaining.stock is not None:
+                taken.append((perfume_id, quantity))  # Untracked perfumes have nothing to hold
+        if short:
+            raise OutOfStock(short)  # Rolls the savepoint back, returning what was taken
+        if taken:
+            db.session.execute(StockReservation.__table__.insert(), [
+                {'reference': reference, 'perfume_id': perfume_id, 'quantity': quantity,
+                 'status': HELD, 'created_at': datetime.utcnow(), 'expires_at': expires_at}
+                for perfume_id, quantity in taken
+            ])
+
+
+def reserve(reference, quantities, ttl):
+    """Hold stock for a checkout for `ttl` seconds; quantities is [(perfume_id, quantity)].
+
+    Raises OutOfStock, having taken nothing, if any line is short. Caller commits.
+    """
+    lines = _merge_lines(quantities)
+    expires_at = datetime.utcnow() + timedelta(seconds=ttl)
+    try:
+        _take(reference, lines, expires_at)
+    except OutOfStock as e:
+        # Expired holds the sweeper hasn't reached yet still count against stock
+        if not release_expired(perfume_ids=e.ids):
+            raise
+        _take(reference, lines, expires_at)
+
+
+def _release_where(*criteria):
+    released = db.session.execute(
+        update(StockReservation)
+        .where(StockReservation.status == HELD, *criteria)
+        .values(status=RELEASED)
+        .returning(StockReservation.perfume_id, StockReservation.quantity)
+        .execution_options(synchronize_session=False)
+    ).all()
+    _adjust_stock(_merge_lines(released), 1)
+    return len(released)
+
+
+def release(reference):
+    """Give back a checkout's held units (payment failed or was replaced). Caller commits."""
+    return _release_where(StockReservation.reference == reference)
+
+
+def release_expired(perfume_ids=None, batch_size=500):
+    """Give back held units past their expiry, optionally only for some perfumes. Returns holds released.
+    Caller commits."""
+    criteria = [StockReservation.expires_at <= datetime.utcnow()]
+    if perfume_ids:
+        criteria.append(StockReservation.perfume_id.in_(perfume_ids))
+    expired = (
+        select(StockReservation.id)
+        .where(StockReservation.status == HELD, *criteria)
+        .order_by(StockReservation.expires_at)
+        .limit(batch_size)
+    )
+    return _release_where(StockReservation.id.in_(expired))
+
+
+def record_orders_created(created, rows):
+    """Convert the holds of newly created orders; created is {payment_ref: order_id}. Caller commits.
+
+    A paid order whose hold already expired (or that never had one) takes its
+    units now, unconditionally: the customer has paid, so stock may go negative
+    and show the oversell rather than lose it.
+    """
+    references = [row['payment_ref'] for row in rows if row['payment_ref'] in created]
+    if not references:
+        return
+    converted = set(db.session.execute(
+        update(StockReservation)
+        .where(StockReservation.reference.in_(references), StockReservation.status == HELD)
+        .values(status=CONVERTED)
+        .returning(StockReservation.reference)
+        .execution_options(synchronize_session=False)
+    ).scalars())
+    late = [
+        (item['perfume_id'], item['quantity'])
+        for row in rows if row['payment_ref'] in created and row['payment_ref'] not in converted
+        for item in order_items.item_rows(None, None, row.get('items_json'))
+    ]
+    _adjust_stock(_merge_lines(late), -1)
+
+
+def set_stock(perfume_id, stock):
+    """Set units free to sell (None stops tracking); returns False if there is no such perfume. Caller commits."""
+    result = db.session.execute(
+        update(Perfume).where(Perfume.id == perfume_id).values(stock=stock)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount > 0
+
+
+def adjust_stock(perfume_id, delta):
+    """Add delta units in one statement, e.g. a delivery; returns the new stock, or None if the
+    perfume doesn't exist or isn't tracked. Caller commits."""
+    return db.session.execute(
+        update(Perfume)
+        .where(Perfume.id == perfume_id, Perfume.stock.isnot(None))
+        .values(stock=Perfume.stock + delta)
+        .returning(Perfume.stock)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+
+
+def levels():
+    """Stock and units currently held, per tracked perfume"""
+    held = dict(
+        db.session.query(StockReservation.perfume_id, db.func.sum(StockReservation.quantity))
+        .filter(StockReservation.status == HELD)
+        .group_by(StockReservation.perfume_id)
+    )
+    perfumes = (
+        db.session.query(Perfume.id, Perfume.sku, Perfume.name, Perfume.stock)
+        .filter(Perfume.stock.isnot(None))
+        .order_by(Perfume.stock, Perfume.id)
+    )
+    return [{'perfume_id': p.id, 'sku': p.sku, 'name': p.name, 'stock': p.stock, 'held': held.get(p.id, 0)}
+            for p in perfumes]
+
+
+class ReservationSweeper:
+    """Background thread releasing expired holds every `interval` seconds"""
+
+    def __init__(self, app, interval=30):
+        self.app = app
+        self.interval = interval
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, app):
+        return cls(app, interval=app.config['RESERVATION_SWEEP_INTERVAL'])
+
+    def start(self):
+        with self._lock:
+            if self._thread or self.interval <= 0:
+                return
+            self._thread = threading.Thread(target=self._run, name='reservation-sweeper', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+
+    def sweep(self):
+        """Release every expired hold, a batch per transaction. Returns holds released."""
+        total = 0
+        while True:
+            released = release_expired()
+            db.session.commit()
+            total += released
+            if not released:
+                return total
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    self.sweep()
+                except Exception:
+                    db.session.rollback()
+                    traceback.print_exc()
+                finally:
+                    db.session.remove()
@@ -0,0 +1,202 @@
+"""
+Request instrumentation and Prometheus text exposition
+
+RequestMetrics times every request by endpoint, counts the SQL each one
+issues (SQLAlchemy engine events) and times template rendering (Flask's
+template signals). Histograms are cumulative per worker, like the Paystack
+CallStats, and rendered in the Prometheus text format by render(). Requests
+slower than the threshold are logged with the statements they ran.
+
+Recording is a dict update under a lock per event, cheap enough to leave
+on in production.
+"""
+
+import threading
+import time
+
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SLOW_LOG_MAX_STATEMENTS = 50
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class Histogram:
+    """Observations bucketed per label set; rendered with cumulative buckets"""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {'count': 0, 'sum': 0.0, 'buckets': [0] * len(self.buckets)}
+            series['count'] += 1
+            series['sum'] += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+                    break
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {labels: (s['count'], s['sum'], list(s['buckets'])) for labels, s in self._series.items()}
+        for labels, (count, total, buckets) in sorted(series.items()):
+            cumulative = 0
+            for bound, in_bucket in zip(self.buckets, buckets):
+                cumulative += in_bucket
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, [("le", _format_value(bound))])} {cumulative}')
+            lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, [("le", "+Inf")])} {count}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+def render_samples(name, kind, help_text, samples):
+    """Lines for a counter or gauge; samples is [(labels dict, value)]"""
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+    for labels, value in samples:
+        lines.append(f'{name}{_labels(labels.keys(), labels.values())} {_format_value(value)}')
+    return lines
+
+
+def render_call_stats(name, help_text, snapshot):
+    """A paystack.CallStats snapshot (already cumulative buckets) as a histogram"""
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for operation, op in sorted(snapshot.items()):
+        for bound, count in op['buckets'].items():
+            lines.append(f'{name}_bucket{_labels(("operation", "le"), (operation, _format_value(bound)))} {count}')
+        lines.append(f'{name}_bucket{_labels(("operation", "le"), (operation, "+Inf"))} {op["count"]}')
+        lines.append(f'{name}_sum{_labels(("operation",), (operation,))} {_format_value(op["sum_seconds"])}')
+        lines.append(f'{name}_count{_labels(("operation",), (operation,))} {op["count"]}')
+    return lines
+
+
+class RequestMetrics:
+    """Per-endpoint latency, SQL and template timings for one Flask app"""
+
+    def __init__(self, slow_request_ms=500):
+        self.slow_request_ms = slow_request_ms
+        self.requests = Histogram('http_request_duration_seconds', 'Request latency by endpoint',
+                                  ('endpoint', 'method', 'status'))
+        self.request_queries = Histogram('http_request_db_queries', 'SQL statements issued per request',
+                                         ('endpoint',), QUERY_COUNT_BUCKETS)
+        self.request_db_time = Histogram('http_request_db_duration_seconds', 'Time per request spent in SQL',
+                                         ('endpoint',))
+        self.queries = Histogram('db_query_duration_seconds', 'SQL statement latency, in and out of requests',
+                                 ('context',))
+        self.templates = Histogram('template_render_duration_seconds', 'Jinja render time by template',
+                                   ('template',))
+        self.collectors = []
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(slow_request_ms=config['SLOW_REQUEST_MS'])
+
+    def init_app(self, app):
+        self.logger = app.logger
+        app.before_request(self._start_request)
+        app.after_request(self._record_status)
+        app.teardown_request(self._finish_request)
+        before_render_template.connect(self._start_template, app)
+        template_rendered.connect(self._finish_template, app)
+        # On the Engine class, so every engine the app creates is covered
+        event.listen(Engine, 'before_cursor_execute', self._start_query)
+        event.listen(Engine, 'after_cursor_execute', self._finish_query)
+
+    def add_collector(self, collector):
+        """collector() returns exposition lines for metrics kept elsewhere (Paystack, caches)"""
+        self.collectors.append(collector)
+
+    # ---- Requests ----
+
+    def _start_request(self):
+        g.metrics = {'started': time.perf_counter(), 'queries': 0, 'db_time': 0.0, 'statements': [], 'status': 500}
+
+    def _record_status(self, response):
+        if 'metrics' in g:
+            g.metrics['status'] = response.status_code
+        return response
+
+    def _finish_request(self, exc=None):
+        state = g.pop('metrics', None)
+        if state is None:
+            return
+        elapsed = time.perf_counter() - state['started']
+        endpoint = request.endpoint or 'unmatched'
+        self.requests.observe(elapsed, endpoint, request.method, str(state['status']))
+        self.request_queries.observe(state['queries'], endpoint)
+        self.request_db_time.observe(state['db_time'], endpoint)
+
+        if elapsed * 1000 >= self.slow_request_ms:
+            lines = [f'  {ms:8.2f} ms  {sql}' for ms, sql in state['statements']]
+            if state['queries'] > len(lines):
+                lines.append(f"  ... {state['queries'] - len(lines)} more")
+            self.logger.warning(
+                'Slow request: %s %s -> %s in %.0f ms (%d queries, %.0f ms SQL)%s',
+                request.method, request.full_path.rstrip('?'), state['status'], elapsed * 1000,
+                state['queries'], state['db_time'] * 1000, ''.join('\n' + line for line in lines),
+            )
+
+    # ---- SQL ----
+
+    def _start_query(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    def _finish_query(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('metrics_query_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        in_request = has_request_context() and 'metrics' in g
+        self.queries.observe(elapsed, 'request' if in_request else 'background')
+        if in_request:
+            state = g.metrics
+            state['queries'] += 1
+            state['db_time'] += elapsed
+            if len(state['statements']) < SLOW_LOG_MAX_STATEMENTS:
+                state['statements'].append((elapsed * 1000, ' '.join(statement.split())))
+
+    # ---- Templates ----
+
+    def _start_template(self, sender, template, context, **extra):
+        if has_request_context() and 'metrics' in g:
+            g.metrics.setdefault('templates', []).append(time.perf_counter())
+
+    def _finish_template(self, sender, template, context, **extra):
+        if has_request_context() and g.get('metrics', {}).get('templates'):
+            started = g.metrics['templates'].pop()
+            self.templates.observe(time.perf_counter() - started, template.name or 'string')
+
+    # ---- Exposition ----
+
+    def render(self):
+        lines = []
+        for histogram in (self.requests, self.request_queries, self.request_db_time, self.queries, self.templates):
+            lines.extend(histogram.render())
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,43 @@
+"""
+Minimal schema upgrades run at startup
+
+db.create_all() only creates missing tables, so columns and indexes added
+to existing models are applied here. New columns must be nullable or have
+a server default, which existing rows take (SQLite only accepts constant
+defaults here, not e.g. CURRENT_TIMESTAMP). Other values are backfilled by
+the code that introduced them.
+"""
+
+from sqlalchemy import inspect, text
+
+
+def add_missing_columns(engine, metadata):
+    """ALTER TABLE ... ADD COLUMN for model columns the database lacks. Returns 'table.column' names added."""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    ddl = engine.dialect.ddl_compiler(engine.dialect, None)
+    added = []
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            present = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in present:
+                    continue
+                column_spec = f'{column.name} {column.type.compile(dialect=engine.dialect)}'
+                default = ddl.get_column_default_string(column)
+                if default is not None:
+                    # Existing rows take the default, so a NOT NULL column is safe to add
+                    column_spec += f' DEFAULT {default}'
+                    if not column.nullable:
+                        column_spec += ' NOT NULL'
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column_spec}'))
+                added.append(f'{table.name}.{column.name}')
+    return added
+
+
+def create_missing_indexes(engine, metadata):
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
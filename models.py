@@ -3,35 +3,110 @@ from datetime import datetime
 
 db = SQLAlchemy()
 
+def image_srcsets(manifest):
+    """{MIME type: srcset} for an image manifest from images.py, or None"""
+    if not manifest:
+        return None
+    srcsets = {}
+    for variant in manifest['variants']:
+        srcsets.setdefault(variant['type'], []).append(f"{variant['url']} {variant['width']}w")
+    return {mime: ', '.join(parts) for mime, parts in srcsets.items()}
+
+
+perfume_notes = db.Table(
+    'perfume_notes',
+    db.Column('perfume_id', db.Integer, db.ForeignKey('perfumes.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('note_id', db.Integer, db.ForeignKey('notes.id', ondelete='CASCADE'), primary_key=True),
+    # The primary key covers perfume -> notes; facet filters go note -> perfumes
+    db.Index('ix_perfume_notes_note_id_perfume_id', 'note_id', 'perfume_id'),
+)
+
+
+class Note(db.Model):
+    __tablename__ = 'notes'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    slug = db.Column(db.String(100), unique=True, nullable=False)  # e.g., "pink-pepper"
+    perfume_count = db.Column(db.Integer, nullable=False, default=0)  # Maintained on perfume writes
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'slug': self.slug,
+            'count': self.perfume_count
+        }
+
+
 class Perfume(db.Model):
     __tablename__ = 'perfumes'
+    __table_args__ = (
+        # Keyset pagination: (sort column, id) for each catalog sort order
+        db.Index('ix_perfumes_created_at_id', 'created_at', 'id'),
+        db.Index('ix_perfumes_price_id', 'price', 'id'),
+        db.Index('ix_perfumes_name_id', 'name', 'id'),
+        db.Index('ix_perfumes_size_created_at_id', 'size', 'created_at', 'id'),
+        # Bulk imports match on SKU; NULLs don't collide, so perfumes without one are fine
+        db.Index('ix_perfumes_sku', 'sku', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
+    sku = db.Column(db.String(64), nullable=True)  # Optional stock-keeping code for bulk import/export
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=False)
     price = db.Column(db.Float, nullable=False)
     compare_at_price = db.Column(db.Float, nullable=True)  # Original price for discounts
     cloudinary_url = db.Column(db.String(500), nullable=False)
+    image_variants = db.Column(db.JSON, nullable=True)  # Manifest from images.py; None for older uploads
     size = db.Column(db.String(50), default='50ml')
     notes = db.Column(db.String(300))  # e.g., "Rose, Oud, Sandalwood"
+    stock = db.Column(db.Integer, nullable=True)  # Units left to reserve (held units already taken); None = not tracked
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    note_tags = db.relationship('Note', secondary=perfume_notes)
+    
     def to_dict(self):
         return {
             'id': self.id,
+            'sku': self.sku,
             'name': self.name,
             'description': self.description,
             'price': self.price,
             'compare_at_price': self.compare_at_price,
             'cloudinary_url': self.cloudinary_url,
+            'image_srcset': image_srcsets(self.image_variants),
             'size': self.size,
             'notes': self.notes,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
 
+class StockReservation(db.Model):
+    """Units taken from Perfume.stock for one checkout until it is paid for or expires"""
+    __tablename__ = 'stock_reservations'
+    __table_args__ = (
+        db.Index('ix_stock_reservations_reference', 'reference'),
+        # The sweeper's scan: held rows, oldest expiry first
+        db.Index('ix_stock_reservations_status_expires_at', 'status', 'expires_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    reference = db.Column(db.String(200), nullable=False)  # Paystack reference of the checkout
+    perfume_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='held')  # held, converted, released
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+
 class Order(db.Model):
     __tablename__ = 'orders'
+    __table_args__ = (
+        # Admin list views: newest first, optionally within one status
+        db.Index('ix_orders_status_created_at_id', 'status', 'created_at', 'id'),
+        db.Index('ix_orders_created_at_id', 'created_at', 'id'),
+        db.Index('ix_orders_customer_email', 'customer_email'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     customer_info_json = db.Column(db.JSON, nullable=False)  # {name, email, phone, address, city, state}
@@ -41,6 +116,11 @@ class Order(db.Model):
     status = db.Column(db.String(50), default='pending')  # pending, confirmed, shipped, delivered
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Copied out of the JSON columns for searching and list views
+    customer_email = db.Column(db.String(200), nullable=True)  # Lowercased
+    customer_name = db.Column(db.String(200), nullable=True)
+    item_count = db.Column(db.Integer, nullable=True)
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -51,6 +131,158 @@ class Order(db.Model):
             'status': self.status,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
+    
+    def to_summary(self):
+        return {
+            'id': self.id,
+            'customer_name': self.customer_name,
+            'customer_email': self.customer_email,
+            'item_count': self.item_count,
+            'total_price': self.total_price,
+            'payment_ref': self.payment_ref,
+            'status': self.status,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+class OrderItem(db.Model):
+    """One row per line of an order's items_json, for per-perfume and per-day SQL rollups"""
+    __tablename__ = 'order_items'
+    __table_args__ = (
+        db.Index('ix_order_items_perfume_id_ordered_at', 'perfume_id', 'ordered_at'),
+        db.Index('ix_order_items_ordered_at_perfume_id', 'ordered_at', 'perfume_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id', ondelete='CASCADE'), nullable=False, index=True)
+    perfume_id = db.Column(db.Integer, nullable=False)  # Not a foreign key: sales outlive deleted perfumes
+    name = db.Column(db.String(200), nullable=False)  # As sold
+    unit_price = db.Column(db.Float, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    ordered_at = db.Column(db.DateTime, nullable=False)  # Copy of the order's created_at
+
+
+class StatCounter(db.Model):
+    __tablename__ = 'stat_counters'
+    
+    # e.g., "orders", "orders:status:confirmed", "perfumes"
+    name = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Float, nullable=False, default=0)
+
+
+class DailySales(db.Model):
+    __tablename__ = 'daily_sales'
+    
+    day = db.Column(db.Date, primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'day': self.day.isoformat(),
+            'order_count': self.order_count,
+            'units': self.units,
+            'revenue': self.revenue
+        }
+
+
+class PerfumeSales(db.Model):
+    __tablename__ = 'perfume_sales'
+    __table_args__ = (
+        db.Index('ix_perfume_sales_units', 'units'),
+    )
+    
+    perfume_id = db.Column(db.Integer, primary_key=True)  # Not a foreign key: sales outlive deleted perfumes
+    name = db.Column(db.String(200), nullable=False)  # Last name seen in an order
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'perfume_id': self.perfume_id,
+            'name': self.name,
+            'units': self.units,
+            'revenue': self.revenue
+        }
+
+
+class ImageBlob(db.Model):
+    __tablename__ = 'image_blobs'
+    
+    digest = db.Column(db.String(64), primary_key=True)  # SHA-256 of the uploaded file
+    refcount = db.Column(db.Integer, nullable=False, default=0)  # Records pointing at it
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    released_at = db.Column(db.DateTime, nullable=True)  # Last time a reference was dropped
+
+
+class Cart(db.Model):
+    __tablename__ = 'carts'
+    __table_args__ = (
+        db.Index('ix_carts_updated_at', 'updated_at'),
+    )
+    
+    id = db.Column(db.String(32), primary_key=True)  # Random id kept in the session cookie
+    version = db.Column(db.Integer, nullable=False, default=0)  # Bumped on every change
+    data = db.Column(db.JSON, nullable=True)  # e.g., pending checkout info
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)  # Expiry is measured from here
+
+
+class CartItem(db.Model):
+    __tablename__ = 'cart_items'
+    
+    cart_id = db.Column(db.String(32), db.ForeignKey('carts.id', ondelete='CASCADE'), primary_key=True)
+    perfume_id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    image = db.Column(db.String(500), nullable=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    added_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.perfume_id,
+            'name': self.name,
+            'price': self.price,
+            'image': self.image,
+            'quantity': self.quantity
+        }
+
+
+class WebhookEvent(db.Model):
+    __tablename__ = 'webhook_events'
+    __table_args__ = (
+        # Paystack redelivers events; the same event for a reference is stored once
+        db.UniqueConstraint('event', 'reference', name='uq_webhook_events_event_reference'),
+        db.Index('ix_webhook_events_status_available_at', 'status', 'available_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    event = db.Column(db.String(100), nullable=False)  # e.g., "charge.success"
+    reference = db.Column(db.String(200), nullable=True)
+    payload = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, processing, done, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    claim_token = db.Column(db.String(32), nullable=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    available_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # Retry backoff
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'event': self.event,
+            'reference': self.reference,
+            'status': self.status,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'processed_at': self.processed_at.isoformat() if self.processed_at else None
+        }
+
 
 class SiteSettings(db.Model):
     __tablename__ = 'site_settings'
@@ -0,0 +1,173 @@
+"""
+Normalized fragrance notes: keeps the notes/perfume_notes tables and the
+per-note perfume counts in step with the free-text Perfume.notes column
+"""
+
+import unicodedata
+
+from sqlalchemy import and_, false, func, select, update
+
+from models import db, Note, Perfume, perfume_notes
+from database import read_session
+
+# Above this many matching perfumes a note filter probes rows in sort order instead of listing matches
+DENSE_NOTE_PERFUMES = 2000
+
+
+def slugify(name):
+    ascii_name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii')
+    return '-'.join(ascii_name.lower().split())
+
+
+def parse_notes(notes):
+    """Split "Rose, Oud, rose" into unique {slug: display name}, first spelling wins"""
+    parsed = {}
+    for name in (notes or '').split(','):
+        name = ' '.join(name.split())
+        slug = slugify(name)
+        if slug and slug not in parsed:
+            parsed[slug] = name[:100]
+    return parsed
+
+
+def _adjust_counts(note_ids, delta):
+    if note_ids:
+        db.session.execute(
+            update(Note)
+            .where(Note.id.in_(note_ids))
+            .values(perfume_count=Note.perfume_count + delta)
+        )
+
+
+def _get_or_create_notes(parsed):
+    if not parsed:
+        return []
+    existing = {n.slug: n for n in Note.query.filter(Note.slug.in_(list(parsed)))}
+    for slug, name in parsed.items():
+        if slug not in existing:
+            note = Note(slug=slug, name=name, perfume_count=0)
+            db.session.add(note)
+            existing[slug] = note
+    db.session.flush()
+    return [existing[slug] for slug in parsed]
+
+
+def sync_perfume_notes(perfume):
+    """Relink perfume to the notes in perfume.notes; caller commits"""
+    wanted = _get_or_create_notes(parse_notes(perfume.notes))
+    current = list(perfume.note_tags)
+
+    wanted_ids = {n.id for n in wanted}
+    current_ids = {n.id for n in current}
+
+    _adjust_counts(wanted_ids - current_ids, 1)
+    _adjust_counts(current_ids - wanted_ids, -1)
+    perfume.note_tags = wanted
+
+
+def replace_perfume_links(notes_by_perfume):
+    """Relink many perfumes at once from {perfume_id: notes string}.
+
+    Counts are not adjusted; call recount_notes() once the batch is done. Caller commits.
+    """
+    if not notes_by_perfume:
+        return
+    parsed = {perfume_id: parse_notes(text) for perfume_id, text in notes_by_perfume.items()}
+    wanted = {}
+    for slugs in parsed.values():
+        for slug, name in slugs.items():
+            wanted.setdefault(slug, name)
+    note_ids = {note.slug: note.id for note in _get_or_create_notes(wanted)}
+
+    db.session.execute(perfume_notes.delete().where(perfume_notes.c.perfume_id.in_(list(parsed))))
+    links = [{'perfume_id': perfume_id, 'note_id': note_ids[slug]}
+             for perfume_id, slugs in parsed.items() for slug in slugs]
+    if links:
+        db.session.execute(perfume_notes.insert(), links)
+
+
+def unlink_perfume_notes(perfume):
+    """Drop a perfume's note links ahead of deleting it; caller commits"""
+    _adjust_counts({n.id for n in perfume.note_tags}, -1)
+    perfume.note_tags = []
+
+
+def recount_notes():
+    """Recompute every perfume_count from the link table"""
+    counts = (
+        select(func.count())
+        .select_from(perfume_notes)
+        .where(perfume_notes.c.note_id == Note.id)
+        .scalar_subquery()
+    )
+    db.session.execute(update(Note).values(perfume_count=counts))
+
+
+def backfill_notes(batch_size=500):
+    """Link every perfume from its notes string, then recount. Returns perfumes processed."""
+    processed = 0
+    last_id = 0
+    while True:
+        batch = Perfume.query.filter(Perfume.id > last_id).order_by(Perfume.id).limit(batch_size).all()
+        if not batch:
+            break
+        for perfume in batch:
+            perfume.note_tags = _get_or_create_notes(parse_notes(perfume.notes))
+        processed += len(batch)
+        last_id = batch[-1].id
+        db.session.commit()
+    recount_notes()
+    db.session.commit()
+    return processed
+
+
+def needs_backfill():
+    has_links = db.session.query(perfume_notes.c.perfume_id).first() is not None
+    if has_links:
+        return False
+    return db.session.query(Perfume.id).filter(Perfume.notes.isnot(None), Perfume.notes != '').first() is not None
+
+
+def note_facets():
+    notes = read_session().query(Note).filter(Note.perfume_count > 0).order_by(Note.perfume_count.desc(), Note.name).all()
+    return [n.to_dict() for n in notes]
+
+
+def _has_notes(note_ids):
+    # One primary-key probe per perfume row
+    return (
+        select(perfume_notes.c.perfume_id)
+        .where(perfume_notes.c.perfume_id == Perfume.id, perfume_notes.c.note_id.in_(note_ids))
+        .exists()
+    )
+
+
+def _linked_to(note_ids):
+    # Read from the (note_id, perfume_id) index
+    return Perfume.id.in_(select(perfume_notes.c.perfume_id).where(perfume_notes.c.note_id.in_(note_ids)))
+
+
+def note_filter(slugs, mode):
+    """Perfume criterion for perfumes having any/all of the given note slugs.
+
+    A note on few perfumes is read from the note index, so only those rows
+    are sorted. A common one is instead checked row by row while the query
+    walks its sort index, which stops as soon as a page is full; reading
+    every match first would load and sort most of the catalog per page.
+    perfume_count picks the plan, so no link rows are counted per query.
+    """
+    found = dict(read_session().query(Note.id, Note.perfume_count).filter(Note.slug.in_(slugs)).all())
+    if not found or (mode == 'all' and len(found) < len(slugs)):
+        return false()
+
+    if mode == 'any':
+        if sum(found.values()) > DENSE_NOTE_PERFUMES:
+            return _has_notes(list(found))
+        return _linked_to(list(found))
+
+    # all: start from the rarest note and probe the others
+    rarest = min(found, key=found.get)
+    others = [_has_notes([note_id]) for note_id in found if note_id != rarest]
+    if found[rarest] > DENSE_NOTE_PERFUMES:
+        return and_(_has_notes([rarest]), *others)
+    return and_(_linked_to([rarest]), *others)
@@ -0,0 +1,165 @@
+"""
+Order line items as rows, for product sales analytics
+
+finalize_orders() writes an order's items_json lines to order_items in the
+same transaction as the order. Questions like "units sold per perfume last
+month" then become an indexed GROUP BY, with no orders loaded into Python.
+`flask rebuild-order-items` refills the table from items_json.
+"""
+
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func
+
+from models import db, Order, OrderItem
+from database import read_session
+
+DEFAULT_DAYS = 30
+MAX_SERIES_DAYS = 366
+
+
+class SalesQueryError(ValueError):
+    pass
+
+
+def item_rows(order_id, ordered_at, items):
+    """order_items column dicts for one order's items_json; lines without a usable perfume id are skipped"""
+    for item in items or []:
+        if not isinstance(item, dict):
+            continue
+        try:
+            perfume_id = int(item.get('id', item.get('perfume_id')))
+            quantity = int(item.get('quantity') or 0)
+            unit_price = float(item.get('price') or 0)
+        except (TypeError, ValueError):
+            continue
+        yield {
+            'order_id': order_id,
+            'perfume_id': perfume_id,
+            'name': (item.get('name') or '')[:200],
+            'unit_price': unit_price,
+            'quantity': quantity,
+            'ordered_at': ordered_at,
+        }
+
+
+def record_orders_created(created, rows):
+    """Insert the items of newly created orders; created is {payment_ref: order_id}. Caller commits."""
+    values = [
+        item
+        for row in rows if row['payment_ref'] in created
+        for item in item_rows(created[row['payment_ref']], row.get('created_at') or datetime.utcnow(), row.get('items_json'))
+    ]
+    if values:
+        db.session.execute(OrderItem.__table__.insert(), values)
+
+
+def needs_rebuild():
+    return db.session.query(OrderItem.id).first() is None and db.session.query(Order.id).first() is not None
+
+
+def rebuild(batch_size=1000):
+    """Refill order_items from items_json for every order up to the current newest. Returns orders scanned.
+
+    Orders created while this runs have higher ids and already wrote their own items.
+    """
+    max_id = db.session.query(func.max(Order.id)).scalar() or 0
+    db.session.query(OrderItem).filter(OrderItem.order_id <= max_id).delete(synchronize_session=False)
+    scanned = 0
+    last_id = 0
+    while True:
+        batch = (
+            db.session.query(Order.id, Order.created_at, Order.items_json)
+            .filter(Order.id > last_id, Order.id <= max_id)
+            .order_by(Order.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        values = [item for order in batch
+                  for item in item_rows(order.id, order.created_at or datetime.utcnow(), order.items_json)]
+        if values:
+            db.session.execute(OrderItem.__table__.insert(), values)
+        scanned += len(batch)
+        last_id = batch[-1].id
+    db.session.commit()
+    return scanned
+
+
+# ---- Queries ----
+
+def _parse_date(args, name):
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise SalesQueryError(f'{name} must be a YYYY-MM-DD date')
+
+
+def parse_range(args):
+    """(first day, last day) from date_from/date_to, both inclusive; the last DEFAULT_DAYS days by default"""
+    end = _parse_date(args, 'date_to') or datetime.utcnow().date()
+    start = _parse_date(args, 'date_from') or end - timedelta(days=DEFAULT_DAYS - 1)
+    if start > end:
+        raise SalesQueryError('date_from must not be after date_to')
+    return start, end
+
+
+def _in_range(query, start, end):
+    return query.filter(
+        OrderItem.ordered_at >= datetime.combine(start, datetime.min.time()),
+        OrderItem.ordered_at < datetime.combine(end + timedelta(days=1), datetime.min.time()),
+    )
+
+
+def perfume_sales(start, end, limit=20):
+    """Units, revenue and orders per perfume between two days, best-selling first"""
+    units = func.sum(OrderItem.quantity)
+    query = _in_range(
+        read_session().query(
+            OrderItem.perfume_id,
+            func.max(OrderItem.name).label('name'),
+            units.label('units'),
+            func.sum(OrderItem.quantity * OrderItem.unit_price).label('revenue'),
+            func.count(func.distinct(OrderItem.order_id)).label('orders'),
+        ),
+        start, end,
+    ).group_by(OrderItem.perfume_id).order_by(units.desc(), OrderItem.perfume_id).limit(limit)
+    return [{
+        'perfume_id': row.perfume_id,
+        'name': row.name,
+        'units': row.units or 0,
+        'revenue': row.revenue or 0.0,
+        'orders': row.orders,
+    } for row in query]
+
+
+def perfume_daily(perfume_id, start, end):
+    """Zero-filled units and revenue per day for one perfume"""
+    if (end - start).days >= MAX_SERIES_DAYS:
+        raise SalesQueryError(f'date range must be at most {MAX_SERIES_DAYS} days')
+    day = func.date(OrderItem.ordered_at)  # A string on SQLite, a date on PostgreSQL
+    query = _in_range(
+        read_session().query(
+            day.label('day'),
+            func.sum(OrderItem.quantity).label('units'),
+            func.sum(OrderItem.quantity * OrderItem.unit_price).label('revenue'),
+        ).filter(OrderItem.perfume_id == perfume_id),
+        start, end,
+    ).group_by(day)
+    rows = {str(row.day): row for row in query}
+
+    series = []
+    current = start
+    while current <= end:
+        row = rows.get(current.isoformat())
+        series.append({
+            'day': current.isoformat(),
+            'units': row.units if row else 0,
+            'revenue': row.revenue if row else 0.0,
+        })
+        current += timedelta(days=1)
+    return series
@@ -0,0 +1,111 @@
+"""
+Admin order listing: status and date filters, customer search, summary
+projection and keyset pagination on (created_at, id)
+"""
+
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import load_only
+
+from models import db, Order
+from database import read_session
+import pagination
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+SUMMARY_COLUMNS = (Order.id, Order.customer_name, Order.customer_email, Order.item_count,
+                   Order.total_price, Order.payment_ref, Order.status, Order.created_at)
+
+
+class OrderQueryError(ValueError):
+    pass
+
+
+def _parse_date(args, name):
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise OrderQueryError(f'{name} must be a YYYY-MM-DD date')
+
+
+def parse_args(args):
+    view = args.get('view', 'full')
+    if view not in ('full', 'summary'):
+        raise OrderQueryError("view must be 'full' or 'summary'")
+
+    limit = None
+    if 'limit' in args or 'cursor' in args:
+        try:
+            limit = int(args.get('limit', DEFAULT_LIMIT))
+        except ValueError:
+            raise OrderQueryError('limit must be an integer')
+        limit = max(1, min(limit, MAX_LIMIT))
+
+    cursor = None
+    if args.get('cursor'):
+        try:
+            created_at, last_id = pagination.decode_cursor(args['cursor'], 2)
+            cursor = (datetime.fromisoformat(created_at), int(last_id))
+        except (ValueError, TypeError):
+            raise OrderQueryError('Invalid cursor')
+
+    return {
+        'status': args.get('status', 'confirmed'),
+        'date_from': _parse_date(args, 'date_from'),
+        'date_to': _parse_date(args, 'date_to'),
+        'q': (args.get('q') or '').strip(),
+        'view': view,
+        'limit': limit,
+        'cursor': cursor,
+    }
+
+
+def filtered_query(spec):
+    query = read_session().query(Order)
+    if spec['status'] != 'all':
+        query = query.filter(Order.status == spec['status'])
+    if spec['date_from']:
+        query = query.filter(Order.created_at >= datetime.combine(spec['date_from'], datetime.min.time()))
+    if spec['date_to']:
+        # Inclusive of the whole end day
+        query = query.filter(Order.created_at < datetime.combine(spec['date_to'] + timedelta(days=1), datetime.min.time()))
+    if spec['q']:
+        q = spec['q']
+        email_match = Order.customer_email.startswith(q.lower(), autoescape=True)
+        if '@' in q:
+            query = query.filter(email_match)
+        else:
+            query = query.filter(db.or_(email_match, Order.customer_name.icontains(q, autoescape=True)))
+    return query
+
+
+def query_orders(spec):
+    """Run a parsed spec; returns a list, or a page dict when limit/cursor was given"""
+    query = filtered_query(spec)
+    if spec['view'] == 'summary':
+        # Leave the JSON blobs in the database
+        query = query.options(load_only(*SUMMARY_COLUMNS))
+    if spec['cursor']:
+        query = query.filter(tuple_(Order.created_at, Order.id) < spec['cursor'])
+    query = query.order_by(Order.created_at.desc(), Order.id.desc())
+
+    serialize = Order.to_summary if spec['view'] == 'summary' else Order.to_dict
+
+    if spec['limit'] is None:
+        return [serialize(o) for o in query.all()]
+
+    orders = query.limit(spec['limit'] + 1).all()
+    next_cursor = None
+    if len(orders) > spec['limit']:
+        orders = orders[:spec['limit']]
+        next_cursor = pagination.encode_cursor(orders[-1].created_at, orders[-1].id)
+
+    return {
+        'items': [serialize(o) for o in orders],
+        'next_cursor': next_cursor,
+    }
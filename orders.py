@@ -0,0 +1,112 @@
+"""
+Order finalization shared by the payment callback and the webhook queue
+
+Both paths can confirm the same Paystack reference at the same moment, so
+orders are written with a single INSERT ... ON CONFLICT (payment_ref) DO
+NOTHING instead of a lookup followed by an insert.
+"""
+
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Order
+from upsert import upsert_insert
+import sales
+import order_items
+import inventory
+
+
+def summary_values(customer_info, items):
+    """Searchable columns derived from an order's JSON blobs"""
+    customer_info = customer_info or {}
+    name = customer_info.get('name') or ' '.join(
+        part for part in (customer_info.get('firstName'), customer_info.get('lastName')) if part
+    )
+    return {
+        'customer_email': (customer_info.get('email') or '').strip().lower()[:200] or None,
+        'customer_name': name.strip()[:200] or None,
+        'item_count': len(items or []),
+    }
+
+
+def order_values(charge, status='confirmed'):
+    """Order column values from a Paystack transaction/charge `data` object"""
+    metadata = charge.get('metadata') or {}
+    customer_info = metadata.get('customer_info', {})
+    items = metadata.get('items', [])
+    return {
+        'customer_info_json': customer_info,
+        'items_json': items,
+        **summary_values(customer_info, items),
+        'total_price': charge['amount'] / 100,
+        'payment_ref': charge['reference'],
+        'status': status,
+        'created_at': datetime.utcnow(),
+    }
+
+
+def finalize_orders(rows):
+    """Insert orders whose payment_ref doesn't exist yet.
+
+    Returns {payment_ref: order_id} for the rows this call created; refs
+    that already had an order are left untouched. Caller commits.
+    """
+    if not rows:
+        return {}
+
+    insert = upsert_insert()
+    if insert is not None:
+        stmt = (
+            insert(Order)
+            .values(rows)
+            .on_conflict_do_nothing(index_elements=['payment_ref'])
+            .returning(Order.payment_ref, Order.id)
+        )
+        created = dict(db.session.execute(stmt).all())
+    else:
+        created = _insert_each(rows)
+
+    # Same transaction as the insert, so aggregates, line items and stock never drift from orders
+    sales.record_orders_created([row for row in rows if row['payment_ref'] in created])
+    order_items.record_orders_created(created, rows)
+    inventory.record_orders_created(created, rows)
+    return created
+
+
+def _insert_each(rows):
+    # Other databases: one savepoint per row, losing races via the unique constraint
+    created = {}
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                order = Order(**row)
+                db.session.add(order)
+            created[order.payment_ref] = order.id
+        except IntegrityError:
+            pass
+    return created
+
+
+def finalize_order(charge):
+    """Create the confirmed order for a successful charge. Returns True if
+    this call created it, False if it already existed. Caller commits."""
+    return bool(finalize_orders([order_values(charge)]))
+
+
+def needs_summary_backfill():
+    return db.session.query(Order.id).filter(Order.item_count.is_(None)).first() is not None
+
+
+def backfill_summary_columns(batch_size=1000):
+    """Fill customer_email/customer_name/item_count on orders created before they existed"""
+    filled = 0
+    while True:
+        batch = Order.query.filter(Order.item_count.is_(None)).order_by(Order.id).limit(batch_size).all()
+        if not batch:
+            return filled
+        for order in batch:
+            for name, value in summary_values(order.customer_info_json, order.items_json).items():
+                setattr(order, name, value)
+        filled += len(batch)
+        db.session.commit()
@@ -0,0 +1,23 @@
+"""
+Opaque keyset-pagination cursors
+"""
+
+import base64
+import json
+from datetime import datetime
+
+
+def encode_cursor(*values):
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, size):
+    """Return the cursor's values as a list of `size` items; ValueError if malformed"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError, UnicodeEncodeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Invalid cursor')
+    return values
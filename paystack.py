@@ -0,0 +1,201 @@
+"""
+Paystack API client
+
+One pooled keep-alive session per worker, connect/read timeouts on every
+call, bounded retries with jittered backoff, and a circuit breaker that
+fails fast while the gateway is degraded instead of pinning workers on it.
+"""
+
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class PaystackError(Exception):
+    pass
+
+
+class PaystackUnavailable(PaystackError):
+    """The gateway timed out, returned 5xx, or the circuit is open"""
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures; lets one trial
+    call through once `reset_timeout` seconds have passed"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class CallStats:
+    """Per-operation call counts and latency histogram (seconds)"""
+
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self._ops = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation, seconds, outcome):
+        with self._lock:
+            op = self._ops.setdefault(operation, {
+                'count': 0,
+                'sum': 0.0,
+                'max': 0.0,
+                'outcomes': {},
+                'buckets': [0] * len(self.BUCKETS),
+            })
+            op['count'] += 1
+            op['sum'] += seconds
+            op['max'] = max(op['max'], seconds)
+            op['outcomes'][outcome] = op['outcomes'].get(outcome, 0) + 1
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    op['buckets'][i] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: {
+                    'count': op['count'],
+                    'avg_ms': round(op['sum'] / op['count'] * 1000, 2) if op['count'] else 0,
+                    'max_ms': round(op['max'] * 1000, 2),
+                    'sum_seconds': op['sum'],
+                    'outcomes': dict(op['outcomes']),
+                    'buckets': dict(zip(self.BUCKETS, op['buckets'])),
+                }
+                for name, op in self._ops.items()
+            }
+
+
+class PaystackClient:
+    def __init__(self, secret_key, base_url='https://api.paystack.co',
+                 connect_timeout=3.05, read_timeout=10, max_retries=2,
+                 backoff=0.25, pool_size=10, breaker=None):
+        self.secret_key = secret_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = CallStats()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            secret_key=config['PAYSTACK_SECRET_KEY'],
+            base_url=config['PAYSTACK_BASE_URL'],
+            connect_timeout=config['PAYSTACK_CONNECT_TIMEOUT'],
+            read_timeout=config['PAYSTACK_READ_TIMEOUT'],
+            max_retries=config['PAYSTACK_MAX_RETRIES'],
+            breaker=CircuitBreaker(
+                failure_threshold=config['PAYSTACK_BREAKER_THRESHOLD'],
+                reset_timeout=config['PAYSTACK_BREAKER_RESET'],
+            ),
+        )
+
+    def initialize_transaction(self, payload):
+        # Only connect failures are retried: the request never reached Paystack
+        return self._request('initialize', 'POST', '/transaction/initialize',
+                             json=payload, retry_read_errors=False)
+
+    def verify_transaction(self, reference):
+        return self._request('verify', 'GET', f'/transaction/verify/{reference}',
+                             retry_read_errors=True)
+
+    def _sleep_before_retry(self, attempt):
+        # Full jitter keeps retrying workers from hitting the gateway in lockstep
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def _request(self, operation, method, path, retry_read_errors, **kwargs):
+        if not self.breaker.allow():
+            self.stats.record(operation, 0.0, 'circuit_open')
+            raise PaystackUnavailable('Paystack circuit is open')
+
+        headers = {'Authorization': f'Bearer {self.secret_key}'}
+        attempt = 0
+        settled = False
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    response = self.session.request(method, self.base_url + path, headers=headers,
+                                                    timeout=self.timeout, **kwargs)
+                except requests.ConnectTimeout as e:
+                    error, retryable, outcome = e, True, 'connect_timeout'
+                except requests.Timeout as e:
+                    error, retryable, outcome = e, retry_read_errors, 'read_timeout'
+                except requests.ConnectionError as e:
+                    error, retryable, outcome = e, retry_read_errors, 'connection_error'
+                except requests.RequestException as e:
+                    # Broken bodies, redirect loops, bad URLs: retrying won't help
+                    error, retryable, outcome = e, False, 'request_error'
+                else:
+                    self.stats.record(operation, time.perf_counter() - started, str(response.status_code))
+                    if response.status_code < 500:
+                        # 4xx is a problem with our request, not with the gateway's health
+                        self.breaker.record_success()
+                        settled = True
+                        try:
+                            return response.json()
+                        except ValueError:
+                            raise PaystackError(f'Paystack returned non-JSON response ({response.status_code})')
+                    error = PaystackUnavailable(f'Paystack returned {response.status_code}')
+                    retryable, outcome = retry_read_errors, None
+
+                if outcome:
+                    self.stats.record(operation, time.perf_counter() - started, outcome)
+
+                if not retryable or attempt >= self.max_retries:
+                    raise PaystackUnavailable(str(error)) from error
+
+                attempt += 1
+                self._sleep_before_retry(attempt)
+        finally:
+            # Every other exit is a failure, so a half-open trial never stays in flight
+            if not settled:
+                self.breaker.record_failure()
@@ -0,0 +1,154 @@
+"""
+Checkout pricing
+
+Cart lines remember the price the shopper saw, but what they pay is
+resolved here against the perfumes table. All lines are priced with one
+`id IN (...)` query, behind a short-TTL per-worker cache that perfume
+writes invalidate through the catalog's VersionStamp. Money stays Decimal
+and is rounded to pesewas once per line.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal, ROUND_HALF_UP
+
+from models import db, Perfume
+
+CENT = Decimal('0.01')
+
+
+class PricingError(ValueError):
+    pass
+
+
+class UnavailableItems(PricingError):
+    """Cart lines whose perfume no longer exists"""
+
+    def __init__(self, ids):
+        super().__init__(f"Perfumes no longer available: {', '.join(map(str, ids))}")
+        self.ids = ids
+
+
+def to_money(value):
+    # str() first, so 0.1 becomes Decimal('0.1') rather than its binary expansion
+    return Decimal(str(value)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def to_subunits(amount):
+    """Pesewas for Paystack's `amount`, e.g. Decimal('120.50') -> 12050"""
+    return int((amount * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+class PriceBook:
+    """Current name, image and prices per perfume id, cached for ttl seconds"""
+
+    def __init__(self, ttl=30, stamp=None, max_entries=10000):
+        self.ttl = ttl
+        self.stamp = stamp
+        self.max_entries = max_entries
+        self._seen_stamp = stamp.read() if stamp else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, ids):
+        """{id: price entry} for the ids that exist, fetching cache misses in one query"""
+        ids = set(ids)
+        now = time.monotonic()
+        current_stamp = self.stamp.read() if self.stamp else None
+
+        found = {}
+        with self._lock:
+            if current_stamp != self._seen_stamp:
+                self._entries.clear()
+                self._seen_stamp = current_stamp
+            for perfume_id in ids:
+                cached = self._entries.get(perfume_id)
+                if cached is not None and cached[1] > now:
+                    self._entries.move_to_end(perfume_id)
+                    found[perfume_id] = cached[0]
+
+        missing = ids - found.keys()
+        if not missing:
+            return found
+
+        rows = (
+            db.session.query(Perfume.id, Perfume.name, Perfume.cloudinary_url, Perfume.price, Perfume.compare_at_price)
+            .filter(Perfume.id.in_(missing))
+            .all()
+        )
+        fetched = {
+            row.id: {
+                'id': row.id,
+                'name': row.name,
+                'image': row.cloudinary_url,
+                'price': to_money(row.price),
+                'compare_at_price': to_money(row.compare_at_price) if row.compare_at_price is not None else None,
+            }
+            for row in rows
+        }
+
+        with self._lock:
+            # Rows read before a concurrent perfume write must not outlive it
+            if current_stamp == self._seen_stamp:
+                for perfume_id, entry in fetched.items():
+                    self._entries[perfume_id] = (entry, now + self.ttl)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        found.update(fetched)
+        return found
+
+    def quote(self, lines):
+        """Price cart lines ({'id', 'quantity'}) at current catalog prices.
+
+        A compare_at_price above the price is shown as a discount; the total
+        is what the customer pays. Raises UnavailableItems for deleted perfumes.
+        """
+        prices = self.lookup(line['id'] for line in lines)
+        unavailable = [line['id'] for line in lines if line['id'] not in prices]
+        if unavailable:
+            raise UnavailableItems(unavailable)
+
+        priced = []
+        total = discount = Decimal('0.00')
+        for line in lines:
+            entry = prices[line['id']]
+            quantity = int(line['quantity'])
+            line_total = entry['price'] * quantity
+            unit_discount = Decimal('0.00')
+            if entry['compare_at_price'] is not None and entry['compare_at_price'] > entry['price']:
+                unit_discount = entry['compare_at_price'] - entry['price']
+            priced.append({
+                'id': entry['id'],
+                'name': entry['name'],
+                'image': entry['image'],
+                'quantity': quantity,
+                'unit_price': entry['price'],
+                'compare_at_price': entry['compare_at_price'],
+                'discount': unit_discount * quantity,
+                'line_total': line_total,
+            })
+            total += line_total
+            discount += unit_discount * quantity
+
+        return {
+            'lines': priced,
+            'subtotal': total + discount,  # Before discounts
+            'discount': discount,
+            'total': total,
+        }
+
+
+def order_items(quote):
+    """Order/metadata item dicts for a quote, in the shape the cart uses"""
+    return [
+        {
+            'id': line['id'],
+            'name': line['name'],
+            'price': float(line['unit_price']),
+            'image': line['image'],
+            'quantity': line['quantity'],
+        }
+        for line in quote['lines']
+    ]
@@ -0,0 +1,173 @@
+"""
+Materialized sales aggregates for the admin dashboard
+
+Counters, daily revenue buckets and per-perfume sales are updated in the
+same transaction that creates an order or changes its status, so the
+dashboard reads a handful of small rows instead of scanning orders.
+`flask rebuild-stats` recomputes everything from the orders table.
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from models import db, Order, Perfume, StatCounter, DailySales, PerfumeSales
+from database import read_session
+from upsert import increment
+
+ORDERS = 'orders'
+PERFUMES = 'perfumes'
+STATUS_PREFIX = 'orders:status:'
+
+
+def _item_lines(items):
+    """(perfume_id, name, quantity, line revenue) for each order item"""
+    for item in items or []:
+        try:
+            perfume_id = int(item.get('id', item.get('perfume_id')))
+        except (TypeError, ValueError):
+            continue
+        quantity = int(item.get('quantity') or 0)
+        yield perfume_id, item.get('name') or '', quantity, float(item.get('price') or 0) * quantity
+
+
+class _Totals:
+    """Aggregate deltas for a set of orders, keyed like the tables they update"""
+
+    def __init__(self):
+        self.counters = defaultdict(lambda: [0, 0.0])
+        self.days = defaultdict(lambda: [0, 0, 0.0])
+        self.perfumes = {}
+
+    def add_order(self, status, total_price, created_at, items):
+        for name in (ORDERS, STATUS_PREFIX + (status or 'pending')):
+            self.counters[name][0] += 1
+            self.counters[name][1] += total_price
+
+        day = self.days[(created_at or datetime.utcnow()).date()]
+        day[0] += 1
+        day[2] += total_price
+
+        for perfume_id, name, quantity, revenue in _item_lines(items):
+            day[1] += quantity
+            entry = self.perfumes.setdefault(perfume_id, [name, 0, 0.0])
+            entry[0] = name or entry[0]
+            entry[1] += quantity
+            entry[2] += revenue
+
+
+def record_orders_created(rows):
+    """Fold newly inserted order rows (column dicts) into the aggregates; caller commits"""
+    totals = _Totals()
+    for row in rows:
+        totals.add_order(row.get('status'), row['total_price'], row.get('created_at'), row.get('items_json'))
+
+    # Fixed key order so concurrent transactions lock counter rows in the same sequence
+    for name in sorted(totals.counters):
+        count, amount = totals.counters[name]
+        increment(StatCounter, {'name': name}, {'count': count, 'amount': amount})
+    for day in sorted(totals.days):
+        order_count, units, revenue = totals.days[day]
+        increment(DailySales, {'day': day}, {'order_count': order_count, 'units': units, 'revenue': revenue})
+    for perfume_id in sorted(totals.perfumes):
+        name, units, revenue = totals.perfumes[perfume_id]
+        increment(PerfumeSales, {'perfume_id': perfume_id}, {'units': units, 'revenue': revenue},
+                  values={'name': name})
+
+
+def record_status_change(old_status, new_status, total_price):
+    """Move one order between per-status counters; caller commits"""
+    old_status = old_status or 'pending'
+    if old_status == new_status:
+        return
+    for name, sign in sorted([(STATUS_PREFIX + old_status, -1), (STATUS_PREFIX + new_status, 1)]):
+        increment(StatCounter, {'name': name}, {'count': sign, 'amount': sign * total_price})
+
+
+def adjust_perfume_count(delta):
+    increment(StatCounter, {'name': PERFUMES}, {'count': delta, 'amount': 0})
+
+
+def stats():
+    counters = {c.name: c for c in read_session().query(StatCounter)}
+    orders = counters.get(ORDERS)
+    perfumes = counters.get(PERFUMES)
+    return {
+        'total_orders': orders.count if orders else 0,
+        'total_revenue': orders.amount if orders else 0,
+        'total_products': perfumes.count if perfumes else 0,
+        'orders_by_status': {
+            name[len(STATUS_PREFIX):]: {'count': c.count, 'revenue': c.amount}
+            for name, c in counters.items()
+            if name.startswith(STATUS_PREFIX) and c.count
+        }
+    }
+
+
+def revenue_series(period='day', days=30):
+    """Revenue buckets for the last `days` days, zero-filled, per day or ISO week"""
+    end = datetime.utcnow().date()
+    start = end - timedelta(days=days - 1)
+    rows = {r.day: r for r in read_session().query(DailySales).filter(DailySales.day >= start, DailySales.day <= end)}
+
+    buckets = {}
+    day = start
+    while day <= end:
+        key = day if period == 'day' else day - timedelta(days=day.weekday())
+        bucket = buckets.setdefault(key, {'period_start': key.isoformat(), 'order_count': 0, 'units': 0, 'revenue': 0.0})
+        row = rows.get(day)
+        if row:
+            bucket['order_count'] += row.order_count
+            bucket['units'] += row.units
+            bucket['revenue'] += row.revenue
+        day += timedelta(days=1)
+    return list(buckets.values())
+
+
+def top_perfumes(limit=10):
+    rows = read_session().query(PerfumeSales).order_by(PerfumeSales.units.desc(), PerfumeSales.perfume_id).limit(limit)
+    return [r.to_dict() for r in rows]
+
+
+def needs_rebuild():
+    if db.session.get(StatCounter, PERFUMES) is None:
+        return True
+    return db.session.get(StatCounter, ORDERS) is None and db.session.query(Order.id).first() is not None
+
+
+def rebuild(batch_size=1000):
+    """Recompute every aggregate from orders and perfumes. Returns orders scanned.
+
+    Orders confirmed while the scan runs can be missed, so run it when
+    checkout traffic is quiet.
+    """
+    totals = _Totals()
+    scanned = 0
+    last_id = 0
+    while True:
+        batch = (
+            db.session.query(Order.id, Order.status, Order.total_price, Order.created_at, Order.items_json)
+            .filter(Order.id > last_id)
+            .order_by(Order.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        for row in batch:
+            totals.add_order(row.status, row.total_price, row.created_at, row.items_json)
+        scanned += len(batch)
+        last_id = batch[-1].id
+
+    db.session.query(StatCounter).delete()
+    db.session.query(DailySales).delete()
+    db.session.query(PerfumeSales).delete()
+
+    totals.counters[PERFUMES] = [Perfume.query.count(), 0.0]
+    db.session.add_all(StatCounter(name=name, count=count, amount=amount)
+                       for name, (count, amount) in totals.counters.items())
+    db.session.add_all(DailySales(day=day, order_count=order_count, units=units, revenue=revenue)
+                       for day, (order_count, units, revenue) in totals.days.items())
+    db.session.add_all(PerfumeSales(perfume_id=perfume_id, name=name, units=units, revenue=revenue)
+                       for perfume_id, (name, units, revenue) in totals.perfumes.items())
+    db.session.commit()
+    return scanned
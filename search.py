@@ -0,0 +1,152 @@
+"""
+Full-text search over perfume name, notes and description
+
+SQLite uses an external-content FTS5 table kept in sync by triggers;
+PostgreSQL uses a generated tsvector column with a GIN index. Both are
+maintained by the database on every insert/update/delete, so admin writes
+only touch the rows they change.
+"""
+
+import re
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from models import db, Perfume
+from database import read_session
+import catalog
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# Which index ensure_search_index() managed to set up: 'fts5', 'tsvector' or 'like'
+backend = 'like'
+
+SQLITE_FTS_DDL = [
+    """
+    CREATE VIRTUAL TABLE perfumes_fts USING fts5(
+        name, notes, description,
+        content='perfumes', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS perfumes_fts_ai AFTER INSERT ON perfumes BEGIN
+        INSERT INTO perfumes_fts(rowid, name, notes, description)
+        VALUES (new.id, new.name, new.notes, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS perfumes_fts_ad AFTER DELETE ON perfumes BEGIN
+        INSERT INTO perfumes_fts(perfumes_fts, rowid, name, notes, description)
+        VALUES ('delete', old.id, old.name, old.notes, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS perfumes_fts_au AFTER UPDATE OF name, notes, description ON perfumes BEGIN
+        INSERT INTO perfumes_fts(perfumes_fts, rowid, name, notes, description)
+        VALUES ('delete', old.id, old.name, old.notes, old.description);
+        INSERT INTO perfumes_fts(rowid, name, notes, description)
+        VALUES (new.id, new.name, new.notes, new.description);
+    END
+    """,
+    # Index existing rows once, when the FTS table is first created
+    "INSERT INTO perfumes_fts(perfumes_fts) VALUES ('rebuild')",
+]
+
+POSTGRES_DDL = [
+    """
+    ALTER TABLE perfumes ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(notes, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(description, '')), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_perfumes_search_vector ON perfumes USING GIN (search_vector)",
+]
+
+
+class SearchQueryError(ValueError):
+    pass
+
+
+def ensure_search_index(engine):
+    """Create the dialect's search index if missing; call once at startup"""
+    global backend
+
+    dialect = engine.dialect.name
+    if dialect == 'sqlite':
+        with engine.connect() as conn:
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'perfumes_fts'"
+            )).first()
+        if not exists:
+            try:
+                with engine.begin() as conn:
+                    for statement in SQLITE_FTS_DDL:
+                        conn.execute(text(statement))
+            except OperationalError as e:
+                # Python builds without FTS5 fall back to LIKE scans
+                print(f"FTS5 unavailable, search will use LIKE: {e}")
+                return
+        backend = 'fts5'
+    elif dialect == 'postgresql':
+        with engine.begin() as conn:
+            for statement in POSTGRES_DDL:
+                conn.execute(text(statement))
+        backend = 'tsvector'
+
+
+def tokenize(q):
+    return re.findall(r'\w+', q.lower())
+
+
+def parse_args(args):
+    terms = tuple(tokenize(args.get('q', '')))
+    if not terms:
+        raise SearchQueryError('q is required')
+    try:
+        limit = int(args.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise SearchQueryError('limit must be an integer')
+    return {'terms': terms, 'limit': max(1, min(limit, MAX_LIMIT))}
+
+
+def _ranked_ids(terms, limit):
+    if backend == 'fts5':
+        # Every term must match; the last one as a prefix so results follow typing
+        match = ' '.join(f'"{t}"' for t in terms[:-1]) + f' "{terms[-1]}"*'
+        rows = read_session().execute(text(
+            "SELECT rowid FROM perfumes_fts WHERE perfumes_fts MATCH :match "
+            "ORDER BY bm25(perfumes_fts, 10.0, 5.0, 1.0) LIMIT :limit"
+        ), {'match': match.strip(), 'limit': limit})
+        return [row[0] for row in rows]
+
+    if backend == 'tsvector':
+        tsquery = ' & '.join(f'{t}:*' for t in terms)
+        rows = read_session().execute(text(
+            "SELECT id FROM perfumes, to_tsquery('simple', :tsquery) AS query "
+            "WHERE search_vector @@ query "
+            "ORDER BY ts_rank(search_vector, query) DESC, id DESC LIMIT :limit"
+        ), {'tsquery': tsquery, 'limit': limit})
+        return [row[0] for row in rows]
+
+    query = read_session().query(Perfume.id)
+    for term in terms:
+        pattern = f'%{term}%'
+        query = query.filter(db.or_(
+            Perfume.name.ilike(pattern),
+            Perfume.notes.ilike(pattern),
+            Perfume.description.ilike(pattern),
+        ))
+    return [row.id for row in query.order_by(Perfume.created_at.desc()).limit(limit)]
+
+
+def search_perfumes(spec):
+    """Return perfume dicts for a parsed spec, best match first"""
+    ids = _ranked_ids(spec['terms'], spec['limit'])
+    if not ids:
+        return []
+    # Same fields as catalog listings, so the shop renders hits and rows alike
+    return catalog.perfumes_by_id(ids)
@@ -1,10 +1,24 @@
 """
 Database Seed Script for Maison Écorce
 Run this script to populate the database with sample perfumes
+
+    python seed.py                                  # the six sample perfumes
+    python seed.py --perfumes 5000 --orders 50000   # generated data for load tests
+
+Generated data is deterministic for a given --seed, so benchmark runs on
+different commits see the same catalog and order history.
 """
 
+import argparse
+import random
+from datetime import datetime, timedelta
+
 from app import app, db
-from models import Perfume
+from models import Perfume, Order
+from notes import sync_perfume_notes, backfill_notes
+import orders
+import sales
+import order_items
 
 # Sample perfume data with high-quality images
 SAMPLE_PERFUMES = [
@@ -82,9 +96,95 @@ def seed_database():
                 cloudinary_url=data["cloudinary_url"]
             )
             db.session.add(perfume)
+            sync_perfume_notes(perfume)
+        sales.adjust_perfume_count(len(SAMPLE_PERFUMES))
         
         db.session.commit()
         print(f"Successfully added {len(SAMPLE_PERFUMES)} perfumes!")
 
+NAME_WORDS = ['Ambre', 'Bois', 'Ciel', 'Dune', 'Écume', 'Fleur', 'Givre', 'Lune', 'Mousse', 'Nuit',
+              'Oud', 'Pluie', 'Rose', 'Sable', 'Soie', 'Terre', 'Vent', 'Velours', 'Figue', 'Cuir']
+NOTE_POOL = sorted({note.strip() for data in SAMPLE_PERFUMES for note in data["notes"].split(",")})
+SIZES = ["30ml", "50ml", "100ml"]
+STATUSES = ["confirmed"] * 6 + ["shipped"] * 2 + ["delivered", "pending"]
+BATCH_SIZE = 1000
+
+
+def generate_perfumes(count, rng):
+    """Insert `count` generated perfumes in batches; notes are linked once at the end"""
+    now = datetime.utcnow()
+    for start in range(0, count, BATCH_SIZE):
+        rows = []
+        for i in range(start, min(start + BATCH_SIZE, count)):
+            sample = SAMPLE_PERFUMES[i % len(SAMPLE_PERFUMES)]
+            price = rng.randrange(15000, 90000, 500)
+            rows.append({
+                "name": f"{rng.choice(NAME_WORDS)} {rng.choice(NAME_WORDS)} No. {i + 1}",
+                "description": sample["description"],
+                "price": price,
+                "compare_at_price": price + rng.randrange(5000, 20000, 500) if rng.random() < 0.2 else None,
+                "size": rng.choice(SIZES),
+                "notes": ", ".join(rng.sample(NOTE_POOL, rng.randint(3, 6))),
+                "cloudinary_url": sample["cloudinary_url"],
+                "created_at": now - timedelta(minutes=count - i),
+            })
+        db.session.execute(db.insert(Perfume), rows)
+        sales.adjust_perfume_count(len(rows))
+        db.session.commit()
+    backfill_notes()
+
+
+def generate_orders(count, rng, days=180):
+    """Insert `count` orders spread over the last `days` days, then rebuild the aggregates and line items"""
+    catalog = db.session.query(Perfume.id, Perfume.name, Perfume.price, Perfume.cloudinary_url).all()
+    if not catalog:
+        raise SystemExit("Generate perfumes before orders")
+    now = datetime.utcnow()
+    for start in range(0, count, BATCH_SIZE):
+        rows = []
+        for i in range(start, min(start + BATCH_SIZE, count)):
+            items = [
+                {"id": p.id, "name": p.name, "price": p.price, "image": p.cloudinary_url,
+                 "quantity": rng.randint(1, 3)}
+                for p in rng.sample(catalog, min(len(catalog), rng.randint(1, 4)))
+            ]
+            customer_info = {"name": f"Customer {i % 5000}", "email": f"customer{i % 5000}@example.com",
+                             "phone": "0240000000", "address": "1 Oxford Street", "city": "Accra"}
+            rows.append({
+                "customer_info_json": customer_info,
+                "items_json": items,
+                **orders.summary_values(customer_info, items),
+                "total_price": sum(item["price"] * item["quantity"] for item in items),
+                "payment_ref": f"seed-{i:08d}",
+                "status": rng.choice(STATUSES),
+                "created_at": now - timedelta(seconds=rng.randrange(days * 86400)),
+            })
+        db.session.execute(db.insert(Order), rows)
+        db.session.commit()
+    sales.rebuild()
+    order_items.rebuild()
+
+
+def generate(perfumes=0, order_count=0, seed=42):
+    """Add generated perfumes and orders; returns (perfumes, orders) in the database afterwards"""
+    rng = random.Random(seed)
+    with app.app_context():
+        if perfumes:
+            generate_perfumes(perfumes, rng)
+        if order_count:
+            generate_orders(order_count, rng)
+        return Perfume.query.count(), Order.query.count()
+
+
 if __name__ == "__main__":
-    seed_database()
+    parser = argparse.ArgumentParser(description="Seed the database")
+    parser.add_argument("--perfumes", type=int, default=0, help="Generated perfumes to add")
+    parser.add_argument("--orders", type=int, default=0, help="Generated orders to add")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for generated data")
+    args = parser.parse_args()
+
+    if args.perfumes or args.orders:
+        perfume_total, order_total = generate(args.perfumes, args.orders, args.seed)
+        print(f"Database now has {perfume_total} perfumes and {order_total} orders")
+    else:
+        seed_database()
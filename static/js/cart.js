@@ -1,22 +1,57 @@
 /**
  * Cart Management - Maison Écorce
- * Session-based cart with API integration
+ * Server-side cart synced through /api/cart/batch
  */
 
+// Last cart the server sent, keyed by item id, with its ETag (cart version)
+const cartState = loadCartState();
+
 // Initialize cart count on page load
 document.addEventListener('DOMContentLoaded', function () {
     initCartCount();
 });
 
+function loadCartState() {
+    try {
+        const saved = JSON.parse(sessionStorage.getItem('cart'));
+        if (saved && saved.etag) {
+            return { etag: saved.etag, items: new Map(saved.items.map(item => [item.id, item])) };
+        }
+    } catch (error) {
+        // Unavailable or corrupt storage: start empty and let the server fill it in
+    }
+    return { etag: null, items: new Map() };
+}
+
+/**
+ * Replace the local cart with what the server sent and update the header badge
+ */
+function setCartState(items, etag) {
+    cartState.items = new Map(items.map(item => [item.id, item]));
+    cartState.etag = etag;
+    try {
+        sessionStorage.setItem('cart', JSON.stringify({ etag, items }));
+    } catch (error) {
+        // Private browsing can refuse storage; the in-memory state still works
+    }
+    updateCartCount(cartItemCount());
+    return cartItems();
+}
+
+function cartItems() {
+    return Array.from(cartState.items.values());
+}
+
+function cartItemCount() {
+    return cartItems().reduce((sum, item) => sum + item.quantity, 0);
+}
+
 /**
  * Fetch cart and update count in header
  */
 async function initCartCount() {
     try {
-        const response = await fetch('/api/cart');
-        const cart = await response.json();
-        const count = cart.reduce((sum, item) => sum + item.quantity, 0);
-        updateCartCount(count);
+        await getCart();
     } catch (error) {
         console.error('Failed to load cart:', error);
     }
@@ -34,29 +69,53 @@ function updateCartCount(count) {
     }
 }
 
+/**
+ * Apply a list of cart operations in one request, e.g.
+ * [{op: 'add', id, name, price, image, quantity}, {op: 'set', id, quantity}, {op: 'remove', id}, {op: 'clear'}]
+ *
+ * The request is conditional on the cart version we last saw. If another tab
+ * changed the cart, the server answers 412 with the current cart and the
+ * operations are sent once more against it.
+ */
+async function updateCart(ops, retried = false) {
+    const headers = { 'Content-Type': 'application/json' };
+    if (cartState.etag) {
+        headers['If-Match'] = cartState.etag;
+    }
+
+    const response = await fetch('/api/cart/batch', {
+        method: 'POST',
+        headers,
+        body: JSON.stringify({ ops })
+    });
+    const data = await response.json();
+
+    if (response.status === 412 && !retried) {
+        setCartState(data.cart, response.headers.get('ETag'));
+        return updateCart(ops, true);
+    }
+    if (!response.ok) {
+        throw new Error(data.error || 'Cart update failed');
+    }
+    return setCartState(data.cart, response.headers.get('ETag'));
+}
+
 /**
  * Add item to cart
  */
-async function addToCart(product) {
+async function addToCart(product, quantity = 1) {
     try {
-        const response = await fetch('/api/cart/add', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                id: product.id,
-                name: product.name,
-                price: product.price,
-                image: product.cloudinary_url,
-                quantity: 1
-            })
-        });
-
-        const data = await response.json();
-        const count = data.cart.reduce((sum, item) => sum + item.quantity, 0);
-        updateCartCount(count);
+        const cart = await updateCart([{
+            op: 'add',
+            id: product.id,
+            name: product.name,
+            price: product.price,
+            image: product.cloudinary_url,
+            quantity
+        }]);
         showToast(`${product.name} added to cart`, 'success');
 
-        return data;
+        return cart;
     } catch (error) {
         showToast('Failed to add item to cart', 'error');
         throw error;
@@ -68,17 +127,7 @@ async function addToCart(product) {
  */
 async function updateCartItem(id, quantity) {
     try {
-        const response = await fetch('/api/cart/update', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ id, quantity })
-        });
-
-        const data = await response.json();
-        const count = data.cart.reduce((sum, item) => sum + item.quantity, 0);
-        updateCartCount(count);
-
-        return data;
+        return await updateCart([{ op: 'set', id, quantity }]);
     } catch (error) {
         showToast('Failed to update cart', 'error');
         throw error;
@@ -90,17 +139,7 @@ async function updateCartItem(id, quantity) {
  */
 async function removeFromCart(id) {
     try {
-        const response = await fetch('/api/cart/remove', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ id })
-        });
-
-        const data = await response.json();
-        const count = data.cart.reduce((sum, item) => sum + item.quantity, 0);
-        updateCartCount(count);
-
-        return data;
+        return await updateCart([{ op: 'remove', id }]);
     } catch (error) {
         showToast('Failed to remove item', 'error');
         throw error;
@@ -112,15 +151,7 @@ async function removeFromCart(id) {
  */
 async function clearCart() {
     try {
-        const response = await fetch('/api/cart/clear', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' }
-        });
-
-        const data = await response.json();
-        updateCartCount(0);
-
-        return data;
+        return await updateCart([{ op: 'clear' }]);
     } catch (error) {
         showToast('Failed to clear cart', 'error');
         throw error;
@@ -128,12 +159,17 @@ async function clearCart() {
 }
 
 /**
- * Get current cart
+ * Get current cart; an unchanged cart is answered with 304 and served from memory
  */
 async function getCart() {
     try {
-        const response = await fetch('/api/cart');
-        return await response.json();
+        const headers = cartState.etag ? { 'If-None-Match': cartState.etag } : {};
+        const response = await fetch('/api/cart', { headers });
+        if (response.status === 304) {
+            updateCartCount(cartItemCount());
+            return cartItems();
+        }
+        return setCartState(await response.json(), response.headers.get('ETag'));
     } catch (error) {
         console.error('Failed to get cart:', error);
         return [];
@@ -89,6 +89,30 @@ function serializeForm(form) {
 }
 
 
+// ============ Responsive Images ============
+/**
+ * Markup for a product image, offering the upload's width variants when it has them
+ * @param {object} product - Needs name and cloudinary_url; image_srcset maps MIME type to srcset
+ * @param {string} sizes - The sizes attribute, e.g. '(max-width: 768px) 50vw, 25vw'
+ * @param {string} attrs - Extra attributes for the <img>
+ */
+function productImage(product, sizes, attrs = '') {
+    const srcsets = product.image_srcset;
+    if (!srcsets) {
+        return `<img src="${product.cloudinary_url}" alt="${product.name}" ${attrs}>`;
+    }
+
+    // AVIF, then WebP, for browsers that support them; the upload's own format otherwise
+    const modern = ['image/avif', 'image/webp'].filter(type => srcsets[type]);
+    const fallback = Object.keys(srcsets).find(type => !modern.includes(type)) || modern[modern.length - 1];
+    const sources = modern
+        .filter(type => type !== fallback)
+        .map(type => `<source type="${type}" srcset="${srcsets[type]}" sizes="${sizes}">`)
+        .join('');
+
+    return `<picture>${sources}<img src="${product.cloudinary_url}" srcset="${srcsets[fallback]}" sizes="${sizes}" alt="${product.name}" ${attrs}></picture>`;
+}
+
 // ============ Currency Formatting ============
 /**
  * Format number as Ghanaian Cedi
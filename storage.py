@@ -0,0 +1,276 @@
+"""
+Upload storage: content-addressed blobs with reference counts
+
+Uploads are keyed by the SHA-256 of their bytes, hashed while the request
+stream is read, so the same photo is stored once however often it is
+uploaded. Records that point at an upload (Perfume.cloudinary_url,
+SiteSettings.hero_image / story_image) hold a reference in the
+image_blobs table; replacing or deleting them only releases it. Files are
+removed later by `flask gc-uploads`, which also repairs counts that drifted.
+
+Backends: LocalStorage (a directory served under /static/uploads) and
+S3Storage (any S3-compatible service; fake_s3.py works for local testing).
+"""
+
+import hashlib
+import io
+import os
+import re
+from datetime import datetime, timedelta
+
+from models import db, Perfume, SiteSettings, ImageBlob
+from upsert import increment
+
+CHUNK_SIZE = 64 * 1024
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# <ab>/<64 hex digest>/..., as laid out by images.blob_prefix
+DIGEST_PATTERN = re.compile(r'(?:^|/)([0-9a-f]{2})/([0-9a-f]{64})/')
+
+
+class StorageError(Exception):
+    pass
+
+
+def read_upload(stream):
+    """(sha256 hex digest, bytes) of an upload stream, hashed chunk by chunk"""
+    digest = hashlib.sha256()
+    buffer = io.BytesIO()
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        buffer.write(chunk)
+    return digest.hexdigest(), buffer.getvalue()
+
+
+def digest_from_url(url):
+    """Blob digest for a content-addressed upload URL, None for anything else"""
+    match = DIGEST_PATTERN.search(url or '')
+    if match and match.group(2).startswith(match.group(1)):
+        return match.group(2)
+    return None
+
+
+class LocalStorage:
+    def __init__(self, root, url_prefix='/static/uploads'):
+        self.root = root
+        self.url_prefix = url_prefix.rstrip('/')
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise StorageError(f'No such blob: {key}')
+
+    def put(self, key, data, content_type=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so a reader never sees half a file
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        # Drop directories the delete left empty
+        directory = os.path.dirname(self._path(key))
+        while directory != self.root and os.path.isdir(directory) and not os.listdir(directory):
+            os.rmdir(directory)
+            directory = os.path.dirname(directory)
+
+    def url(self, key):
+        return f'{self.url_prefix}/{key}'
+
+    def list(self):
+        """(key, modified datetime) for every stored file"""
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                yield key, datetime.utcfromtimestamp(os.path.getmtime(path))
+
+
+class S3Storage:
+    def __init__(self, bucket, public_url, prefix='', endpoint_url=None, region=None):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError:
+            raise StorageError('STORAGE_BACKEND=s3 needs boto3 (pip install boto3)')
+        self.bucket = bucket
+        self.public_url = public_url.rstrip('/')
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        # Credentials come from the usual AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY variables
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region, config=Config(
+            # MinIO and most self-hosted stores only speak path-style URLs
+            s3={'addressing_style': 'path'} if endpoint_url else None,
+            request_checksum_calculation='when_required',
+            response_checksum_validation='when_required',
+        ))
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def get(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)['Body'].read()
+        except ClientError as e:
+            raise StorageError(f'No such blob: {key} ({e})')
+
+    def put(self, key, data, content_type=None):
+        extra = {'ContentType': content_type} if content_type else {}
+        # Keys never change content, so browsers and CDNs may keep them forever
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data, CacheControl=IMMUTABLE, **extra)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def url(self, key):
+        return f'{self.public_url}/{self.prefix}{key}'
+
+    def list(self):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get('Contents', []):
+                yield obj['Key'][len(self.prefix):], obj['LastModified'].replace(tzinfo=None)
+
+
+def create_storage(config):
+    if config['STORAGE_BACKEND'] == 's3':
+        return S3Storage(
+            bucket=config['S3_BUCKET'],
+            public_url=config['S3_PUBLIC_URL'],
+            prefix=config['S3_PREFIX'],
+            endpoint_url=config['S3_ENDPOINT_URL'],
+            region=config['S3_REGION'],
+        )
+    return LocalStorage(config['UPLOAD_FOLDER'])
+
+
+# ---- Reference counting (callers commit, in the same transaction as the record change) ----
+
+def acquire(url):
+    digest = digest_from_url(url)
+    if digest:
+        increment(ImageBlob, {'digest': digest}, {'refcount': 1})
+
+
+def release(url):
+    digest = digest_from_url(url)
+    if digest:
+        increment(ImageBlob, {'digest': digest}, {'refcount': -1}, values={'released_at': datetime.utcnow()})
+
+
+def referenced_urls():
+    """Every upload URL currently stored on a record"""
+    for (url,) in db.session.query(Perfume.cloudinary_url):
+        yield url
+    for hero_image, story_image in db.session.query(SiteSettings.hero_image, SiteSettings.story_image):
+        yield hero_image
+        yield story_image
+
+
+def recount():
+    """Set every blob's refcount from the records that point at it; caller commits.
+    Returns ({digest: references}, number of rows changed)."""
+    counts = {}
+    for url in referenced_urls():
+        digest = digest_from_url(url)
+        if digest:
+            counts[digest] = counts.get(digest, 0) + 1
+
+    changed = 0
+    blobs = {blob.digest: blob for blob in ImageBlob.query.all()}
+    for digest, blob in blobs.items():
+        if blob.refcount != counts.get(digest, 0):
+            blob.refcount = counts.get(digest, 0)
+            changed += 1
+    for digest in counts.keys() - blobs.keys():
+        db.session.add(ImageBlob(digest=digest, refcount=counts[digest]))
+        changed += 1
+    return counts, changed
+
+
+def needs_recount():
+    # Uploads made before reference counting existed
+    return (db.session.query(ImageBlob.digest).first() is None
+            and db.session.query(Perfume.id).filter(Perfume.image_variants.isnot(None)).first() is not None)
+
+
+def collect_garbage(storage, grace_seconds=3600, dry_run=False):
+    """Recount references, then delete unreferenced blobs older than the grace period.
+
+    The grace period covers uploads whose record hasn't been committed yet.
+    Returns {'recounted', 'deleted_blobs', 'deleted_files'}.
+    """
+    counts, recounted = recount()
+    if dry_run:
+        db.session.rollback()
+    else:
+        db.session.commit()
+    blobs = {blob.digest: blob for blob in ImageBlob.query.all()}
+
+    base_url = storage.url('')
+    legacy_keys = {url[len(base_url):] for url in referenced_urls()
+                   if url and url.startswith(base_url) and not digest_from_url(url)}
+
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    doomed = {}
+    for key, modified in storage.list():
+        match = DIGEST_PATTERN.match(key)
+        if match:
+            digest = match.group(2)
+            if counts.get(digest):
+                continue
+            blob = blobs.get(digest)
+            last_used = max(filter(None, [modified, blob and blob.released_at, blob and blob.created_at]))
+            doomed.setdefault(digest, []).append((key, last_used))
+        elif key not in legacy_keys and not key.endswith('.tmp') and not key.rpartition('/')[2].startswith('.'):
+            # Pre-content-addressing upload (uuid name) that nothing points at any more
+            doomed.setdefault(key, []).append((key, modified))
+
+    deleted_blobs = deleted_files = 0
+    for name, files in doomed.items():
+        # A blob is only deleted as a whole, once every one of its files is past the grace period
+        if any(last_used > cutoff for _, last_used in files):
+            continue
+        if name in blobs:
+            # Re-read: an upload of the same image may have taken a reference since the recount
+            db.session.refresh(blobs[name])
+            if blobs[name].refcount > 0:
+                continue
+        deleted_blobs += 1
+        deleted_files += len(files)
+        if dry_run:
+            continue
+        # Manifest first: without it the pipeline re-creates the set on the next upload
+        for key, _ in sorted(files, key=lambda f: not f[0].endswith('manifest.json')):
+            storage.delete(key)
+        if name in blobs:
+            db.session.query(ImageBlob).filter(ImageBlob.digest == name, ImageBlob.refcount <= 0).delete()
+    if not dry_run:
+        db.session.commit()
+
+    return {'recounted': recounted, 'deleted_blobs': deleted_blobs, 'deleted_files': deleted_files}
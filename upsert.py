@@ -0,0 +1,42 @@
+"""
+Dialect-aware INSERT ... ON CONFLICT helpers for SQLite and PostgreSQL
+"""
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db
+
+UPSERT_DIALECTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+
+def upsert_insert():
+    """The insert() construct supporting on_conflict_* for the session's database, or None"""
+    return UPSERT_DIALECTS.get(db.session.get_bind().dialect.name)
+
+
+def increment(model, keys, deltas, values=None):
+    """Add `deltas` to the counter row identified by `keys`, creating it if missing.
+
+    `values` are plain columns written on insert and overwritten on conflict.
+    Caller commits.
+    """
+    values = values or {}
+    insert = upsert_insert()
+    if insert is not None:
+        stmt = insert(model).values(**keys, **deltas, **values)
+        updates = {name: getattr(model, name) + stmt.excluded[name] for name in deltas}
+        updates.update({name: stmt.excluded[name] for name in values})
+        db.session.execute(stmt.on_conflict_do_update(index_elements=list(keys), set_=updates))
+        return
+
+    criteria = [getattr(model, name) == value for name, value in keys.items()]
+    updates = {name: getattr(model, name) + delta for name, delta in deltas.items()}
+    updates.update(values)
+    result = db.session.execute(
+        db.update(model).where(*criteria).values(**updates).execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db.session.execute(db.insert(model).values(**keys, **deltas, **values))
@@ -0,0 +1,216 @@
+"""
+Durable ingestion queue for Paystack webhooks
+
+The webhook endpoint only verifies the signature and stores the event in
+webhook_events. Worker threads (in the web process, or a dedicated
+`flask webhooks-work` process) claim events in batches and create their
+orders with one upsert per batch. Events that keep failing are retried
+with backoff, then parked as 'dead' until replayed.
+"""
+
+import threading
+import traceback
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, WebhookEvent
+import orders
+
+
+def enqueue(payload):
+    """Store a verified webhook payload. Returns False if it was already queued."""
+    data = payload.get('data') or {}
+    event = WebhookEvent(
+        event=payload.get('event') or 'unknown',
+        reference=data.get('reference'),
+        payload=payload,
+        status='pending',
+    )
+    db.session.add(event)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    return True
+
+
+def claim_batch(batch_size):
+    """Atomically mark up to batch_size due events as processing by this caller"""
+    token = uuid.uuid4().hex
+    now = datetime.utcnow()
+    due = (
+        db.select(WebhookEvent.id)
+        .where(WebhookEvent.status == 'pending', WebhookEvent.available_at <= now)
+        .order_by(WebhookEvent.id)
+        .limit(batch_size)
+    )
+    # Re-checking status makes concurrent claimers skip rows another worker took
+    db.session.execute(
+        update(WebhookEvent)
+        .where(WebhookEvent.id.in_(due), WebhookEvent.status == 'pending')
+        .values(status='processing', claim_token=token, claimed_at=now,
+                attempts=WebhookEvent.attempts + 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return WebhookEvent.query.filter_by(claim_token=token).order_by(WebhookEvent.id).all()
+
+
+def release_stale_claims(visibility_timeout):
+    """Return events whose worker died mid-batch to the queue"""
+    cutoff = datetime.utcnow() - timedelta(seconds=visibility_timeout)
+    result = db.session.execute(
+        update(WebhookEvent)
+        .where(WebhookEvent.status == 'processing', WebhookEvent.claimed_at < cutoff)
+        .values(status='pending', claim_token=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def _apply(events):
+    """Create orders for charge.success events and mark the batch done; caller commits"""
+    rows = {}
+    for event in events:
+        if event.event == 'charge.success' and event.reference:
+            rows.setdefault(event.reference, orders.order_values(event.payload['data']))
+    orders.finalize_orders(list(rows.values()))
+
+    now = datetime.utcnow()
+    for event in events:
+        event.status = 'done'
+        event.processed_at = now
+        event.claim_token = None
+
+
+def _fail(event_id, error, max_attempts):
+    event = db.session.get(WebhookEvent, event_id)
+    event.last_error = error[-2000:]
+    event.claim_token = None
+    if event.attempts >= max_attempts:
+        event.status = 'dead'
+    else:
+        event.status = 'pending'
+        # Exponential backoff capped at an hour
+        event.available_at = datetime.utcnow() + timedelta(seconds=min(2 ** event.attempts, 3600))
+    db.session.commit()
+
+
+def process_batch(batch_size=50, max_attempts=8):
+    """Claim and process one batch. Returns the number of events claimed."""
+    events = claim_batch(batch_size)
+    if not events:
+        return 0
+
+    try:
+        _apply(events)
+        db.session.commit()
+        return len(events)
+    except Exception:
+        db.session.rollback()
+
+    # Something in the batch failed: retry one at a time to isolate it
+    for event_id in [e.id for e in events]:
+        event = db.session.get(WebhookEvent, event_id)
+        try:
+            _apply([event])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            _fail(event_id, traceback.format_exc(), max_attempts)
+    return len(events)
+
+
+def replay(ids=None, status='dead'):
+    """Put dead (or the given) events back on the queue. Returns how many."""
+    query = update(WebhookEvent)
+    if ids:
+        query = query.where(WebhookEvent.id.in_(ids))
+    else:
+        query = query.where(WebhookEvent.status == status)
+    result = db.session.execute(
+        query.values(status='pending', attempts=0, available_at=datetime.utcnow(), claim_token=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def queue_depth():
+    counts = dict(db.session.query(WebhookEvent.status, func.count()).group_by(WebhookEvent.status).all())
+    oldest = db.session.query(func.min(WebhookEvent.created_at)).filter(WebhookEvent.status == 'pending').scalar()
+    return {
+        'pending': counts.get('pending', 0),
+        'processing': counts.get('processing', 0),
+        'done': counts.get('done', 0),
+        'dead': counts.get('dead', 0),
+        'oldest_pending_seconds': (datetime.utcnow() - oldest).total_seconds() if oldest else 0,
+    }
+
+
+class WebhookWorkerPool:
+    """Background threads draining the queue; wake() skips the poll delay after an enqueue"""
+
+    def __init__(self, app, threads=2, batch_size=50, max_attempts=8,
+                 poll_interval=1.0, visibility_timeout=300):
+        self.app = app
+        self.threads = threads
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._workers = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, app, threads=None):
+        config = app.config
+        return cls(
+            app,
+            threads=config['WEBHOOK_WORKER_THREADS'] if threads is None else threads,
+            batch_size=config['WEBHOOK_BATCH_SIZE'],
+            max_attempts=config['WEBHOOK_MAX_ATTEMPTS'],
+            poll_interval=config['WEBHOOK_POLL_INTERVAL'],
+            visibility_timeout=config['WEBHOOK_VISIBILITY_TIMEOUT'],
+        )
+
+    def start(self):
+        with self._lock:
+            if self._workers or self.threads <= 0:
+                return
+            for i in range(self.threads):
+                worker = threading.Thread(target=self._run, name=f'webhook-worker-{i}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def wake(self):
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+        for worker in self._workers:
+            worker.join()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            processed = 0
+            with self.app.app_context():
+                try:
+                    release_stale_claims(self.visibility_timeout)
+                    processed = process_batch(self.batch_size, self.max_attempts)
+                except Exception:
+                    db.session.rollback()
+                    traceback.print_exc()
+                finally:
+                    db.session.remove()
+            if not processed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()